@@ -1,49 +1,38 @@
-from passlib.context import CryptContext
-from datetime import datetime, timedelta
-from jose import jwt
+from dataclasses import dataclass
+from datetime import timedelta
 from fastapi import status, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import Optional, Union
+from typing import Optional, Union, Dict, Tuple
 from uuid import UUID
+import os
+import threading
+import time
 from database import get_db
 from models import User, UserRole, Admin, ServiceProvider, HomeOwner
+from passwords import (
+    hash_password,
+    verify_password,
+    verify_and_update,
+    hash_password_async,
+    verify_password_async,
+    verify_and_update_async,
+)
+from tokens import (
+    REVOCATION_READY_TIMEOUT, TokenClaims, create_token, decode_token, revocations, revoke_user_tokens, user_claims,
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="signin")
 
-SECRET_KEY = "mysecret"
-ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days in minutes
 ADMIN_TOKEN_EXPIRE_MINUTES = 8 * 60  # 8 hours for admins
 SUPER_ADMIN_TOKEN_EXPIRE_MINUTES = 24 * 60  # 24 hours for super admins
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def hash_password(password: str):
-    return pwd_context.hash(password)
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    
-    # Convert UUIDs to strings
-    for key, value in to_encode.items():
-        if isinstance(value, UUID):
-            to_encode[key] = str(value)
-    
-    # Set expiration time
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return create_token(data, expires_delta)
 
-def create_admin_token(email: str, user_id: UUID, is_super_admin: bool):
+def create_admin_token(email: str, user_id: UUID, is_super_admin: bool, version: int = 0):
     if is_super_admin:
         expires_delta = timedelta(minutes=SUPER_ADMIN_TOKEN_EXPIRE_MINUTES)
     else:
@@ -54,137 +43,184 @@ def create_admin_token(email: str, user_id: UUID, is_super_admin: bool):
             "sub": email,
             "user_id": user_id,
             "role": UserRole.ADMIN.value,
-            "is_super_admin": is_super_admin
+            "is_super_admin": is_super_admin,
+            "ver": version
         },
         expires_delta=expires_delta
     )
 
-async def get_current_admin_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        
-        # Check token expiration
-        expire = payload.get("exp")
-        if expire is None or datetime.utcnow() > datetime.fromtimestamp(expire):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token expired"
-            )
-        
-        # Verify admin role
-        role: str = payload.get("role")
-        if role != UserRole.ADMIN.value:
+async def get_token_claims(token: str = Depends(oauth2_scheme)) -> TokenClaims:
+    """Verified token claims, without any database query"""
+    if not revocations.ready.is_set():
+        # Until the worker's first revocation load, wait for it off the event loop
+        revocations.refresh_if_stale()
+        await run_in_threadpool(revocations.ready.wait, REVOCATION_READY_TIMEOUT)
+    return decode_token(token)
+
+def require_roles(*roles: str):
+    """Claims-only authorization for endpoints that don't need the user row"""
+    async def dependency(claims: TokenClaims = Depends(get_token_claims)) -> TokenClaims:
+        if claims.is_pending or claims.role not in roles:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
-                detail="Admin access required"
+                detail="Not authorized to access this endpoint"
             )
-        
-    except JWTError as e:
+        return claims
+    return dependency
+
+require_admin = require_roles(UserRole.ADMIN.value)
+
+async def get_current_admin_user(
+    claims: TokenClaims = Depends(get_token_claims),
+    db: Session = Depends(get_db)
+) -> User:
+    # Verify admin role
+    if claims.role != UserRole.ADMIN.value:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Invalid token: {str(e)}"
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
         )
     
-    user = db.query(User).filter(User.email == email).first()
+    user = db.query(User).filter(User.email == claims.sub).first()
     if user is None or user.role != UserRole.ADMIN.value:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
     return user
 
 async def get_current_super_admin(
-    token: str = Depends(oauth2_scheme),
+    claims: TokenClaims = Depends(get_token_claims),
+    user: User = Depends(get_current_admin_user),
     db: Session = Depends(get_db)
 ) -> User:
-    try:
-        # First get the current admin user
-        user = await get_current_admin_user(token, db)
-        
-        # Then verify super admin status from token first
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        token_is_super = payload.get("is_super_admin", False)
-        
-        if not token_is_super:
-            # Fallback to database check if token doesn't have the claim
-            admin = db.query(Admin).filter(Admin.user_id == user.id).first()
-            if not admin or not admin.is_super_admin:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail="Super admin privileges required"
-                )
-        return user
-        
-    except JWTError as e:
+    if not claims.is_super_admin:
+        # Fallback to database check if token doesn't have the claim
+        admin = db.query(Admin).filter(Admin.user_id == user.id).first()
+        if not admin or not admin.is_super_admin:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="Super admin privileges required"
+            )
+    return user
+
+async def get_current_user(
+    claims: TokenClaims = Depends(get_token_claims),
+    db: Session = Depends(get_db)
+) -> User:
+    user = db.query(User).filter(User.email == claims.sub).first()
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Invalid token: {str(e)}"
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
         )
-    except Exception as e:
+        
+    # Check if user is active
+    if not user.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
-            detail=f"Super admin validation failed: {str(e)}"
+            detail="User account is inactive"
         )
+        
+    return user
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme), 
+@dataclass(frozen=True)
+class Principal:
+    """Authenticated user plus the role-specific ids handlers usually look up"""
+    id: UUID
+    email: str
+    full_name: str
+    role: str
+    is_active: bool
+    profile_image: Optional[str] = None
+    provider_id: Optional[UUID] = None
+    homeowner_id: Optional[UUID] = None
+    is_super_admin: bool = False
+
+
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))  # seconds
+
+# user id (str) -> (expires_at, Principal)
+_principal_cache: Dict[str, Tuple[float, Principal]] = {}
+_principal_lock = threading.Lock()
+
+
+def invalidate_principal(user_id) -> None:
+    """Drop a cached principal after profile, role or suspension changes"""
+    with _principal_lock:
+        _principal_cache.pop(str(user_id), None)
+
+
+def load_principal(db: Session, user_filter) -> Optional[Principal]:
+    row = db.query(
+        User, ServiceProvider.id, HomeOwner.id, Admin.is_super_admin
+    ).outerjoin(
+        ServiceProvider, ServiceProvider.user_id == User.id
+    ).outerjoin(
+        HomeOwner, HomeOwner.user_id == User.id
+    ).outerjoin(
+        Admin, Admin.user_id == User.id
+    ).filter(user_filter).first()
+    if row is None:
+        return None
+
+    user, provider_id, homeowner_id, is_super_admin = row
+    return Principal(
+        id=user.id,
+        email=user.email,
+        full_name=user.full_name,
+        role=user.role.value if isinstance(user.role, UserRole) else user.role,
+        is_active=bool(user.is_active),
+        profile_image=user.profile_image,
+        provider_id=provider_id,
+        homeowner_id=homeowner_id,
+        is_super_admin=bool(is_super_admin),
+    )
+
+
+async def get_current_principal(
+    claims: TokenClaims = Depends(get_token_claims),
     db: Session = Depends(get_db)
-) -> User:
+) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
-    try:
-        if token.startswith('Bearer '):
-            token = token[7:]
-            
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        
-        # Check token expiration
-        expire = payload.get("exp")
-        if expire is None or datetime.utcnow() > datetime.fromtimestamp(expire):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token expired"
-            )
-            
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-            
-    except JWTError as e:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Invalid token: {str(e)}"
-        )
-        
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
+
+    email = claims.sub
+    user_id = claims.user_id
+    principal = None
+    if user_id:
+        cached = _principal_cache.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            principal = cached[1]
+        else:
+            principal = load_principal(db, User.id == user_id)
+            if principal is not None:
+                with _principal_lock:
+                    _principal_cache[user_id] = (time.monotonic() + PRINCIPAL_CACHE_TTL, principal)
+    else:
+        # Older tokens only carry the email
+        principal = load_principal(db, User.email == email)
+
+    if principal is None or principal.email != email:
         raise credentials_exception
-        
-    # Check if user is active
-    if not user.is_active:
+
+    if not principal.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="User account is inactive"
         )
-        
-    return user
+
+    return principal
+
 
 async def get_current_user_for_messaging(
-    token: str = Depends(oauth2_scheme),
+    claims: TokenClaims = Depends(get_token_claims),
     db: Session = Depends(get_db)
 ):
-    return await get_current_user(token, db)
+    return await get_current_user(claims, db)
@@ -0,0 +1,83 @@
+"""Image variant throughput benchmark
+
+Generates synthetic photos, runs the variant pipeline over them with 1..N
+worker processes and reports images per second overall and per core.
+
+    python -m benchmarks.image_variants --images 40 --size 3000x2000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from images import VARIANTS, generate_variants, variant_path
+
+
+def make_images(directory, count, width, height):
+    paths = []
+    for i in range(count):
+        # Noise plus a gradient compresses roughly like a real photo
+        noise = Image.effect_noise((width, height), 40 + i % 20).convert("RGB")
+        gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+        path = os.path.join(directory, f"{i:064d}.jpg")
+        Image.blend(noise, gradient, 0.5).save(path, "JPEG", quality=90)
+        paths.append(path)
+    return paths
+
+
+def clear_variants(paths):
+    for path in paths:
+        for name in VARIANTS:
+            target = variant_path(path, name)
+            if os.path.exists(target):
+                os.remove(target)
+
+
+def run(paths, workers):
+    clear_variants(paths)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        per_image = [seconds for _, seconds in pool.map(generate_variants, paths)]
+    elapsed = time.perf_counter() - start
+    return {
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "images_per_s": round(len(paths) / elapsed, 2),
+        "images_per_s_per_core": round(len(paths) / elapsed / workers, 2),
+        "mean_ms_per_image": round(sum(per_image) / len(per_image) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=40)
+    parser.add_argument("--size", default="3000x2000")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split("x"))
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_images(directory, args.images, width, height)
+        source_bytes = sum(os.path.getsize(p) for p in paths)
+        counts = sorted({1, 2, 4, args.max_workers} & set(range(1, args.max_workers + 1)))
+        results = [run(paths, workers) for workers in counts]
+        variant_bytes = {
+            name: sum(os.path.getsize(variant_path(p, name)) for p in paths) // len(paths)
+            for name in VARIANTS
+        }
+
+    print(json.dumps({
+        "images": args.images,
+        "size": args.size,
+        "mean_source_bytes": source_bytes // len(paths),
+        "mean_variant_bytes": variant_bytes,
+        "runs": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
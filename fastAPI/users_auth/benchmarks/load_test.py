@@ -0,0 +1,260 @@
+"""Whole-API load test against a seeded database
+
+Virtual users sign in as the accounts in the seed manifest and loop through
+weighted tasks the way the web app uses the API: homeowners browse and
+search the catalog, read reviews, check availability, book, message and
+poll their dashboard; providers poll bookings, stats, reviews and chats.
+Latency is recorded per endpoint (path template, not per id) and written
+as JSON, so a run before and after a change can be compared with
+--baseline.
+
+    python -m benchmarks.seed_data --truncate
+    uvicorn main:app --workers 4
+    python -m benchmarks.load_test --users 100 --duration 120 --output after.json --baseline before.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import httpx
+
+from benchmarks.login_storm import percentiles
+from benchmarks.recommendation_bench import AREAS, TRADES
+
+PROVIDER_SHARE = 0.2  # of virtual users
+SEARCH_TERMS = [word for words in TRADES.values() for word in words]
+MESSAGES = ["Are you free tomorrow?", "What would it cost?", "Thanks, see you then.", "Running 10 minutes late."]
+
+
+class Stats:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, name, seconds, status):
+        self.samples[name].append(seconds)
+        self.statuses[name][status] += 1
+
+
+class VirtualUser:
+    def __init__(self, client, stats, manifest, args, rng):
+        self.client = client
+        self.stats = stats
+        self.manifest = manifest
+        self.args = args
+        self.rng = rng
+        self.provider = rng.random() < PROVIDER_SHARE and bool(manifest["providers"])
+        self.role = "serviceproviders" if self.provider else "homeowners"
+        self.account = rng.choice(manifest["providers" if self.provider else "homeowners"])
+        self.headers = {}
+
+    async def call(self, name, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, headers=self.headers, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.stats.record(name, time.perf_counter() - start, status)
+        return response
+
+    async def signin(self):
+        response = await self.call("POST /signin/", "POST", "/signin/", data={
+            "email": self.account["email"], "password": self.manifest["password"], "role": self.role,
+        })
+        if response is not None and response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            return True
+        return False
+
+    def service_id(self):
+        return self.rng.choice(self.manifest["services"])
+
+    def contact_id(self):
+        return self.rng.choice(self.manifest["homeowners" if self.provider else "providers"])["user_id"]
+
+    # Homeowner tasks
+
+    async def browse(self):
+        params = {"limit": 20, "sort": self.rng.choice(["newest", "rating", "price_asc"])}
+        if self.rng.random() < 0.5:
+            params["category"] = self.rng.choice(list(TRADES))
+        if self.rng.random() < 0.3:
+            params["location"] = self.rng.choice(AREAS)
+        for _ in range(self.rng.randint(1, 3)):  # scroll a page or two
+            response = await self.call("GET /services/", "GET", "/services/", params=params)
+            cursor = response is not None and response.headers.get("x-next-cursor")
+            if not cursor:
+                break
+            params["cursor"] = cursor
+
+    async def search(self):
+        await self.call("GET /services/search", "GET", "/services/search",
+                        params={"q": self.rng.choice(SEARCH_TERMS)})
+
+    async def reviews(self):
+        await self.call("GET /bookings/services/{service_id}/reviews", "GET",
+                        f"/bookings/services/{self.service_id()}/reviews")
+
+    async def availability(self):
+        day = date.today() + timedelta(days=self.rng.randint(1, 14))
+        await self.call("POST /bookings/availability", "POST", "/bookings/availability", json={
+            "service_id": self.service_id(), "date": day.isoformat(), "duration": 60,
+        })
+
+    async def book(self):
+        day = date.today() + timedelta(days=self.rng.randint(1, 14))
+        await self.call("POST /bookings/", "POST", "/bookings/", json={
+            "service_id": self.service_id(), "scheduled_date": day.isoformat(),
+            "scheduled_time": f"{self.rng.randint(8, 17):02d}:00",
+            "address": f"{self.rng.choice(AREAS)}, Addis Ababa", "notes": "load test",
+        })
+
+    async def my_bookings(self):
+        await self.call("GET /bookings/homeowner/", "GET", "/bookings/homeowner/")
+
+    # Shared tasks
+
+    async def send_message(self):
+        await self.call("POST /messages/send", "POST", "/messages/send", json={
+            "receiverId": self.contact_id(), "content": self.rng.choice(MESSAGES),
+        })
+
+    async def conversation(self):
+        await self.call("GET /messages/conversation/{contact_id}", "GET",
+                        f"/messages/conversation/{self.contact_id()}")
+
+    async def get(self, path):
+        await self.call(f"GET {path}", "GET", path)
+
+    # Provider tasks are plain GETs of the dashboard panels
+
+    def tasks(self):
+        """(weight, coroutine factory) pairs for this persona"""
+        if self.provider:
+            return [
+                (30, lambda: self.get("/bookings/provider/")),
+                (15, lambda: self.get("/bookings/provider/stats")),
+                (10, lambda: self.get("/reviews/provider")),
+                (10, lambda: self.get("/provider/services")),
+                (15, lambda: self.get("/messages/conversations")),
+                (20, lambda: self.get("/messages/unread-count")),
+                (5, self.conversation),
+                (5, self.send_message),
+                (5, lambda: self.get("/users/me")),
+            ]
+        return [
+            (30, self.browse),
+            (10, self.search),
+            (10, self.reviews),
+            (8, self.availability),
+            (4, self.book),
+            (10, self.my_bookings),
+            (5, self.send_message),
+            (5, self.conversation),
+            (4, lambda: self.get("/messages/contacts")),
+            (10, lambda: self.get("/messages/unread-count")),
+            (4, lambda: self.get("/users/me")),
+        ]
+
+    async def run(self, stop):
+        if not await self.signin():
+            return
+        tasks = self.tasks()
+        weights = [w for w, _ in tasks]
+        while not stop.is_set():
+            if self.rng.random() < self.args.resignin:
+                await self.signin()
+            else:
+                await self.rng.choices(tasks, weights=weights)[0][1]()
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.think) if self.args.think else 0)
+
+
+def report(stats, duration):
+    endpoints = {}
+    for name in sorted(stats.samples):
+        samples = stats.samples[name]
+        statuses = stats.statuses[name]
+        errors = sum(n for status, n in statuses.items() if not isinstance(status, int) or status >= 500)
+        endpoints[name] = {
+            **percentiles(samples),
+            "rps": round(len(samples) / duration, 2),
+            "error_rate": round(errors / len(samples), 4),
+            "statuses": {str(status): n for status, n in statuses.items()},
+        }
+    total = sum(len(s) for s in stats.samples.values())
+    return {"requests": total, "rps": round(total / duration, 2), "endpoints": endpoints}
+
+
+def compare(result, baseline):
+    """Per-endpoint change against an earlier report; negative latency deltas are improvements"""
+    deltas = {}
+    for name, now in result["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if not before:
+            continue
+        deltas[name] = {
+            key: round((now[key] - before[key]) / before[key] * 100, 1) if before[key] else None
+            for key in ("p50_ms", "p95_ms", "p99_ms", "rps")
+        }
+    return {"percent_change": deltas, "rps_change": round((result["rps"] - baseline["rps"]) / baseline["rps"] * 100, 1)
+            if baseline.get("rps") else None}
+
+
+async def run(args, manifest):
+    rng = random.Random(args.seed)
+    stats = Stats()
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.users)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        users = [VirtualUser(client, stats, manifest, args, random.Random(rng.random())) for _ in range(args.users)]
+        tasks = []
+        for user in users:
+            tasks.append(asyncio.create_task(user.run(stop)))
+            await asyncio.sleep(args.ramp / args.users)  # staggered start
+        start = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start + args.ramp
+    return {
+        "base_url": args.base_url,
+        "users": args.users,
+        "providers": sum(user.provider for user in users),
+        "duration_s": round(elapsed, 1),
+        **report(stats, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--manifest", default="seed_manifest.json", help="written by benchmarks.seed_data")
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds after ramp-up")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds to start all users")
+    parser.add_argument("--think", type=float, default=0.5, help="mean pause between tasks; 0 for closed loop")
+    parser.add_argument("--resignin", type=float, default=0.01, help="chance a task is a fresh /signin/")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the report here")
+    parser.add_argument("--baseline", help="earlier --output to compare against")
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    result = asyncio.run(run(args, manifest))
+    if args.baseline:
+        with open(args.baseline) as f:
+            result["comparison"] = compare(result, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Login-storm benchmark
+
+Fires concurrent /signin/ requests at a running server while probing a cheap
+endpoint, and compares the probe latency against an idle baseline. With the
+password hashing pool the probe latency should stay close to the baseline.
+
+    uvicorn main:app
+    python -m benchmarks.login_storm --email someone@example.com --password secret
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 2),
+    }
+
+
+async def probe(client, path, stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(path)
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(0.05)
+
+
+async def login(client, args, stop, samples, statuses):
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.post(
+            "/signin/", data={"email": args.email, "password": args.password, "role": args.role}
+        )
+        samples.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        baseline = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, args.probe_path, stop, baseline))
+        await asyncio.sleep(args.baseline_seconds)
+        stop.set()
+        await task
+
+        during, logins, statuses = [], [], {}
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(probe(client, args.probe_path, stop, during))]
+        tasks += [
+            asyncio.create_task(login(client, args, stop, logins, statuses))
+            for _ in range(args.concurrency)
+        ]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    return {
+        "probe_path": args.probe_path,
+        "concurrency": args.concurrency,
+        "probe_baseline": percentiles(baseline),
+        "probe_during_storm": percentiles(during),
+        "signin": {**percentiles(logins), "throughput_per_s": round(len(logins) / args.duration, 2)},
+        "signin_statuses": statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--role", default="homeowners")
+    parser.add_argument("--probe-path", default="/services/")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--baseline-seconds", type=float, default=5)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""rank_services scoring benchmark
+
+Scores synthetic candidate services with the previous per-service Python loop
+(full sort, then top 5) and with the vectorized NumPy scoring plus
+argpartition top-k now used by RecommendationAgent.rank_services.
+
+    python -m benchmarks.rank_bench --candidates 10000
+"""
+import argparse
+import json
+import os
+import random
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import numpy as np
+
+from geo import GEO_RADIUS_KM, haversine_km
+from features import feature_store
+from recommendation import RecommendationAgent, top_k_indices
+
+
+def make_services(count, seed=7):
+    rng = random.Random(seed)
+    services = []
+    for i in range(count):
+        located = rng.random() < 0.8
+        provider = SimpleNamespace(
+            years_experience=rng.choice([None, *range(0, 25)]),
+            latitude=8.9 + rng.random() * 0.25 if located else None,
+            longitude=38.65 + rng.random() * 0.25 if located else None,
+            address="Addis Ababa",
+        )
+        services.append(SimpleNamespace(
+            id=i, title=f"Service {i}", description="", price=rng.randint(100, 5000),
+            rating=rng.randint(0, 5), provider_name="p", image=None, provider=provider,
+        ))
+    return services
+
+
+def legacy_top_k(services, similarities, max_budget, origin, k=5):
+    """The loop rank_services used before vectorization"""
+    recommendations = []
+    for idx, service in enumerate(services):
+        score = (
+            0.8 * similarities[idx] +
+            0.2 * (service.provider.years_experience / 10.0 if service.provider.years_experience else 0.0)
+        )
+        if origin and service.provider.latitude is not None:
+            distance = haversine_km(origin[0], origin[1], service.provider.latitude, service.provider.longitude)
+            score += 0.2 * max(0.0, 1.0 - distance / GEO_RADIUS_KM)
+        if max_budget and service.price > max_budget:
+            score *= 0.5
+        recommendations.append({"service": service, "score": score})
+    recommendations.sort(key=lambda x: x["score"], reverse=True)
+    return [r["service"].id for r in recommendations[:k]]
+
+
+def vectorized_top_k(agent, services, similarities, max_budget, origin, k=5):
+    scores = agent.score_services(services, similarities, max_budget, origin)
+    return [services[i].id for i in top_k_indices(scores, k)]
+
+
+def best_of(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--candidates", type=int, default=10_000)
+    parser.add_argument("--repeats", type=int, default=7)
+    args = parser.parse_args()
+
+    services = make_services(args.candidates)
+    similarities = np.random.default_rng(7).random(args.candidates)
+    origin, max_budget = (9.02, 38.80), 2500
+    # The legacy loop predates the booking/review features; leave them out so
+    # the top-k stays comparable (the lookup itself is still timed)
+    agent = RecommendationAgent(db=None, weights={
+        name: 0.0 for name in ("quality", "completion", "cancellation", "velocity", "response")
+    })
+    feature_store.loaded_at = time.monotonic()
+
+    legacy_s, legacy_ids = best_of(lambda: legacy_top_k(services, similarities, max_budget, origin), args.repeats)
+    vector_s, vector_ids = best_of(
+        lambda: vectorized_top_k(agent, services, similarities, max_budget, origin), args.repeats
+    )
+    print(json.dumps({
+        "candidates": args.candidates,
+        "legacy_loop_ms": round(legacy_s * 1000, 2),
+        "vectorized_ms": round(vector_s * 1000, 2),
+        "speedup": round(legacy_s / vector_s, 1),
+        "same_top_k": legacy_ids == vector_ids,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""Recommendation pipeline benchmark and relevance regression suite
+
+Seeds a synthetic catalog, builds the embedding index and runs a fixed,
+labelled query set through ConversationalAgent with the LLM parameter
+extraction stubbed out. Reports p50/p95/p99 latency with the result cache
+bypassed and warm, throughput per core, peak memory, and NDCG@k / precision@k
+against the labels. Write the JSON with --output and diff it between commits.
+
+    python -m benchmarks.recommendation_bench --services 10000 --output rec_10k.json
+    python -m benchmarks.recommendation_bench --services 1000000 --workers 4
+
+Each catalog size gets its own SQLite file and index directory unless
+DATABASE_URL / EMBEDDING_DIR are set.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import resource
+import statistics
+import subprocess
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+TRADES = {
+    "plumbing": ["plumber", "pipe", "drain", "toilet", "sink", "water heater", "sewer"],
+    "electrical": ["electrician", "wiring", "socket", "lighting", "breaker", "generator"],
+    "cleaning": ["cleaning", "housekeeping", "laundry", "mopping", "disinfection"],
+    "painting": ["painter", "paint", "plastering", "wallpaper", "varnish"],
+    "carpentry": ["carpenter", "furniture", "cabinet", "door", "wardrobe"],
+    "gardening": ["gardener", "lawn", "landscaping", "hedge", "pruning"],
+    "pest control": ["fumigation", "termite", "cockroach", "rodent", "exterminator"],
+    "moving": ["movers", "relocation", "packing", "removals", "truck"],
+    "roofing": ["roofer", "roof", "gutter", "corrugated iron"],
+    "appliance repair": ["fridge", "washing machine", "oven", "dishwasher", "stove"],
+    "hvac": ["air conditioning", "ventilation", "heating", "fan"],
+}
+GENERIC = ["fast", "reliable", "certified", "affordable", "emergency", "weekend", "licensed",
+           "experienced", "residential", "commercial", "service", "repair", "install", "maintenance"]
+AREAS = ["Bole", "Kazanchis", "Piassa", "Megenagna", "CMC", "Sarbet", "Ayat", "Gerji", "Lebu"]
+PROVIDERS_PER_AREA = 5
+
+# message -> (parameters the LLM would extract, trade that counts as relevant).
+# Several use words that never appear in the catalog ("leaky tap"), so they
+# only score if synonym matching works.
+QUERY_SET = {
+    "I need a plumber": ({"job_type": "plumbing"}, "plumbing"),
+    "leaky tap in the kitchen": ({"job_type": "leaky tap"}, "plumbing"),
+    "blocked drain in Bole": ({"job_type": "blocked drain", "location": "Bole"}, "plumbing"),
+    "water heater broken, under 1500": ({"job_type": "water heater repair", "max_budget": 1500}, "plumbing"),
+    "plumbng asap": ({"job_type": "plumbng", "urgency": "immediate"}, "plumbing"),
+    "socket stopped working": ({"job_type": "socket not working"}, "electrical"),
+    "rewire my house in Kazanchis": ({"job_type": "rewiring", "location": "Kazanchis"}, "electrical"),
+    "weekly maid under 800": ({"job_type": "maid", "max_budget": 800}, "cleaning"),
+    "deep cleaning after moving out": ({"job_type": "deep cleaning"}, "cleaning"),
+    "repaint the living room walls": ({"job_type": "repaint walls"}, "painting"),
+    "fix kitchen cabinets": ({"job_type": "kitchen cabinets"}, "carpentry"),
+    "hedge trimming in Ayat": ({"job_type": "hedge trimming", "location": "Ayat"}, "gardening"),
+    "grass cutting this weekend": ({"job_type": "grass cutting", "urgency": "within_week"}, "gardening"),
+    "cockroaches everywhere": ({"job_type": "cockroach"}, "pest control"),
+    "movers for relocation": ({"job_type": "movers"}, "moving"),
+    "my roof leaks when it rains": ({"job_type": "roof leak"}, "roofing"),
+    "refrigerator not cooling": ({"job_type": "refrigerator repair"}, "appliance repair"),
+    "air conditioner service in CMC": ({"job_type": "air conditioner", "location": "CMC"}, "hvac"),
+}
+
+
+def setup_env(services):
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///./recommendation_bench_{services}.db")
+    os.environ.setdefault("EMBEDDING_DIR", f"./recommendation_bench_{services}_embeddings")
+
+
+def seed(count, batch=5000):
+    from sqlalchemy import insert
+
+    from database import Base, engine
+    from geo import geocode
+    from models import Service, ServiceProvider
+    from search import ensure_search_schema
+
+    Base.metadata.create_all(bind=engine)
+    ensure_search_schema(engine)
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        if conn.execute(Service.__table__.select().limit(1)).first():
+            return False
+        providers = []
+        for trade in TRADES:
+            for area in AREAS:
+                lat, lon = geocode(area)
+                for _ in range(PROVIDERS_PER_AREA):
+                    providers.append({
+                        "id": uuid.uuid4(), "service_name": trade, "address": f"{area}, Addis Ababa",
+                        "latitude": lat + rng.uniform(-0.01, 0.01), "longitude": lon + rng.uniform(-0.01, 0.01),
+                        "years_experience": rng.randint(0, 20), "is_verified": True,
+                    })
+        conn.execute(insert(ServiceProvider), providers)
+        for start in range(0, count, batch):
+            rows = []
+            for _ in range(min(batch, count - start)):
+                provider = rng.choice(providers)
+                words = TRADES[provider["service_name"]]
+                rows.append({
+                    "id": uuid.uuid4(),
+                    "provider_id": provider["id"],
+                    "title": f"{rng.choice(GENERIC).title()} {rng.choice(words)} {rng.choice(GENERIC)}",
+                    "description": " ".join(rng.sample(words, min(3, len(words))) + rng.choices(GENERIC, k=8)),
+                    "price": rng.randint(200, 5000),
+                    "rating": rng.randint(0, 5),
+                    "provider_name": "Bench provider",
+                    "is_active": True,
+                })
+            conn.execute(insert(Service), rows)
+    return True
+
+
+def make_agent(db):
+    from recommendation import ConversationalAgent
+
+    agent = ConversationalAgent(db)
+    # Stub for the OpenAI extraction call: the labelled parameters
+    agent.extract_parameters = lambda message: dict(QUERY_SET[message][0])
+    return agent
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(pick(0.50) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 2),
+    }
+
+
+def run_queries(agent, repeats):
+    """Latency samples and the recommendations of the last repeat, per message"""
+    samples, results = [], {}
+    for _ in range(repeats):
+        for message in QUERY_SET:
+            start = time.perf_counter()
+            _, recommendations, _ = agent.generate_response(message)
+            samples.append(time.perf_counter() - start)
+            results[message] = recommendations
+    return samples, results
+
+
+def _worker(repeats):
+    # Runs in a fresh process, uncached, so every query does the full work
+    from database import SessionLocal
+    from recommendation import recommendation_cache
+
+    recommendation_cache.ttl = 0
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        samples, _ = run_queries(make_agent(db), repeats)
+        return len(samples), time.perf_counter() - start
+    finally:
+        db.close()
+
+
+def relevance(db, results, k):
+    """NDCG@k and precision@k with binary labels: the provider offers the labelled trade"""
+    from models import Service, ServiceProvider
+
+    trade_of = {}
+    ids = {r.id for recommendations in results.values() for r in recommendations}
+    if ids:
+        trade_of = dict(
+            db.query(Service.id, ServiceProvider.service_name)
+            .join(ServiceProvider, Service.provider_id == ServiceProvider.id)
+            .filter(Service.id.in_(ids))
+        )
+    per_query = {}
+    for message, recommendations in results.items():
+        label = QUERY_SET[message][1]
+        gains = [1.0 if trade_of.get(r.id) == label else 0.0 for r in recommendations[:k]]
+        dcg = sum(g / math.log2(i + 2) for i, g in enumerate(gains))
+        # Every synthetic catalog has far more than k services per trade
+        idcg = sum(1.0 / math.log2(i + 2) for i in range(k))
+        per_query[message] = {
+            "ndcg": round(dcg / idcg, 4),
+            "precision": round(sum(gains) / k, 4),
+            "returned": len(recommendations),
+        }
+    return {
+        f"ndcg@{k}": round(statistics.mean(q["ndcg"] for q in per_query.values()), 4),
+        f"precision@{k}": round(statistics.mean(q["precision"] for q in per_query.values()), 4),
+        "per_query": per_query,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", type=int, default=10_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1, help="processes for the throughput run")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    args = parser.parse_args()
+    setup_env(args.services)
+
+    start = time.perf_counter()
+    seeded = seed(args.services)
+    seed_s = time.perf_counter() - start
+
+    import embeddings
+    from database import SessionLocal, engine
+    from models import Service
+    from recommendation import recommendation_cache
+
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        if seeded or not os.path.exists(os.path.join(embeddings.EMBEDDING_DIR, "meta.json")):
+            embeddings.build(db)
+        index_s = time.perf_counter() - start
+
+        agent = make_agent(db)
+        # First pass warms imports, the memory map and the geo/feature stores
+        run_queries(agent, 1)
+
+        recommendation_cache.ttl = 0
+        start = time.perf_counter()
+        uncached, results = run_queries(agent, args.repeats)
+        single_qps = len(uncached) / (time.perf_counter() - start)
+
+        recommendation_cache.ttl = 300
+        run_queries(agent, 1)
+        cached, _ = run_queries(agent, args.repeats)
+
+        throughput = {"workers": 1, "qps": round(single_qps, 2), "qps_per_core": round(single_qps, 2)}
+        if args.workers > 1:
+            start = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=args.workers) as pool:
+                done = sum(n for n, _ in pool.map(_worker, [args.repeats] * args.workers))
+            qps = done / (time.perf_counter() - start)
+            throughput = {"workers": args.workers, "qps": round(qps, 2), "qps_per_core": round(qps / args.workers, 2)}
+
+        result = {
+            "commit": git_commit(),
+            "dialect": engine.dialect.name,
+            "services": db.query(Service).count(),
+            "queries": len(QUERY_SET),
+            "repeats": args.repeats,
+            "seed_seconds": round(seed_s, 2) if seeded else None,
+            "index_build_seconds": round(index_s, 2),
+            "uncached": percentiles(uncached),
+            "cached": percentiles(cached),
+            "throughput": throughput,
+            # ru_maxrss is KiB on Linux
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "quality": relevance(db, results, 5),
+        }
+    finally:
+        db.close()
+
+    body = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(body + "\n")
+    print(body)
+
+
+if __name__ == "__main__":
+    main()
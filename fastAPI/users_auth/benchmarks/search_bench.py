@@ -0,0 +1,116 @@
+"""Service search latency benchmark
+
+Seeds a database with synthetic services (100k by default) and compares the
+old leading-wildcard ILIKE filter, which fetched every match for ranking in
+Python, with the ranked top-N indexed search in search.py.
+Uses DATABASE_URL, so point it at a scratch Postgres database or leave the
+default SQLite file to exercise the FTS5 fallback.
+
+    DATABASE_URL=sqlite:///./search_bench.db python -m benchmarks.search_bench --services 100000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+
+os.environ.setdefault("DATABASE_URL", "sqlite:///./search_bench.db")
+
+from sqlalchemy import insert, or_
+
+from database import Base, SessionLocal, engine
+from models import Service, ServiceProvider
+from search import ensure_search_schema, search_services
+
+TRADES = ["plumbing", "electrical", "cleaning", "painting", "carpentry", "gardening",
+          "roofing", "tiling", "moving", "appliance repair", "pest control", "welding"]
+WORDS = ["fast", "reliable", "certified", "affordable", "emergency", "leak", "pipe", "wiring",
+         "deep", "wall", "door", "kitchen", "bathroom", "garden", "roof", "install", "repair",
+         "maintenance", "weekend", "licensed", "experienced", "residential", "commercial"]
+AREAS = ["Bole", "Kazanchis", "Piassa", "Megenagna", "CMC", "Sarbet", "Ayat", "Gerji", "Lebu"]
+QUERIES = ["plumbing", "pipe leak", "electrical wiring", "deep cleaning", "roof repair",
+           "plumbng", "kitchen tiling", "garden maintenance", "emergency electrician"]
+
+
+def seed(count, batch=5000):
+    Base.metadata.create_all(bind=engine)
+    ensure_search_schema(engine)
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        existing = conn.execute(Service.__table__.select().limit(1)).first()
+        if existing:
+            return
+        providers = [
+            {"id": uuid.uuid4(), "service_name": trade, "address": f"{area}, Addis Ababa",
+             "years_experience": rng.randint(0, 20), "is_verified": True}
+            for trade in TRADES for area in AREAS
+        ]
+        conn.execute(insert(ServiceProvider), providers)
+        for start in range(0, count, batch):
+            rows = []
+            for _ in range(min(batch, count - start)):
+                provider = rng.choice(providers)
+                trade = provider["service_name"]
+                rows.append({
+                    "id": uuid.uuid4(),
+                    "provider_id": provider["id"],
+                    "title": f"{rng.choice(WORDS).title()} {trade}",
+                    "description": " ".join(rng.choices(WORDS, k=12)) + f" {trade}",
+                    "price": rng.randint(200, 5000),
+                    "rating": rng.randint(0, 5),
+                    "provider_name": "Bench provider",
+                    "is_active": True,
+                })
+            conn.execute(insert(Service), rows)
+
+
+def ilike_search(db, q):
+    # What RecommendationAgent.get_services used to do: fetch every match, rank in Python
+    return (
+        db.query(Service).join(ServiceProvider, Service.provider_id == ServiceProvider.id)
+        .filter(Service.is_active == True, or_(Service.title.ilike(f"%{q}%"), Service.description.ilike(f"%{q}%")))
+        .all()
+    )
+
+
+def measure(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        for q in QUERIES:
+            start = time.perf_counter()
+            fn(q)
+            samples.append(time.perf_counter() - start)
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95)] * 1000, 2),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    seed(args.services)
+    db = SessionLocal()
+    try:
+        result = {
+            "dialect": engine.dialect.name,
+            "services": db.query(Service).count(),
+            "ilike_all_matches": measure(lambda q: ilike_search(db, q), args.repeats),
+            "indexed_search": measure(lambda q: search_services(db, q, limit=args.limit), args.repeats),
+            "sample": {q: [s.title for s, _ in search_services(db, q, limit=3)] for q in QUERIES[:3]},
+        }
+    finally:
+        db.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
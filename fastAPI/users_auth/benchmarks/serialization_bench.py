@@ -0,0 +1,163 @@
+"""Per-endpoint response serialization micro-benchmark
+
+Builds synthetic payloads in the shape each hot endpoint returns and times
+the serialization paths available to it, without the database or HTTP:
+
+    jsonable_encoder   FastAPI's path for routes without a response_model
+                       (jsonable_encoder, then json.dumps)
+    fast_json_response the same with FastJSONResponse (jsonable_encoder, then orjson)
+    response_model     validate against the response_model, then pydantic dump_json
+    list_serializer    serializers.ListSerializer: precompiled TypeAdapter
+    trusted            serializers.dumps straight from dicts, no validation
+
+    python -m benchmarks.serialization_bench --items 100
+    python -m benchmarks.serialization_bench --items 1000 --repeats 50
+"""
+import argparse
+import json
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+import serializers
+from main import MessageBase
+from recommendation import ServiceRecommendation
+from schemas import Service as ServiceSchema
+from serializers import FastJSONResponse, dumps, service_list
+
+START = datetime(2024, 1, 1, 9, 30)
+
+
+def make_services(rng, count):
+    """Attribute objects standing in for Service ORM rows"""
+    return [SimpleNamespace(
+        id=uuid.uuid4(), title=f"Service {i}", description="Licensed plumber, fast and reliable " * 3,
+        price=rng.randint(200, 5000), image=f"/static/uploads/{uuid.uuid4().hex}.jpg", rating=rng.randint(0, 5),
+        provider_name="Provider", created_at=START + timedelta(minutes=i), provider_id=uuid.uuid4(),
+    ) for i in range(count)]
+
+
+def make_messages(rng, count):
+    """Dicts as get_conversation builds them"""
+    users = [str(uuid.uuid4()), str(uuid.uuid4())]
+    conversation = str(uuid.uuid4())
+    messages = []
+    for i in range(count):
+        sender = rng.randrange(2)
+        messages.append({
+            "id": str(uuid.uuid4()), "sender_id": users[sender], "receiver_id": users[1 - sender],
+            "conversation_id": conversation, "sender_name": "Abebe", "sender_role": "homeowner",
+            "sender_image": None, "content": "Can you come on Tuesday morning?",
+            "timestamp": (START + timedelta(seconds=37 * i, microseconds=i)).isoformat(), "read": bool(i % 3),
+        })
+    return messages
+
+
+def make_conversations(rng, count):
+    """Dicts as get_user_conversations builds them"""
+    return [{
+        "id": str(uuid.uuid4()),
+        "other_user": {"id": str(uuid.uuid4()), "name": "Abebe", "email": f"user{i}@example.com", "image": None},
+        "last_message": "See you then",
+        "last_message_time": (START + timedelta(minutes=i)).isoformat(),
+        "unread_count": rng.randint(0, 5),
+    } for i in range(count)]
+
+
+def make_recommendations(rng, count):
+    return [ServiceRecommendation(
+        id=uuid.uuid4(), title=f"Service {i}", description="Licensed plumber", price=float(rng.randint(200, 5000)),
+        provider_name="Provider", rating=rng.random() * 5, image="/static/x.jpg", years_experience=rng.randint(0, 20),
+        address="Bole, Addis Ababa", score=rng.random(),
+    ) for i in range(count)]
+
+
+def best_of(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        body = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), len(body)
+
+
+def endpoints(items):
+    rng = random.Random(7)
+    services = make_services(rng, items)
+    messages = make_messages(rng, items)
+    conversations = make_conversations(rng, items)
+    recommendations = make_recommendations(rng, 5)
+    service_model = TypeAdapter(List[ServiceSchema])
+    message_model = TypeAdapter(List[MessageBase])
+    dict_model = TypeAdapter(List[Dict[str, Any]])
+    plain_services = service_list.adapter.dump_python(service_list.validate(services))
+    batch_lines = [{"index": i, "query": "leaky tap", "parameters": {"job_type": "plumbing"},
+                    "extracted_by": "local", "results": recommendations} for i in range(items)]
+
+    return {
+        # /services/, /services/search, /provider/services
+        "services": {
+            "jsonable_encoder": lambda: JSONResponse(jsonable_encoder(plain_services)).body,
+            "response_model": lambda: service_model.dump_json(
+                service_model.validate_python(services, from_attributes=True)),
+            "list_serializer": lambda: service_list.dump(services),
+        },
+        # /messages/conversation/{contact_id}
+        "conversation": {
+            "response_model": lambda: message_model.dump_json(message_model.validate_python(messages)),
+            "trusted": lambda: dumps(messages),
+        },
+        # /messages/conversations
+        "conversations": {
+            "response_model": lambda: dict_model.dump_json(dict_model.validate_python(conversations)),
+            "trusted": lambda: dumps(conversations),
+        },
+        # Routes without a response_model, e.g. the admin endpoints
+        "untyped_dicts": {
+            "jsonable_encoder": lambda: JSONResponse(jsonable_encoder(conversations)).body,
+            "fast_json_response": lambda: FastJSONResponse(jsonable_encoder(conversations)).body,
+            "trusted": lambda: dumps(conversations),
+        },
+        # /api/recommendations/batch, one NDJSON line per query
+        "recommendation_batch": {
+            "jsonable_encoder": lambda: b"".join(
+                json.dumps({**line, "results": [r.model_dump(mode="json") for r in line["results"]]}).encode()
+                + b"\n" for line in batch_lines),
+            "trusted": lambda: b"".join(
+                dumps({**line, "results": [r.model_dump() for r in line["results"]]}) + b"\n"
+                for line in batch_lines),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100, help="list length per response")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    result = {"items": args.items, "orjson": serializers.orjson is not None, "endpoints": {}}
+    for endpoint, paths in endpoints(args.items).items():
+        timings = {name: best_of(fn, args.repeats) for name, fn in paths.items()}
+        slowest = max(seconds for seconds, _ in timings.values())
+        result["endpoints"][endpoint] = {name: {
+            "ms": round(seconds * 1000, 3),
+            "bytes": size,
+            "speedup": round(slowest / seconds, 1),
+        } for name, (seconds, size) in timings.items()}
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Static file throughput benchmark
+
+Downloads a set of static URLs from a running server with N concurrent
+clients and reports bytes and requests per second. --revalidate sends the
+ETag back as If-None-Match to measure the 304 path browsers take on repeat
+page views.
+
+    uvicorn main:app
+    python -m benchmarks.static_throughput --dir static/uploads/cas --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import httpx
+
+
+def urls_from_dir(directory, limit):
+    urls = []
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            if name.endswith((".part", ".br", ".gz")):
+                continue
+            urls.append("/" + os.path.join(root, name).replace(os.sep, "/").lstrip("./"))
+            if len(urls) >= limit:
+                return urls
+    return urls
+
+
+async def worker(client, urls, offset, args, deadline, totals, etags):
+    i = offset
+    while time.perf_counter() < deadline:
+        url = urls[i % len(urls)]
+        i += 1
+        headers = {"accept-encoding": args.accept_encoding}
+        if args.revalidate and url in etags:
+            headers["if-none-match"] = etags[url]
+        async with client.stream("GET", url, headers=headers) as response:
+            async for chunk in response.aiter_raw():
+                totals["bytes"] += len(chunk)
+        totals["requests"] += 1
+        totals["status"][response.status_code] = totals["status"].get(response.status_code, 0) + 1
+        if "etag" in response.headers:
+            etags[url] = response.headers["etag"]
+
+
+async def run(args, urls):
+    totals = {"bytes": 0, "requests": 0, "status": {}}
+    etags = {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        if args.revalidate:
+            for url in urls:
+                response = await client.get(url)
+                etags[url] = response.headers.get("etag")
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*[
+            worker(client, urls, i, args, deadline, totals, etags) for i in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "files": len(urls),
+        "concurrency": args.concurrency,
+        "revalidate": args.revalidate,
+        "requests_per_s": round(totals["requests"] / elapsed, 1),
+        "megabytes_per_s": round(totals["bytes"] / elapsed / 1e6, 2),
+        "statuses": totals["status"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--dir", default="static/uploads")
+    parser.add_argument("--url", action="append", help="explicit URL path, may be repeated")
+    parser.add_argument("--max-files", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--accept-encoding", default="br, gzip")
+    parser.add_argument("--revalidate", action="store_true")
+    args = parser.parse_args()
+
+    urls = args.url or urls_from_dir(args.dir, args.max_files)
+    if not urls:
+        parser.error("no files to request")
+    print(json.dumps(asyncio.run(run(args, urls)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@ from typing import List, Optional, Dict
 from sqlalchemy.orm import Session, joinedload
 from fastapi import HTTPException, status
 from models import Booking, Service, HomeOwner, User, ServiceProvider, BookingStatus
-from sqlalchemy import func
 
 from schemas import (
     BookingCreate, 
@@ -256,6 +255,7 @@ class CRUDBooking(CRUDBase[Booking, BookingCreate, BookingUpdate]):
 
 from models import Review
 from schemas import ReviewCreate, ReviewResponse
+import ratings
 
 # Add this class to booking.py
 class CRUDReview(CRUDBase[Review, ReviewCreate, ReviewCreate]):
@@ -267,7 +267,7 @@ class CRUDReview(CRUDBase[Review, ReviewCreate, ReviewCreate]):
             Booking.id == booking_id,
             Booking.homeowner_id == homeowner_id,
             Booking.status == BookingStatus.COMPLETED
-        ).first()
+        ).with_for_update().first()
         
         if not booking:
             raise HTTPException(
@@ -296,12 +296,10 @@ class CRUDReview(CRUDBase[Review, ReviewCreate, ReviewCreate]):
         )
         
         db.add(db_obj)
+        ratings.add_review(db, booking, db_obj)
         db.commit()
         db.refresh(db_obj)
         
-        # Update service average rating
-        self._update_service_rating(db, booking.service_id)
-        
         return db_obj
     
     def get_reviews_for_service(
@@ -314,21 +312,6 @@ class CRUDReview(CRUDBase[Review, ReviewCreate, ReviewCreate]):
         ).order_by(
             Review.created_at.desc()
         ).offset(skip).limit(limit).all()
-    
-    def _update_service_rating(self, db: Session, service_id: int):
-        # Calculate new average rating
-        avg_rating = db.query(
-            func.avg(Review.rating)
-        ).filter(
-            Review.service_id == service_id
-        ).scalar()
-        
-        # Update service
-        service = db.query(Service).filter(Service.id == service_id).first()
-        if service:
-            service.average_rating = avg_rating or 0
-            db.add(service)
-            db.commit()
 
 review = CRUDReview(Review)
 
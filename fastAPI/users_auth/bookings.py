@@ -14,20 +14,22 @@ from schemas import (
     AvailabilityResponse,
     BookingStats
 )
-from models import User, BookingStatus
+from models import BookingStatus
 from booking import booking
-from database import get_db
-from auth import get_current_user
-from models import Booking, Service, HomeOwner, User, ServiceProvider, BookingStatus, Review
+from database import get_db, get_read_db
+from auth import get_current_principal, Principal
+from models import Booking, Service, HomeOwner, ServiceProvider, BookingStatus, Review
 from booking import review
+from serializers import FastJSONRoute
+import ratings
 
-router = APIRouter(prefix="/bookings", tags=["bookings"])
+router = APIRouter(prefix="/bookings", tags=["bookings"], route_class=FastJSONRoute)
 
 @router.post("/", response_model=BookingResponse)
 def create_booking(
     booking_data: BookingCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     # Verify homeowner
     if current_user.role != "homeowners":
@@ -36,8 +38,7 @@ def create_booking(
             detail="Only homeowners can create bookings"
         )
     
-    homeowner = db.query(HomeOwner).filter(HomeOwner.user_id == current_user.id).first()
-    if not homeowner:
+    if not current_user.homeowner_id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Homeowner profile not found"
@@ -57,7 +58,7 @@ def create_booking(
     # Create booking with properly formatted status
     db_booking = Booking(
         service_id=booking_data.service_id,
-        homeowner_id=homeowner.id,
+        homeowner_id=current_user.homeowner_id,
         provider_id=service.provider_id,
         scheduled_date=booking_data.scheduled_date,
         scheduled_time=booking_data.scheduled_time,
@@ -80,11 +81,10 @@ def create_booking(
 def get_homeowner_bookings(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_principal)
 ):
-    homeowner = db.query(HomeOwner).filter(HomeOwner.user_id == current_user.id).first()
-    if not homeowner:
+    if not current_user.homeowner_id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Homeowner profile not found"
@@ -94,7 +94,7 @@ def get_homeowner_bookings(
     upcoming = db.query(Booking).options(
         joinedload(Booking.service)
     ).filter(
-        Booking.homeowner_id == homeowner.id,
+        Booking.homeowner_id == current_user.homeowner_id,
         Booking.status.in_([BookingStatus.PENDING.value, BookingStatus.CONFIRMED.value]),
         Booking.scheduled_date >= datetime.now().date()
     ).order_by(Booking.scheduled_date).offset(skip).limit(limit).all()
@@ -103,7 +103,7 @@ def get_homeowner_bookings(
     past = db.query(Booking).options(
         joinedload(Booking.service)
     ).filter(
-        Booking.homeowner_id == homeowner.id,
+        Booking.homeowner_id == current_user.homeowner_id,
         or_(
             Booking.status.in_([BookingStatus.COMPLETED.value, BookingStatus.CANCELLED.value]),
             Booking.scheduled_date < datetime.now().date()
@@ -118,7 +118,7 @@ def get_provider_bookings(
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     if current_user.role != "serviceproviders":
         raise HTTPException(
@@ -126,15 +126,14 @@ def get_provider_bookings(
             detail="Only service providers can access these bookings"
         )
     
-    provider = db.query(ServiceProvider).filter(ServiceProvider.user_id == current_user.id).first()
-    if not provider:
+    if not current_user.provider_id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Provider profile not found"
         )
     
-    print(f"Fetching bookings for provider_id: {provider.id}, user_id: {current_user.id}")  # Debugging
-    bookings = booking.get_bookings_for_provider(db, provider_id=provider.id, skip=skip, limit=limit)
+    print(f"Fetching bookings for provider_id: {current_user.provider_id}, user_id: {current_user.id}")  # Debugging
+    bookings = booking.get_bookings_for_provider(db, provider_id=current_user.provider_id, skip=skip, limit=limit)
     print(f"Retrieved {len(bookings['upcoming'])} upcoming, {len(bookings['past'])} past bookings")  # Debugging
     return bookings
 
@@ -143,7 +142,7 @@ def update_booking_status(
     booking_id: str,
     status_update: BookingUpdate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     return booking.update_booking_status(
         db,
@@ -168,7 +167,7 @@ def check_availability(
 @router.get("/provider/stats", response_model=BookingStats)
 def get_provider_stats(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     if current_user.role != "serviceproviders":
         raise HTTPException(
@@ -176,14 +175,13 @@ def get_provider_stats(
             detail="Only service providers can access these stats"
         )
     
-    provider = db.query(ServiceProvider).filter(ServiceProvider.user_id == current_user.id).first()
-    if not provider:
+    if not current_user.provider_id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Provider profile not found"
         )
     
-    return booking.get_stats_for_provider(db, provider_id=provider.id)
+    return booking.get_stats_for_provider(db, provider_id=current_user.provider_id)
 
 
 from schemas import ReviewCreate, ReviewResponse
@@ -194,7 +192,7 @@ def create_review(
     booking_id: UUID,
     review_data: ReviewCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     # Verify homeowner
     if current_user.role != "homeowners":
@@ -203,8 +201,7 @@ def create_review(
             detail="Only homeowners can create reviews"
         )
     
-    homeowner = db.query(HomeOwner).filter(HomeOwner.user_id == current_user.id).first()
-    if not homeowner:
+    if not current_user.homeowner_id:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Homeowner profile not found"
@@ -213,9 +210,9 @@ def create_review(
     # Check if booking exists and is completed
     booking = db.query(Booking).filter(
         Booking.id == booking_id,
-        Booking.homeowner_id == homeowner.id,
+        Booking.homeowner_id == current_user.homeowner_id,
         Booking.status == BookingStatus.COMPLETED.value
-    ).first()
+    ).with_for_update().first()
     
     if not booking:
         raise HTTPException(
@@ -238,12 +235,13 @@ def create_review(
     db_review = Review(
         booking_id=booking_id,
         service_id=booking.service_id,
-        homeowner_id=homeowner.id,
+        homeowner_id=current_user.homeowner_id,
         rating=review_data.rating,
         review_text=review_data.review_text
     )
     
     db.add(db_review)
+    ratings.add_review(db, booking, db_review)
     db.commit()
     db.refresh(db_review)
     
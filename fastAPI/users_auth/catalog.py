@@ -0,0 +1,250 @@
+import base64
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import astuple, dataclass
+from datetime import datetime
+from typing import Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, event, func, or_
+from sqlalchemy.orm import Session
+
+import metrics
+from models import Service, ServiceProvider
+from geo import GEO_RADIUS_KM, location_filter
+from search import text_filter
+from serializers import service_list
+
+# Pages kept per worker; every service/provider write starts a new generation
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "256"))
+# Bounds staleness of writes made by other workers, which can't invalidate this one
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "30"))
+MAX_PAGE_SIZE = 100
+
+CATALOG_CACHE = metrics.counter("catalog_cache_total", "Catalog page lookups by cache outcome")
+
+# sort name -> (key expression, descending); "distance" is built per query in build_query
+SORTS = {
+    "newest": (Service.created_at, True),
+    "price_asc": (func.coalesce(Service.price, 0), False),
+    "price_desc": (func.coalesce(Service.price, 0), True),
+    "rating": (func.coalesce(Service.rating, 0), True),
+    "distance": (None, False),
+}
+
+
+@dataclass(frozen=True)
+class CatalogQuery:
+    category: Optional[str] = None
+    q: Optional[str] = None
+    min_price: Optional[int] = None
+    max_price: Optional[int] = None
+    min_rating: Optional[float] = None
+    verified: Optional[bool] = None
+    location: Optional[str] = None
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+    radius_km: Optional[float] = None
+    sort: str = "newest"
+    limit: int = 20
+    cursor: Optional[str] = None
+    offset: int = 0
+
+    def normalized(self) -> "CatalogQuery":
+        """Canonical form used as the cache key"""
+        def clean(value):
+            return value.strip().lower() or None if isinstance(value, str) else value
+
+        if self.sort not in SORTS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"sort must be one of: {', '.join(SORTS)}"
+            )
+        return CatalogQuery(
+            category=clean(self.category),
+            q=clean(self.q),
+            min_price=self.min_price,
+            max_price=self.max_price,
+            min_rating=self.min_rating,
+            verified=self.verified,
+            location=clean(self.location),
+            lat=self.lat,
+            lon=self.lon,
+            radius_km=self.radius_km,
+            sort=self.sort,
+            limit=max(1, min(self.limit, MAX_PAGE_SIZE)),
+            cursor=self.cursor or None,
+            offset=max(self.offset, 0) if not self.cursor else 0,
+        )
+
+
+def encode_cursor(sort_value, service_id) -> str:
+    if isinstance(sort_value, datetime):
+        sort_value = {"dt": sort_value.isoformat()}
+    raw = json.dumps([sort_value, str(service_id)], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[object, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, service_id = json.loads(raw)
+        if isinstance(sort_value, dict):
+            sort_value = datetime.fromisoformat(sort_value["dt"])
+        return sort_value, UUID(service_id)
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _distance_key(origin):
+    """Equirectangular distance in degrees; orders like the real distance at city scale"""
+    lat, lon = origin
+    scale = math.cos(math.radians(lat))
+    dlat = ServiceProvider.latitude - lat
+    dlon = (ServiceProvider.longitude - lon) * scale
+    return dlat * dlat + dlon * dlon
+
+
+def build_query(db: Session, query: CatalogQuery):
+    """Page query selecting (Service, sort key) so the cursor comes from the database's own value"""
+    services = db.query(Service).filter(Service.is_active == True)
+
+    origin = (query.lat, query.lon) if query.lat is not None and query.lon is not None else None
+    near = origin is not None or query.location
+    if query.category or query.verified is not None or near:
+        services = services.join(ServiceProvider, Service.provider_id == ServiceProvider.id)
+        if query.category:
+            services = services.filter(func.lower(ServiceProvider.service_name) == query.category)
+        if query.verified is not None:
+            services = services.filter(ServiceProvider.is_verified == query.verified)
+        if near:
+            clause, origin = location_filter(query.location, origin, query.radius_km or GEO_RADIUS_KM)
+            services = services.filter(clause)
+
+    if query.q:
+        services = services.filter(text_filter(db, query.q))
+    if query.min_price is not None:
+        services = services.filter(Service.price >= query.min_price)
+    if query.max_price is not None:
+        services = services.filter(Service.price <= query.max_price)
+    if query.min_rating is not None:
+        services = services.filter(Service.rating >= query.min_rating)
+
+    key, descending = SORTS[query.sort]
+    if query.sort == "distance":
+        if origin is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="sort=distance needs lat/lon or a known location"
+            )
+        key = _distance_key(origin)
+        services = services.filter(ServiceProvider.latitude.isnot(None))
+
+    if query.cursor:
+        # Keyset pagination: continue strictly after the last row of the previous page
+        last_value, last_id = decode_cursor(query.cursor)
+        if descending:
+            services = services.filter(or_(key < last_value, and_(key == last_value, Service.id < last_id)))
+        else:
+            services = services.filter(or_(key > last_value, and_(key == last_value, Service.id > last_id)))
+
+    order = (key.desc(), Service.id.desc()) if descending else (key.asc(), Service.id.asc())
+    services = services.add_columns(key.label("sort_key")).order_by(*order)
+    if query.offset:
+        services = services.offset(query.offset)
+    return services.limit(query.limit + 1)
+
+
+class CatalogCache:
+    """Serialized catalog pages keyed by (generation, normalized query)
+
+    Any committed write to services or providers bumps the generation, so
+    stale pages are never looked up again and age out of the LRU.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.generation = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query: CatalogQuery):
+        key = (self.generation, astuple(query))
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None:
+                return None
+            stored_at, page = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._pages[key]
+                return None
+            self._pages.move_to_end(key)
+            return page
+
+    def put(self, query: CatalogQuery, generation: int, page):
+        with self._lock:
+            self._pages[(generation, astuple(query))] = (time.monotonic(), page)
+            while len(self._pages) > self.size:
+                self._pages.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._pages.clear()
+
+
+cache = CatalogCache(CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL)
+
+
+def get_page(db: Session, query: CatalogQuery) -> Tuple[bytes, Optional[str]]:
+    """One catalog page as (JSON body, next cursor), served from memory when possible"""
+    query = query.normalized()
+    page = cache.get(query)
+    if page is not None:
+        CATALOG_CACHE.inc(outcome="hit")
+        return page
+    CATALOG_CACHE.inc(outcome="miss")
+
+    # Read the generation before querying so a write landing mid-query is not
+    # cached under the newer generation
+    generation = cache.generation
+    rows = build_query(db, query).all()
+    next_cursor = None
+    if len(rows) > query.limit:
+        rows = rows[:query.limit]
+        last, sort_key = rows[-1]
+        next_cursor = encode_cursor(sort_key, last.id)
+
+    services = [service for service, _ in rows]
+    body = service_list.dump(services)
+    page = (body, next_cursor)
+    cache.put(query, generation, page)
+    return page
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_catalog_write(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Service, ServiceProvider)):
+            session.info["catalog_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _mark_catalog_bulk_write(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in (Service, ServiceProvider):
+            orm_execute_state.session.info["catalog_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_catalog(session):
+    if session.info.pop("catalog_dirty", False):
+        cache.invalidate()
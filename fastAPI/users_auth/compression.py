@@ -0,0 +1,205 @@
+import os
+import time
+import zlib
+from typing import Callable, Optional, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import metrics
+from profiling import route_template
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:  # gzip only
+        brotli = None
+
+# Responses smaller than this are sent as is: the framing costs more than it saves
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Dynamic responses are compressed per request, so favour speed over ratio
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# Formats that are already compressed; recompressing them only burns CPU
+INCOMPRESSIBLE_TYPES = (
+    "image/", "video/", "audio/", "font/woff", "application/zip", "application/gzip",
+    "application/x-gzip", "application/pdf", "application/octet-stream", "application/x-brotli",
+)
+COMPRESSIBLE_IMAGES = ("image/svg+xml",)
+
+COMPRESSION_RATIO = metrics.histogram(
+    "http_compression_ratio", "Uncompressed over compressed response size",
+    buckets=(1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 12.0, 20.0),
+)
+COMPRESSION_SECONDS = metrics.histogram(
+    "http_compression_cpu_seconds", "CPU time spent compressing a response",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+COMPRESSION_BYTES = metrics.counter("http_compression_bytes_total", "Response bytes before and after compression")
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Best encoding the client accepts, by q-value; brotli wins ties"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            accepted[name.strip()] = q
+    best, best_q = None, 0.0
+    for encoding in supported_encodings():
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressor(encoding: str) -> Tuple[Callable[[bytes], bytes], Callable[[], bytes], Callable[[], bytes]]:
+    """(compress, flush, finish) for one response; flush ends the chunk so the client can decode it"""
+    if encoding == "br":
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        return c.process, c.flush, c.finish
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+
+def compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False  # e.g. precompressed static siblings
+    if "no-transform" in headers.get("cache-control", ""):
+        return False
+    content_type = headers.get("content-type", "").lower()
+    if content_type.startswith(COMPRESSIBLE_IMAGES):
+        return True
+    return not content_type.startswith(INCOMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """Brotli/gzip response compression with a size threshold and streaming support
+
+    Single-body responses below minimum_size are passed through untouched.
+    Streaming responses (more_body) are compressed chunk by chunk and flushed
+    after each one, so NDJSON lines still reach the client as they are sent.
+    Ratio, CPU time and byte counts are recorded per route and encoding.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponse(self.app, encoding, self.minimum_size)(scope, receive, send)
+
+
+class _CompressedResponse:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start: Optional[Message] = None
+        self.state = "pending"  # pending -> passthrough | compressing
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.cpu_seconds = 0.0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.scope = scope
+        self.send = send
+        await self.app(scope, receive, self.on_send)
+
+    def _encode(self, body: bytes, more_body: bool) -> bytes:
+        start = time.thread_time()
+        out = self.compress(body) + (self.flush() if more_body else self.finish())
+        self.cpu_seconds += time.thread_time() - start
+        return out
+
+    def _begin(self) -> None:
+        headers = MutableHeaders(raw=list(self.start["headers"]))
+        headers["content-encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            # A different byte representation must not share a strong validator
+            headers["etag"] = f"W/{etag}"
+        del headers["content-length"]
+        self.start["headers"] = headers.raw
+        self.compress, self.flush, self.finish = compressor(self.encoding)
+
+    async def _passthrough(self, message: Message) -> None:
+        self.state = "passthrough"
+        await self.send(self.start)
+        await self.send(message)
+
+    async def on_send(self, message: Message) -> None:
+        kind = message["type"]
+        if kind == "http.response.start":
+            self.start = message
+            return
+        if self.state == "passthrough":
+            await self.send(message)
+            return
+        if kind != "http.response.body":
+            # pathsend and other extensions hand the body to the server
+            await self._passthrough(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.state == "pending":
+            headers = Headers(raw=self.start["headers"])
+            status = self.start["status"]
+            declared = headers.get("content-length")
+            if more_body:
+                too_small = declared is not None and int(declared) < self.minimum_size
+            else:
+                too_small = len(body) < self.minimum_size
+            if status < 200 or status in (204, 206, 304) or too_small or not compressible(headers):
+                await self._passthrough(message)
+                return
+            self.state = "compressing"
+            self._begin()
+
+        out = self._encode(body, more_body)
+        if self.start is not None:
+            if not more_body:
+                # The whole body in one message: its final length is known
+                MutableHeaders(raw=self.start["headers"])["content-length"] = str(len(out))
+            await self.send(self.start)
+            self.start = None
+        await self._body(body, out, more_body)
+
+    async def _body(self, raw: bytes, out: bytes, more_body: bool) -> None:
+        self.raw_bytes += len(raw)
+        self.sent_bytes += len(out)
+        await self.send({"type": "http.response.body", "body": out, "more_body": more_body})
+        if not more_body:
+            self._record()
+
+    def _record(self) -> None:
+        labels = {"route": route_template(self.scope), "encoding": self.encoding}
+        if self.sent_bytes:
+            COMPRESSION_RATIO.observe(self.raw_bytes / self.sent_bytes, **labels)
+        COMPRESSION_SECONDS.observe(self.cpu_seconds, **labels)
+        COMPRESSION_BYTES.inc(self.raw_bytes, stage="raw", **labels)
+        COMPRESSION_BYTES.inc(self.sent_bytes, stage="sent", **labels)
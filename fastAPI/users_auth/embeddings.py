@@ -0,0 +1,334 @@
+import csv
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import Service
+
+logger = logging.getLogger(__name__)
+
+SYNONYMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synonyms.csv")
+# Where `python embeddings.py` writes the index; workers memory-map it read-only
+EMBEDDING_DIR = os.getenv("EMBEDDING_DIR", "data/embeddings")
+EMBEDDING_DIM = 256
+# Inverted lists scanned per query; more is slower and closer to exact search
+EMBEDDING_NPROBE = int(os.getenv("EMBEDDING_NPROBE", "8"))
+# How often each worker looks for a rebuilt index and services added elsewhere
+EMBEDDING_SYNC_SECONDS = float(os.getenv("EMBEDDING_SYNC_SECONDS", "60"))
+
+# Feature weights: whole words, character trigrams (typos, inflections) and the
+# concepts from synonyms.csv that make "leaky tap" land next to "plumbing repair"
+WORD_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.5
+CONCEPT_WEIGHT = 2.0
+
+
+def _load_synonyms(path: str = SYNONYMS_PATH) -> Dict[str, List[str]]:
+    synonyms = defaultdict(list)
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            synonyms[row["term"].lower()].append(row["concept"])
+    return dict(synonyms)
+
+
+SYNONYMS = _load_synonyms()
+
+
+def _features(text: str) -> Iterable[Tuple[str, float]]:
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    for i, word in enumerate(words):
+        yield f"w:{word}", WORD_WEIGHT
+        padded = f"<{word}>"
+        grams = [padded[j:j + 3] for j in range(len(padded) - 2)]
+        for gram in grams:
+            yield f"t:{gram}", TRIGRAM_WEIGHT / len(grams)
+        for term in (word, f"{words[i - 1]} {word}" if i else None):
+            for concept in SYNONYMS.get(term, ()):
+                yield f"c:{concept}", CONCEPT_WEIGHT
+
+
+def embed(text: str) -> np.ndarray:
+    """Unit-length signed feature-hashing embedding of text
+
+    crc32 rather than hash() so vectors are identical across processes and
+    restarts, which the on-disk index relies on.
+    """
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for feature, weight in _features(text or ""):
+        h = zlib.crc32(feature.encode())
+        vector[h % EMBEDDING_DIM] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def service_text(title: Optional[str], description: Optional[str]) -> str:
+    # Title twice: it says what the service is, descriptions wander
+    return f"{title or ''} {title or ''} {description or ''}"
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on (a sample of) the vectors"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), 20000), replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = sample[assignment == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+    return centroids.astype(np.float32)
+
+
+def build(db: Session, directory: str = EMBEDDING_DIR) -> dict:
+    """Embed every service and write vectors.f32, centroids.npy and meta.json"""
+    built_at = datetime.utcnow()
+    rows = db.query(Service.id, Service.title, Service.description).all()
+    os.makedirs(directory, exist_ok=True)
+
+    vectors_path = os.path.join(directory, "vectors.f32")
+    temp = f"{vectors_path}.{os.getpid()}.part"
+    vectors = np.memmap(temp, dtype=np.float32, mode="w+", shape=(max(len(rows), 1), EMBEDDING_DIM))
+    for i, (_, title, description) in enumerate(rows):
+        vectors[i] = embed(service_text(title, description))
+    vectors.flush()
+
+    nlist = max(1, int(np.sqrt(len(rows))))
+    centroids = train_centroids(np.asarray(vectors[:len(rows)]), nlist) if rows else \
+        np.zeros((1, EMBEDDING_DIM), dtype=np.float32)
+    del vectors
+    with open(os.path.join(directory, "centroids.npy.part"), "wb") as f:
+        np.save(f, centroids)
+
+    meta = {"dim": EMBEDDING_DIM, "count": len(rows), "built_at": built_at.isoformat(),
+            "ids": [str(service_id) for service_id, _, _ in rows]}
+    with open(os.path.join(directory, "meta.json.part"), "w") as f:
+        json.dump(meta, f)
+
+    # meta.json last: workers reload when it changes, by then the rest is in place
+    os.replace(temp, vectors_path)
+    os.replace(os.path.join(directory, "centroids.npy.part"), os.path.join(directory, "centroids.npy"))
+    os.replace(os.path.join(directory, "meta.json.part"), os.path.join(directory, "meta.json"))
+    return {"services": len(rows), "lists": nlist, "directory": directory}
+
+
+class EmbeddingIndex:
+    """IVF index over the memory-mapped service vectors, plus an in-memory delta
+
+    The base vectors are shared read-only between workers through the page
+    cache. Services created, edited or deleted since the build live in the
+    delta (searched exhaustively) and tombstones, so changes are visible in
+    this worker immediately; other workers pick up new services on their next
+    sync and everything else on the next rebuild.
+    """
+
+    def __init__(self, directory: str = EMBEDDING_DIR):
+        self.directory = directory
+        self.ids: List[str] = []
+        self.row_of: Dict[str, int] = {}
+        self.vectors = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.centroids = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.lists: List[np.ndarray] = []
+        self.built_at: Optional[datetime] = None
+        self.delta: Dict[str, Tuple[np.ndarray, datetime]] = {}
+        self.changed: Dict[str, datetime] = {}  # ids edited or removed since the build
+        self.deleted = set()  # base rows of those ids, skipped by search
+        self.watermark: Optional[datetime] = None
+        self.meta_mtime = None
+        self.synced_at = 0.0
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+
+    def load(self) -> bool:
+        meta_path = os.path.join(self.directory, "meta.json")
+        try:
+            mtime = os.stat(meta_path).st_mtime
+            with open(meta_path) as f:
+                meta = json.load(f)
+            centroids = np.load(os.path.join(self.directory, "centroids.npy"))
+            vectors = np.memmap(os.path.join(self.directory, "vectors.f32"), dtype=np.float32, mode="r",
+                                shape=(max(meta["count"], 1), meta["dim"]))[:meta["count"]]
+        except (OSError, ValueError, KeyError):
+            return False
+        if meta["dim"] != EMBEDDING_DIM:
+            logger.warning("Embedding index at %s has dim %s, rebuild it", self.directory, meta["dim"])
+            return False
+
+        # Inverted lists are cheap to rebuild from the centroids, so they are not stored
+        assignment = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 8192):
+            assignment[start:start + 8192] = np.argmax(vectors[start:start + 8192] @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        built_at = datetime.fromisoformat(meta["built_at"])
+
+        with self._lock:
+            self.ids = meta["ids"]
+            self.row_of = {service_id: i for i, service_id in enumerate(self.ids)}
+            self.vectors, self.centroids = vectors, centroids
+            self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(centroids))]
+            self.built_at = built_at
+            # Changes applied after the build started are not in it yet
+            self.delta = {k: v for k, v in self.delta.items() if v[1] > built_at}
+            self.changed = {k: at for k, at in self.changed.items() if at > built_at}
+            self.deleted = {self.row_of[k] for k in self.changed if k in self.row_of}
+            self.watermark = max(self.watermark or built_at, built_at)
+            self.meta_mtime = mtime
+        return True
+
+    def upsert(self, service_id, text: str) -> None:
+        key, now = str(service_id), datetime.utcnow()
+        with self._lock:
+            self.changed[key] = now
+            if key in self.row_of:
+                self.deleted.add(self.row_of[key])
+            self.delta[key] = (embed(text), now)
+
+    def remove(self, service_id) -> None:
+        key = str(service_id)
+        with self._lock:
+            self.delta.pop(key, None)
+            self.changed[key] = datetime.utcnow()
+            if key in self.row_of:
+                self.deleted.add(self.row_of[key])
+
+    def _sync(self) -> None:
+        try:
+            meta_path = os.path.join(self.directory, "meta.json")
+            mtime = os.stat(meta_path).st_mtime if os.path.exists(meta_path) else None
+            if mtime is not None and mtime != self.meta_mtime:
+                self.load()
+            if self.watermark is None:
+                return  # nothing built yet; `python embeddings.py` creates the index
+
+            from database import SessionLocal
+
+            db = SessionLocal()
+            try:
+                rows = db.query(Service.id, Service.title, Service.description, Service.created_at).filter(
+                    Service.created_at > self.watermark
+                ).all()
+            finally:
+                db.close()
+            for service_id, title, description, created_at in rows:
+                if str(service_id) not in self.delta:
+                    self.upsert(service_id, service_text(title, description))
+                self.watermark = max(self.watermark, created_at)
+        except Exception as e:
+            logger.warning("Could not sync the embedding index: %s", e)
+        finally:
+            self.synced_at = time.monotonic()
+            self._sync_lock.release()
+
+    def refresh_if_stale(self) -> None:
+        if time.monotonic() - self.synced_at < EMBEDDING_SYNC_SECONDS:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return  # another thread is already syncing
+        if self.meta_mtime is None:
+            self._sync()  # first use: load synchronously so the first request has an index
+        else:
+            threading.Thread(target=self._sync, name="embedding-sync", daemon=True).start()
+
+    def search(self, text: str, k: int = 200, nprobe: int = EMBEDDING_NPROBE) -> List[Tuple[str, float]]:
+        """Approximate top-k (service id, cosine) for a query"""
+        self.refresh_if_stale()
+        query = embed(text)
+        if not query.any():
+            return []
+        with self._lock:
+            vectors, centroids, lists, ids = self.vectors, self.centroids, self.lists, self.ids
+            deleted = set(self.deleted)
+            delta = list(self.delta.items())
+
+        hits = []
+        if len(centroids):
+            probe = np.argsort(-(centroids @ query))[:nprobe]
+            rows = np.concatenate([lists[c] for c in probe])
+            if deleted:
+                rows = rows[~np.isin(rows, list(deleted))]
+            if len(rows):
+                rows.sort()  # sequential reads from the memory map
+                scores = np.asarray(vectors[rows]) @ query
+                best = np.argsort(-scores)[:k]
+                hits = [(ids[rows[i]], float(scores[i])) for i in best]
+        if delta:
+            scores = np.stack([vector for _, (vector, _) in delta]) @ query
+            hits.extend((delta[i][0], float(scores[i])) for i in np.argsort(-scores)[:k])
+        hits.sort(key=lambda hit: -hit[1])
+        return [hit for hit in hits[:k] if hit[1] > 0]
+
+    def similarities(self, text: str, services) -> np.ndarray:
+        """Cosine between text and each service, from stored vectors where available"""
+        query = embed(text)
+        with self._lock:
+            result = np.empty(len(services), dtype=np.float32)
+            for i, service in enumerate(services):
+                key = str(service.id)
+                if key in self.delta:
+                    vector = self.delta[key][0]
+                elif key in self.row_of and self.row_of[key] not in self.deleted:
+                    vector = self.vectors[self.row_of[key]]
+                else:
+                    vector = embed(service_text(service.title, service.description))
+                result[i] = vector @ query
+        return result
+
+
+embedding_index = EmbeddingIndex()
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_service_changes(session, flush_context):
+    changes = session.info.setdefault("embedding_changes", {})
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Service):
+            state = inspect(obj)
+            if obj in session.new or state.attrs.title.history.has_changes() \
+                    or state.attrs.description.history.has_changes():
+                changes[obj.id] = service_text(obj.title, obj.description)
+    for obj in session.deleted:
+        if isinstance(obj, Service):
+            changes[obj.id] = None
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_service_changes(session):
+    for service_id, text in session.info.pop("embedding_changes", {}).items():
+        if text is None:
+            embedding_index.remove(service_id)
+        else:
+            embedding_index.upsert(service_id, text)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_service_changes(session):
+    session.info.pop("embedding_changes", None)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild the service embedding index")
+    parser.add_argument("--directory", default=EMBEDDING_DIR)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(json.dumps(build(db, args.directory), indent=2))
+    finally:
+        db.close()
@@ -0,0 +1,244 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from statistics import median
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import Session
+
+from models import Booking, BookingStatus, Message, Review, Service, ServiceFeature, ServiceProvider
+
+logger = logging.getLogger(__name__)
+
+# Pseudo-reviews at the global mean blended into every service's rating, so
+# one 5-star review does not outrank fifty 4.8s
+FEATURE_RATING_PRIOR = float(os.getenv("FEATURE_RATING_PRIOR", "5"))
+# Bookings counted towards velocity, and messages counted towards response time
+VELOCITY_DAYS = 30
+RESPONSE_WINDOW_DAYS = int(os.getenv("FEATURE_RESPONSE_WINDOW_DAYS", "90"))
+# Rows older than this are recomputed even without new activity so velocity decays
+FEATURE_MAX_AGE = timedelta(hours=float(os.getenv("FEATURE_MAX_AGE_HOURS", "24")))
+# How often each worker reloads the feature table into memory
+FEATURE_REFRESH_SECONDS = float(os.getenv("FEATURE_REFRESH_SECONDS", "300"))
+_CHUNK = 500
+
+# Column order of FeatureStore matrices
+FEATURE_NAMES = ("bayes_rating", "completion_rate", "cancellation_rate", "booking_velocity", "response_minutes")
+RATING, COMPLETION, CANCELLATION, VELOCITY, RESPONSE = range(len(FEATURE_NAMES))
+
+
+def _chunks(ids: List, size: int = _CHUNK):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def _rating_totals(db: Session, service_ids) -> Dict[object, List[float]]:
+    """service id -> (sum, count), the running totals ratings.py keeps on the service"""
+    rows = db.query(Service.id, Service.rating_sum, Service.rating_count).filter(Service.id.in_(service_ids))
+    return {service_id: (float(total or 0), count or 0) for service_id, total, count in rows}
+
+
+def global_mean_rating(db: Session) -> float:
+    total, count = db.query(func.sum(Service.rating_sum), func.sum(Service.rating_count)).one()
+    return float(total) / count if count else 3.0
+
+
+def _booking_stats(db: Session, service_ids, now: datetime):
+    recent = now - timedelta(days=VELOCITY_DAYS)
+    rows = db.query(
+        Booking.service_id,
+        func.count(Booking.id),
+        func.sum(case((Booking.status == BookingStatus.COMPLETED, 1), else_=0)),
+        func.sum(case((Booking.status == BookingStatus.CANCELLED, 1), else_=0)),
+        func.sum(case((Booking.created_at >= recent, 1), else_=0)),
+    ).filter(Booking.service_id.in_(service_ids)).group_by(Booking.service_id)
+    return {service_id: (total, completed or 0, cancelled or 0, recent_count or 0)
+            for service_id, total, completed, cancelled, recent_count in rows}
+
+
+def _response_minutes(db: Session, provider_users: Set, now: datetime) -> Dict[object, float]:
+    """Median minutes between a customer's first unanswered message and the provider's reply"""
+    since = now - timedelta(days=RESPONSE_WINDOW_DAYS)
+    users = list(provider_users)
+    messages = db.query(Message.sender_id, Message.receiver_id, Message.timestamp).filter(
+        Message.timestamp >= since,
+        or_(Message.sender_id.in_(users), Message.receiver_id.in_(users)),
+    ).order_by(Message.timestamp)
+
+    waiting = {}  # (provider user, customer) -> time of the first unanswered message
+    delays = defaultdict(list)
+    for sender, receiver, sent_at in messages:
+        if receiver in provider_users and (receiver, sender) not in waiting:
+            waiting[(receiver, sender)] = sent_at
+        elif sender in provider_users:
+            asked_at = waiting.pop((sender, receiver), None)
+            if asked_at is not None:
+                delays[sender].append((sent_at - asked_at).total_seconds() / 60.0)
+    return {user: median(values) for user, values in delays.items()}
+
+
+def compute_features(db: Session, service_ids: List, mean_rating: float,
+                     now: Optional[datetime] = None) -> List[dict]:
+    """Feature rows for the given services, in the shape of ServiceFeature"""
+    now = now or datetime.utcnow()
+    ratings = _rating_totals(db, service_ids)
+    bookings = _booking_stats(db, service_ids, now)
+    owners = dict(
+        db.query(Service.id, ServiceProvider.user_id)
+        .join(ServiceProvider, Service.provider_id == ServiceProvider.id)
+        .filter(Service.id.in_(service_ids))
+    )
+    response = _response_minutes(db, {u for u in owners.values() if u is not None}, now)
+
+    rows = []
+    for service_id in service_ids:
+        rating_sum, rating_count = ratings.get(service_id, (0.0, 0))
+        total, completed, cancelled, recent = bookings.get(service_id, (0, 0, 0, 0))
+        rows.append({
+            "service_id": service_id,
+            "bayes_rating": (FEATURE_RATING_PRIOR * mean_rating + rating_sum) / (FEATURE_RATING_PRIOR + rating_count),
+            "rating_count": rating_count,
+            # Laplace-smoothed so a service with no finished bookings sits at 0.5
+            "completion_rate": (completed + 1) / (completed + cancelled + 2),
+            "cancellation_rate": cancelled / total if total else 0.0,
+            "booking_velocity": recent / VELOCITY_DAYS,
+            "response_minutes": response.get(owners.get(service_id)),
+            "updated_at": now,
+        })
+    return rows
+
+
+def changed_service_ids(db: Session, since: Optional[datetime], now: datetime) -> Set:
+    """Services whose features may differ from the stored row"""
+    if since is None:
+        return {service_id for (service_id,) in db.query(Service.id)}
+
+    ids = {service_id for (service_id,) in db.query(Booking.service_id).filter(
+        or_(Booking.created_at > since, Booking.updated_at > since)
+    ).distinct()}
+    ids.update(service_id for (service_id,) in db.query(Review.service_id).filter(Review.created_at > since).distinct())
+
+    # Either side of a conversation with a provider changes all of their services
+    talkers = {user for row in db.query(Message.sender_id, Message.receiver_id).filter(Message.timestamp > since)
+               for user in row}
+    for chunk in _chunks(list(talkers)):
+        ids.update(service_id for (service_id,) in db.query(Service.id)
+                   .join(ServiceProvider, Service.provider_id == ServiceProvider.id)
+                   .filter(ServiceProvider.user_id.in_(chunk)))
+
+    ids.update(service_id for (service_id,) in db.query(Service.id).outerjoin(
+        ServiceFeature, ServiceFeature.service_id == Service.id
+    ).filter(or_(ServiceFeature.service_id.is_(None), ServiceFeature.updated_at < now - FEATURE_MAX_AGE)))
+    ids.discard(None)
+    return ids
+
+
+def refresh_features(db: Session, full: bool = False) -> dict:
+    """Recompute the rows that changed since the last run; full=True rebuilds every row
+
+    The newest updated_at in the table is the watermark, so the job can be run
+    from cron at any interval and picks up exactly what it missed.
+    """
+    now = datetime.utcnow()
+    since = None if full else db.query(func.max(ServiceFeature.updated_at)).scalar()
+    ids = list(changed_service_ids(db, since, now))
+    mean_rating = global_mean_rating(db)
+
+    for chunk in _chunks(ids):
+        existing = {row.service_id: row for row in
+                    db.query(ServiceFeature).filter(ServiceFeature.service_id.in_(chunk))}
+        for values in compute_features(db, chunk, mean_rating, now):
+            row = existing.get(values["service_id"])
+            if row is None:
+                db.add(ServiceFeature(**values))
+            else:
+                for key, value in values.items():
+                    setattr(row, key, value)
+        db.commit()
+    return {"refreshed": len(ids), "since": since.isoformat() if since else None, "mean_rating": round(mean_rating, 3)}
+
+
+class FeatureStore:
+    """Per-worker copy of service_features as a float32 matrix, one row per service
+
+    Reloads happen on a background thread, so ranking a request never waits
+    on or issues a query. The last matrix row holds defaults for services
+    the pipeline has not seen yet.
+    """
+
+    def __init__(self):
+        self._snapshot = ({}, self._defaults(np.empty((0, len(FEATURE_NAMES)), dtype=np.float32)))
+        self.loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _defaults(matrix: np.ndarray) -> np.ndarray:
+        default = np.array([3.0, 0.5, 0.0, 0.0, np.nan], dtype=np.float32)
+        if len(matrix):
+            # Close to the smoothed rating of a service without reviews
+            default[RATING] = np.median(matrix[:, RATING])
+        return np.vstack([matrix, default])
+
+    def refresh(self, db: Session) -> None:
+        columns = [getattr(ServiceFeature, name) for name in FEATURE_NAMES]
+        rows = db.query(ServiceFeature.service_id, *columns).all()
+        matrix = np.array([[np.nan if v is None else v for v in row[1:]] for row in rows],
+                          dtype=np.float32).reshape(len(rows), len(FEATURE_NAMES))
+        index = {row[0]: i for i, row in enumerate(rows)}
+        self._snapshot = (index, self._defaults(matrix))
+        self.loaded_at = time.monotonic()
+
+    def _reload(self) -> None:
+        try:
+            from database import SessionLocal
+
+            db = SessionLocal()
+            try:
+                self.refresh(db)
+            finally:
+                db.close()
+        except Exception as e:
+            logger.warning("Could not load service features: %s", e)
+            self.loaded_at = time.monotonic()  # retry after the next interval
+        finally:
+            self._lock.release()
+
+    def refresh_if_stale(self) -> None:
+        if time.monotonic() - self.loaded_at < FEATURE_REFRESH_SECONDS:
+            return
+        if not self._lock.acquire(blocking=False):
+            return  # another thread is already refreshing
+        threading.Thread(target=self._reload, name="feature-store", daemon=True).start()
+
+    def lookup(self, service_ids: Iterable) -> np.ndarray:
+        """(n, len(FEATURE_NAMES)) features aligned with service_ids"""
+        self.refresh_if_stale()
+        index, matrix = self._snapshot
+        service_ids = list(service_ids)
+        rows = np.fromiter((index.get(i, -1) for i in service_ids), dtype=np.intp, count=len(service_ids))
+        return matrix[rows]
+
+
+feature_store = FeatureStore()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Refresh the service_features ranking table")
+    parser.add_argument("--full", action="store_true", help="recompute every service, not only changed ones")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(json.dumps(refresh_features(db, args.full), indent=2))
+    finally:
+        db.close()
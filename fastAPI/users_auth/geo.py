@@ -0,0 +1,273 @@
+import csv
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, event, inspect, or_
+from sqlalchemy.orm import Session
+
+from models import ServiceProvider
+
+logger = logging.getLogger(__name__)
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.csv")
+# Default "near me" radius and how many providers to fall back to when none are inside it
+GEO_RADIUS_KM = float(os.getenv("GEO_RADIUS_KM", "10"))
+GEO_NEAREST_K = int(os.getenv("GEO_NEAREST_K", "20"))
+# Largest radius a client may ask for
+GEO_MAX_RADIUS_KM = float(os.getenv("GEO_MAX_RADIUS_KM", "100"))
+# How often each worker reloads provider coordinates from the database
+GEO_INDEX_REFRESH_SECONDS = float(os.getenv("GEO_INDEX_REFRESH_SECONDS", "60"))
+
+EARTH_RADIUS_KM = 6371.0
+# More specific places win when an address mentions several ("Bole, Addis Ababa")
+_KIND_PRIORITY = {"neighborhood": 2, "subcity": 1, "city": 0}
+
+Point = Tuple[float, float]
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def _load_gazetteer(path: str = GAZETTEER_PATH) -> Dict[str, Tuple[float, float, int]]:
+    places = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            places[_normalize(row["name"])] = (
+                float(row["latitude"]), float(row["longitude"]), _KIND_PRIORITY.get(row["kind"], 0)
+            )
+    return places
+
+
+GAZETTEER = _load_gazetteer()
+_MAX_PLACE_WORDS = max(len(name.split()) for name in GAZETTEER)
+
+
+def find_place(text: Optional[str]) -> Optional[str]:
+    """Gazetteer name of the most specific place mentioned in text"""
+    if not text:
+        return None
+    words = _normalize(text).split()
+    best = None
+    for size in range(min(_MAX_PLACE_WORDS, len(words)), 0, -1):
+        for start in range(len(words) - size + 1):
+            name = " ".join(words[start:start + size])
+            place = GAZETTEER.get(name)
+            if place and (best is None or (place[2], size) > best[0]):
+                best = ((place[2], size), name)
+    return best[1] if best else None
+
+
+def geocode(address: Optional[str]) -> Optional[Point]:
+    """Resolve a free-text address to (lat, lon) with the bundled gazetteer, offline"""
+    name = find_place(address)
+    if name is None:
+        return None
+    lat, lon, _ = GAZETTEER[name]
+    return lat, lon
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GeoGrid:
+    """Fixed-size lat/lon grid for radius and k-nearest lookups
+
+    Each cell is cell_deg degrees on a side (~5.5km at the default), so a
+    radius query only visits the handful of cells overlapping its bounding box.
+    """
+
+    def __init__(self, points: Dict[object, Point], cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        self.points = points
+        self.cells = defaultdict(list)
+        for key, (lat, lon) in points.items():
+            self.cells[self._cell(lat, lon)].append(key)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _distances(self, origin: Point, cells) -> Dict[object, float]:
+        found = {}
+        for cell in cells:
+            for key in self.cells.get(cell, ()):
+                lat, lon = self.points[key]
+                found[key] = haversine_km(origin[0], origin[1], lat, lon)
+        return found
+
+    def within(self, origin: Point, radius_km: float) -> Dict[object, float]:
+        """key -> distance for every point within radius_km of origin"""
+        lat, lon = origin
+        dlat = radius_km / 111.0
+        dlon = radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+        lat_lo, lon_lo = self._cell(lat - dlat, lon - dlon)
+        lat_hi, lon_hi = self._cell(lat + dlat, lon + dlon)
+        if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) > len(self.points):
+            # More cells than points: scanning every point is cheaper than walking the box
+            found = {key: haversine_km(lat, lon, *point) for key, point in self.points.items()}
+        else:
+            cells = [(i, j) for i in range(lat_lo, lat_hi + 1) for j in range(lon_lo, lon_hi + 1)]
+            found = self._distances(origin, cells)
+        return {k: d for k, d in found.items() if d <= radius_km}
+
+    def nearest(self, origin: Point, k: int, max_rings: int = 200) -> List[Tuple[object, float]]:
+        """The k closest points as (key, distance), searching outward ring by ring"""
+        ci, cj = self._cell(*origin)
+        # Points outside ring r are at least r cells away; a cell's narrowest side is its width in longitude
+        cell_km = self.cell_deg * 111.32 * max(math.cos(math.radians(origin[0])), 0.01)
+        found = {}
+        for ring in range(max_rings + 1):
+            if ring == 0:
+                cells = [(ci, cj)]
+            else:
+                cells = [(ci + di, cj + dj) for di in range(-ring, ring + 1) for dj in range(-ring, ring + 1)
+                         if max(abs(di), abs(dj)) == ring]
+            found.update(self._distances(origin, cells))
+            if len(found) >= min(k, len(self.points)):
+                best = sorted(found.items(), key=lambda item: item[1])[:k]
+                if len(found) == len(self.points) or best[-1][1] <= ring * cell_km:
+                    return best
+        return sorted(found.items(), key=lambda item: item[1])[:k]
+
+
+class ProviderLocations:
+    """Per-worker grid of provider coordinates, reloaded when providers change
+
+    Reloads run on a background thread while requests keep using the
+    previous grid; `ready` is set once the first one has completed.
+    """
+
+    def __init__(self):
+        self.grid = GeoGrid({})
+        self.loaded_at = 0.0
+        self.ready = threading.Event()
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session) -> None:
+        self._stale = False  # a write committed from here on marks it again
+        rows = db.query(ServiceProvider.id, ServiceProvider.latitude, ServiceProvider.longitude).filter(
+            ServiceProvider.latitude.isnot(None), ServiceProvider.longitude.isnot(None)
+        ).all()
+        self.grid = GeoGrid({provider_id: (lat, lon) for provider_id, lat, lon in rows})
+        self.loaded_at = time.monotonic()
+        self.ready.set()
+
+    def _reload(self) -> None:
+        try:
+            from database import SessionLocal
+
+            db = SessionLocal()
+            try:
+                self.refresh(db)
+            finally:
+                db.close()
+        except Exception as e:
+            logger.warning("Could not load provider locations: %s", e)
+            self._stale = False
+            self.loaded_at = time.monotonic()  # retry after the next interval
+        finally:
+            self._lock.release()
+
+    def refresh_if_stale(self) -> None:
+        if not self._stale and time.monotonic() - self.loaded_at < GEO_INDEX_REFRESH_SECONDS:
+            return
+        if not self._lock.acquire(blocking=False):
+            return  # another thread is already refreshing
+        threading.Thread(target=self._reload, name="provider-locations", daemon=True).start()
+
+    def mark_stale(self) -> None:
+        self._stale = True
+
+    def near(self, origin: Point, radius_km: float = GEO_RADIUS_KM) -> Dict[object, float]:
+        """Providers within radius_km, or the GEO_NEAREST_K closest when none are"""
+        self.refresh_if_stale()
+        found = self.grid.within(origin, radius_km)
+        if not found:
+            found = dict(self.grid.nearest(origin, GEO_NEAREST_K))
+        return found
+
+
+provider_locations = ProviderLocations()
+
+
+def location_filter(location: Optional[str] = None, origin: Optional[Point] = None,
+                    radius_km: float = GEO_RADIUS_KM):
+    """(where clause on ServiceProvider, origin) for a place name or coordinates
+
+    Known places and coordinates use the provider grid; providers that could
+    not be geocoded still match on their address text.
+    """
+    if origin is None and location:
+        origin = geocode(location)
+    if origin is None:
+        return ServiceProvider.address.ilike(f"%{location}%"), None
+    provider_locations.refresh_if_stale()
+    if provider_locations.ready.is_set():
+        clause = ServiceProvider.id.in_(list(provider_locations.near(origin, radius_km)))
+    else:
+        clause = _bounding_box(origin, radius_km)  # until this worker's first grid load
+    if location:
+        clause = or_(clause, and_(ServiceProvider.latitude.is_(None), ServiceProvider.address.ilike(f"%{location}%")))
+    return clause, origin
+
+
+def _bounding_box(origin: Point, radius_km: float):
+    """Where clause for providers inside the radius' bounding box, straight from the columns"""
+    lat, lon = origin
+    dlat = radius_km / 111.0
+    dlon = radius_km / (111.32 * max(math.cos(math.radians(lat)), 0.01))
+    return and_(ServiceProvider.latitude.between(lat - dlat, lat + dlat),
+                ServiceProvider.longitude.between(lon - dlon, lon + dlon))
+
+
+@event.listens_for(ServiceProvider, "before_insert")
+@event.listens_for(ServiceProvider, "before_update")
+def _geocode_provider(mapper, connection, provider):
+    if inspect(provider).attrs.address.history.has_changes():
+        point = geocode(provider.address)
+        provider.latitude, provider.longitude = point if point else (None, None)
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_location_write(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, ServiceProvider):
+            session.info["geo_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _refresh_locations(session):
+    if session.info.pop("geo_dirty", False):
+        provider_locations.mark_stale()
+
+
+def backfill(db: Session) -> int:
+    """Geocode every provider address; returns how many were located"""
+    providers = 0
+    for provider in db.query(ServiceProvider).all():
+        point = geocode(provider.address)
+        provider.latitude, provider.longitude = point if point else (None, None)
+        providers += point is not None
+    db.commit()
+    return providers
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        print("Geocoded %d providers" % backfill(session))
+    finally:
+        session.close()
@@ -0,0 +1,189 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Tuple
+
+import metrics
+from uploads import CAS_DIR, CAS_URL_FRAGMENT, IMAGE_TYPES, path_to_url
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # variants are skipped, originals are still served
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Longest edge in pixels; None keeps the original size and only re-encodes to WebP.
+# Generated largest first, each from the previous one, so "thumb" is written last
+# and doubles as the marker that the whole set is ready.
+VARIANTS = {"webp": None, "medium": 800, "small": 320, "thumb": 64}
+READY_MARKER = "thumb"
+WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+
+# "process" sidesteps the GIL for decoding; "thread" avoids pickling and is fine
+# since Pillow releases the GIL while resizing and encoding.
+IMAGE_EXECUTOR = os.getenv("IMAGE_EXECUTOR", "process").lower()
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Jobs waiting for a worker before new uploads skip variant generation
+IMAGE_MAX_QUEUE = int(os.getenv("IMAGE_MAX_QUEUE", "256"))
+# How long variant_urls trusts "not generated yet" before checking the disk again;
+# variants made by another worker's pool are only noticed this way
+VARIANT_RECHECK_SECONDS = float(os.getenv("IMAGE_VARIANT_RECHECK_SECONDS", "30"))
+
+JOBS = metrics.counter("image_variant_jobs_total", "Image variant jobs by outcome")
+DURATION = metrics.histogram("image_variant_duration_seconds", "Time to generate all variants of one image")
+PENDING = metrics.gauge("image_variant_pending", "Image variant jobs queued or running")
+
+_slots = threading.BoundedSemaphore(IMAGE_WORKERS + IMAGE_MAX_QUEUE)
+_in_progress = set()
+_in_progress_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+# Images whose variant set is complete; content-addressed, so entries never go stale
+_ready = set()
+_missing: Dict[str, float] = {}  # path -> time.monotonic() of the last disk check
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                if IMAGE_EXECUTOR == "thread":
+                    _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image-variants")
+                else:
+                    _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+
+def variant_path(path: str, name: str) -> str:
+    """static/uploads/cas/ab/cd/<sha256>.png -> static/uploads/cas/ab/cd/<sha256>_<name>.webp"""
+    return f"{os.path.splitext(path)[0]}_{name}.webp"
+
+
+def variant_urls(url) -> Dict[str, str]:
+    """Variant URLs for an uploaded image, empty until they have been generated"""
+    if not url or CAS_URL_FRAGMENT not in url:
+        return {}
+    path = os.path.normpath(url.lstrip("/"))
+    if path not in _ready and not _check_ready(path):
+        return {}
+    return {name: path_to_url(variant_path(path, name)) for name in VARIANTS}
+
+
+def _check_ready(path: str) -> bool:
+    """Disk check for variants, at most once per VARIANT_RECHECK_SECONDS per image"""
+    now = time.monotonic()
+    checked_at = _missing.get(path)
+    if checked_at is not None and now - checked_at < VARIANT_RECHECK_SECONDS:
+        return False
+    if os.path.exists(variant_path(path, READY_MARKER)):
+        _mark_ready(path)
+        return True
+    _missing[path] = now
+    return False
+
+
+def _mark_ready(path: str) -> None:
+    _ready.add(path)
+    _missing.pop(path, None)
+
+
+# Module level so the process pool can pickle it
+def generate_variants(path: str) -> Tuple[int, float]:
+    """Write every variant of one image; returns (variants written, seconds)"""
+    start = time.perf_counter()
+    with Image.open(path) as source:
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.mode in ("LA", "P", "PA") else "RGB")
+
+        for name, size in VARIANTS.items():
+            if size is not None:
+                image.thumbnail((size, size), Image.LANCZOS)
+            target = variant_path(path, name)
+            temp = f"{target}.{os.getpid()}.part"
+            image.save(temp, "WEBP", quality=WEBP_QUALITY, method=4)
+            os.replace(temp, target)
+    return len(VARIANTS), time.perf_counter() - start
+
+
+def schedule_variants(stored) -> bool:
+    """Queue variant generation for a freshly stored upload
+
+    Runs on the image pool after the response has been sent. Returns False if
+    nothing was queued (not an image, already done, Pillow missing or the
+    queue is full); the originals are served either way.
+    """
+    if stored.content_type not in IMAGE_TYPES:
+        return False
+    if Image is None:
+        JOBS.inc(outcome="unavailable")
+        return False
+    path = stored.path
+    if os.path.exists(variant_path(path, READY_MARKER)):
+        _mark_ready(os.path.normpath(path))
+        JOBS.inc(outcome="cached")
+        return False
+
+    with _in_progress_lock:
+        if path in _in_progress:
+            return False
+        if not _slots.acquire(blocking=False):
+            JOBS.inc(outcome="rejected")
+            logger.warning("Image queue full, skipping variants for %s", path)
+            return False
+        _in_progress.add(path)
+        PENDING.set(len(_in_progress))
+
+    def _done(future):
+        with _in_progress_lock:
+            _in_progress.discard(path)
+            PENDING.set(len(_in_progress))
+        _slots.release()
+        error = None if future.cancelled() else future.exception()
+        if future.cancelled() or error is not None:
+            JOBS.inc(outcome="failed")
+            logger.warning("Generating variants for %s failed: %s", path, error)
+            return
+        JOBS.inc(outcome="done")
+        DURATION.observe(future.result()[1])
+        _mark_ready(os.path.normpath(path))
+        # Cached catalog pages were serialized without the variants
+        from catalog import cache as catalog_cache
+        catalog_cache.invalidate()
+
+    try:
+        future = _get_executor().submit(generate_variants, path)
+    except Exception:
+        with _in_progress_lock:
+            _in_progress.discard(path)
+            PENDING.set(len(_in_progress))
+        _slots.release()
+        raise
+    future.add_done_callback(_done)
+    return True
+
+
+def backfill(directory: str = CAS_DIR) -> int:
+    """Generate missing variants for every stored image (run after deploys or queue overflows)"""
+    extensions = (".jpg", ".png", ".gif", ".webp")
+    todo = []
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            # Variants are named <sha256>_<variant>.webp, originals plain <sha256>.<ext>
+            if "_" in name or not name.endswith(extensions):
+                continue
+            path = os.path.join(root, name)
+            if not os.path.exists(variant_path(path, READY_MARKER)):
+                todo.append(path)
+    with ProcessPoolExecutor(max_workers=IMAGE_WORKERS) as pool:
+        for _ in pool.map(generate_variants, todo):
+            pass
+    return len(todo)
+
+
+if __name__ == "__main__":
+    print(f"Generated variants for {backfill()} images")
@@ -1,9 +1,8 @@
 from fastapi import FastAPI, Depends, HTTPException, File, UploadFile, Form, status, Body, Request, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, contains_eager, joinedload
 from sqlalchemy.sql import and_, func, case, or_  
-import shutil
 import os
 from datetime import datetime, timedelta
 from typing import Optional, List
@@ -14,11 +13,11 @@ from schemas import BookingCreate, ChatResponse, ChatInput, PasswordChangeReques
 # from booking_homeowner_router import router as booking_homeowner_router
 # from booking_router import router as booking_router
 
-from jose import JWTError, jwt
 from typing_extensions import Annotated
 from pydantic import BaseModel
 from pydantic import UUID4
-import math
+import secrets
+import metrics
 
 class RatingInput(BaseModel):
     rating: int  
@@ -28,15 +27,22 @@ class RatingInput(BaseModel):
     rating: int  
 
 
-SECRET_KEY = "mysecret"  
-ALGORITHM = "HS256"  
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="admin/login")
 
 SUPER_ADMIN_TOKEN_EXPIRE_MINUTES = 120  
 ADMIN_TOKEN_EXPIRE_MINUTES = 60         
 
-from database import get_db, engine
-from auth import hash_password, verify_password, create_access_token, get_current_admin_user, get_current_super_admin, get_current_user, get_current_user_for_messaging, create_admin_token
+from database import get_db, get_read_db, engine, pool_status
+from auth import verify_password, verify_and_update, hash_password_async, verify_password_async, verify_and_update_async, create_access_token, get_current_admin_user, get_current_super_admin, get_current_user, get_current_user_for_messaging, create_admin_token, get_current_principal, invalidate_principal, Principal, require_admin, load_principal
+from tokens import TokenClaims, decode_token, user_claims, revoke_user_tokens
+from uploads import save_upload, IMAGE_TYPES, MAX_IMAGE_BYTES, MAX_AVATAR_BYTES
+from images import schedule_variants, variant_urls
+from catalog import CatalogQuery, get_page as get_catalog_page
+from geo import GEO_MAX_RADIUS_KM
+import ratings
+from search import ensure_search_schema, search_services
+from recommendation import recommendation_cache
+from serializers import FastJSONRoute, ListSerializer, service_list, trusted_response
 from models import (
     Base, 
     User, 
@@ -58,7 +64,10 @@ from models import (
 
 from models import Report as ReportModel
 from schemas import ServiceCreate,AdminCreate,AdminResponse,Service as ServiceSchema, Token, ServiceUpdate, ConversationRead, MessageCreate, MessageRead, WarnProvider, Report
-from fastapi.staticfiles import StaticFiles
+from static_files import CachedStaticFiles
+from compression import CompressionMiddleware
+from profiling import ProfilingMiddleware
+from query_budget import QueryBudgetMiddleware, query_budget
 import os
 
 from chat_assistant import AiAssistant
@@ -67,6 +76,7 @@ from starlette.middleware.cors import CORSMiddleware
 
 
 app = FastAPI()
+app.router.route_class = FastJSONRoute
 
 assistant = AiAssistant()
 
@@ -82,6 +92,12 @@ app.add_middleware(
     allow_headers=["*"],
     expose_headers=["*"] 
 )
+# Brotli/gzip for JSON and other text responses; images and precompressed static files pass through
+app.add_middleware(CompressionMiddleware)
+# Flags N+1 patterns and routes over their @query_budget (QUERY_BUDGET_MODE=strict in tests)
+app.add_middleware(QueryBudgetMiddleware)
+# Outermost, so latency includes compression and sizes are bytes on the wire
+app.add_middleware(ProfilingMiddleware)
 
 # app.include_router(booking_router)
 # app.include_router(booking_homeowner_router)
@@ -90,9 +106,10 @@ UPLOAD_DIR = "static/uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 
 Base.metadata.create_all(bind=engine)
+ensure_search_schema(engine)
 
 UPLOAD_DIR = "static/uploads/"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -105,8 +122,8 @@ async def connect(sid, environ, auth):
         print(f"Connection rejected for sid {sid}: No token provided")
         return False
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id = payload.get("user_id")
+        claims = decode_token(token)
+        user_id = claims.user_id
         if not user_id:
             print(f"Connection rejected for sid {sid}: Invalid user_id")
             return False
@@ -114,8 +131,8 @@ async def connect(sid, environ, auth):
         sio.enter_room(sid, str(user_id))
         print(f"User {user_id} connected with sid {sid}")
         return True
-    except JWTError as e:
-        print(f"Connection rejected for sid {sid}: JWTError {str(e)}")
+    except HTTPException as e:
+        print(f"Connection rejected for sid {sid}: {e.detail}")
         return False
 
 @sio.event
@@ -204,23 +221,6 @@ async def private_message(sid, data):
 
 
 
-def save_upload_file(upload_file: UploadFile, destination: str) -> str:
-    try:
-        file_ext = os.path.splitext(upload_file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = os.path.join(destination, unique_filename)
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(upload_file.file, buffer)
-            
-        return file_path
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Error saving file: {str(e)}"
-        )
-
-
 @app.post("/register/provider/request")
 async def register_provider_request(
     full_name: Annotated[str, Form(...)],
@@ -243,8 +243,8 @@ async def register_provider_request(
             )
 
         # Handle file uploads if provided
-        id_path = save_upload_file(id_verification, UPLOAD_DIR) if id_verification else None
-        cert_path = save_upload_file(certification, UPLOAD_DIR) if certification else None
+        id_path = (await save_upload(id_verification)).path if id_verification else None
+        cert_path = (await save_upload(certification)).path if certification else None
 
         # Create registration request instead of direct User/ServiceProvider
         registration_request = ProviderRegistrationRequest(
@@ -253,7 +253,7 @@ async def register_provider_request(
             phone_number=phone_number,
             address=address,
             years_experience=years_experience,
-            password_hash=hash_password(password),
+            password_hash=await hash_password_async(password),
             id_verification=id_path,
             certification=cert_path,
             status=RegistrationStatus.PENDING.value,
@@ -290,21 +290,7 @@ async def upload_provider_documents(
 ):
     try:
         # Verify token first
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            email: str = payload.get("sub")
-
-            if email is None:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid authentication credentials"
-                )
-        except JWTError as e:
-            
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail=f"Invalid token: {str(e)}"
-            )
+        email = decode_token(token).sub
 
         # Get user from token
         user = db.query(ProviderRegistrationRequest).filter(ProviderRegistrationRequest.email == email).first()
@@ -315,8 +301,8 @@ async def upload_provider_documents(
             )
         
         # Save documents
-        id_path = save_upload_file(id_verification, UPLOAD_DIR)
-        cert_path = save_upload_file(certification, UPLOAD_DIR)
+        id_path = (await save_upload(id_verification)).path
+        cert_path = (await save_upload(certification)).path
 
         # Update provider record
         provider = db.query(ProviderRegistrationRequest).filter(ProviderRegistrationRequest.id == user.id).first()
@@ -390,7 +376,7 @@ async def register_admin(
         # Create base User
         new_user = User(
             email=admin_data.email,
-            password_hash=hash_password(admin_data.password),
+            password_hash=await hash_password_async(admin_data.password),
             full_name=admin_data.full_name,
             role=UserRole.ADMIN.value,
             is_active=True
@@ -445,11 +431,16 @@ async def admin_login(
                 detail="Invalid admin credentials"
             )
 
-        if not verify_password(password, user.password_hash):
+        password_ok, new_hash = await verify_and_update_async(password, user.password_hash)
+        if not password_ok:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid admin credentials"
             )
+        if new_hash:
+            # Cost factor changed since this hash was made
+            user.password_hash = new_hash
+            db.commit()
 
         admin = db.query(Admin).filter(Admin.user_id == user.id).first()
         if not admin:
@@ -462,7 +453,8 @@ async def admin_login(
         access_token = create_admin_token(
             email=user.email,
             user_id=user.id,
-            is_super_admin=admin.is_super_admin
+            is_super_admin=admin.is_super_admin,
+            version=user.token_version or 0
         )
         
         return {
@@ -476,6 +468,8 @@ async def admin_login(
                 "is_super_admin": admin.is_super_admin
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -484,6 +478,7 @@ async def admin_login(
     
 #Fetch available admins
 @app.get("/admins", response_model=List[AdminResponse])
+@query_budget(3)
 async def get_all_admins(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_super_admin)  # Only super admins can access
@@ -494,7 +489,7 @@ async def get_all_admins(
     """
     try:
         # Query all admin users with their related User information
-        admins = db.query(Admin).join(User).all()
+        admins = db.query(Admin).join(User).options(contains_eager(Admin.user)).all()
         
         return [
             {
@@ -518,7 +513,7 @@ async def get_all_admins(
 async def get_registration_requests(
     status: Optional[str] = None,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    claims: TokenClaims = Depends(require_admin)
 ):
     try:
         query = db.query(ProviderRegistrationRequest)
@@ -679,7 +674,7 @@ async def register_homeowner(
         # Create base User - use lowercase 'homeowner'
         new_user = User(
             email=email,
-            password_hash=hash_password(password),
+            password_hash=await hash_password_async(password),
             full_name=full_name,
             phone_number=phone_number,
             address=address,  # Address now stored in User table
@@ -776,11 +771,16 @@ def signin(
             detail="User does not have this role"
         )
     
-    if not verify_password(password, user.password_hash):
+    password_ok, new_hash = verify_and_update(password, user.password_hash)
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect password"
         )
+    if new_hash:
+        # Cost factor changed since this hash was made
+        user.password_hash = new_hash
+        db.commit()
     
     # For service providers, check verification status
     if role == UserRole.SERVICEPROVIDERS:
@@ -798,11 +798,7 @@ def signin(
                 status_code=200,
                 content={
                     "access_token": create_access_token(
-                        data={
-                            "sub": user.email,
-                            "user_id": str(user.id),  # Convert to string
-                            "role": user.role
-                        }
+                        data=user_claims(user, provider_id=provider.id)
                     ),
                     "token_type": "bearer",
                     "role": role.value,
@@ -813,13 +809,17 @@ def signin(
                 }
             )
     
-    # Generate token with user details
+    # Generate token with user details. Role-specific ids are embedded so
+    # handlers can authorize from the token alone.
+    homeowner_id = None
+    if role == UserRole.HOMEOWNERS:
+        homeowner_id = db.query(HomeOwner.id).filter(HomeOwner.user_id == user.id).scalar()
     access_token = create_access_token(
-        data={
-            "sub": user.email,
-            "user_id": str(user.id),  # Convert to string
-            "role": user.role
-        }
+        data=user_claims(
+            user,
+            provider_id=provider.id if role == UserRole.SERVICEPROVIDERS else None,
+            homeowner_id=homeowner_id
+        )
     )
 
     # Determine dashboard URL based on role
@@ -876,16 +876,9 @@ async def create_service(
         # Handle image upload
         image_url = None
         if image:
-            # Generate unique filename
-            file_ext = os.path.splitext(image.filename)[1]
-            unique_filename = f"{uuid.uuid4()}{file_ext}"
-            file_path = os.path.join(UPLOAD_DIR, unique_filename)
-            
-            # Save the file
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(image.file, buffer)
-            
-            image_url = f"/static/uploads/{unique_filename}"
+            stored = await save_upload(image, max_bytes=MAX_IMAGE_BYTES, allowed_types=IMAGE_TYPES)
+            schedule_variants(stored)
+            image_url = stored.url
 
         # Create the service
         db_service = Service(
@@ -921,8 +914,8 @@ async def delete_service(
     current_user: User = Depends(get_current_user)
 ):
     try:
-        # Get the service to delete
-        db_service = db.query(Service).filter(Service.id == service_id).first()
+        # Get the service to delete, locked so no rating lands between the provider update and the delete
+        db_service = db.query(Service).filter(Service.id == service_id).with_for_update().first()
         if not db_service:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -941,6 +934,8 @@ async def delete_service(
                 detail="You don't have permission to delete this service"
             )
 
+        # Its bookings and reviews go with it, so they stop counting towards the provider
+        ratings.remove_service(db, db_service.id)
         db.delete(db_service)
         db.commit()
         
@@ -1003,13 +998,36 @@ async def update_service(
 
 @app.get("/services/", response_model=List[ServiceSchema])
 async def read_services(
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    category: Optional[str] = None,
+    q: Optional[str] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    min_rating: Optional[float] = None,
+    verified: Optional[bool] = None,
+    location: Optional[str] = None,
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    radius_km: Optional[float] = Query(None, gt=0, le=GEO_MAX_RADIUS_KM),
+    sort: str = "newest",
+    cursor: Optional[str] = None
 ):
+    """
+    List active services. The next page's cursor is returned in the X-Next-Cursor header.
+    """
     try:
-        services = db.query(Service).offset(skip).limit(limit).all()
-        return services  # FastAPI will automatically use ServiceSchema to serialize
+        body, next_cursor = get_catalog_page(db, CatalogQuery(
+            category=category, q=q, min_price=min_price, max_price=max_price,
+            min_rating=min_rating, verified=verified, location=location,
+            lat=lat, lon=lon, radius_km=radius_km,
+            sort=sort, limit=limit, cursor=cursor, offset=skip,
+        ))
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return Response(content=body, media_type="application/json", headers=headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1017,6 +1035,26 @@ async def read_services(
         )
     
 
+@app.get("/services/search", response_model=List[ServiceSchema])
+async def search_services_endpoint(
+    q: str = Query(..., min_length=1),
+    location: Optional[str] = None,
+    max_price: Optional[float] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Full-text search over active services, best match first
+    """
+    try:
+        return service_list.response(service for service, _ in search_services(db, q, location, max_price, limit))
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error searching services: {str(e)}"
+        )
+
+
 @app.get("/services/{service_id}", response_model=ServiceSchema)
 async def read_service(
     service_id: int,
@@ -1040,7 +1078,7 @@ async def read_service(
 @app.get("/provider/services", response_model=List[ServiceSchema])
 async def get_provider_services(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Get all services for the current provider
@@ -1053,12 +1091,7 @@ async def get_provider_services(
                 detail="Only service providers can access this endpoint"
             )
 
-        # Get the provider record
-        provider = db.query(ServiceProvider).filter(
-            ServiceProvider.user_id == current_user.id
-        ).first()
-        
-        if not provider:
+        if not current_user.provider_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Provider not found"
@@ -1066,10 +1099,10 @@ async def get_provider_services(
 
         # Get all services for this provider
         services = db.query(Service).filter(
-            Service.provider_id == provider.id
+            Service.provider_id == current_user.provider_id
         ).order_by(Service.created_at.desc()).all()
 
-        return services
+        return service_list.response(services)
     except HTTPException:
         raise
     except Exception as e:
@@ -1081,12 +1114,12 @@ async def get_provider_services(
 
 @app.get("/auth/validate")
 async def validate_token(
-    current_user: User = Depends(get_current_admin_user)
+    claims: TokenClaims = Depends(require_admin)
 ):
     return {
         "valid": True,
-        "user_id": current_user.id,
-        "email": current_user.email
+        "user_id": claims.user_id,
+        "email": claims.sub
     }
 
 @app.get("/admins/me")
@@ -1101,14 +1134,15 @@ async def get_current_admin(
     }
 
 @app.get("/providers")
+@query_budget(2)
 async def get_providers(
     verified: bool = True,
     limit: int = 6,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    claims: TokenClaims = Depends(require_admin)
 ):
     try:
-        providers = db.query(ServiceProvider).filter(
+        providers = db.query(ServiceProvider).options(joinedload(ServiceProvider.user)).filter(
             ServiceProvider.is_verified == verified
         ).limit(limit).all()
         
@@ -1158,8 +1192,8 @@ async def rate_booking(
             detail="Rating must be between 1 and 5"
         )
 
-    # Get the booking
-    booking = db.query(Booking).filter(Booking.id == booking_id).first()
+    # Get the booking, locked so concurrent ratings apply their deltas in turn
+    booking = db.query(Booking).filter(Booking.id == booking_id).with_for_update().first()
     if not booking:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -1173,33 +1207,17 @@ async def rate_booking(
             detail="Only completed bookings can be rated."
         )
 
-    # Update booking rating
-    booking.rating = rating_input.rating
-    db.add(booking)
-    
-    # Update service average rating
-    service = db.query(Service).filter(Service.id == booking.service_id).first()
-    if service:
-        # Get all non-null ratings for this service
-        ratings = db.query(Booking.rating).filter(
-            Booking.service_id == service.id,
-            Booking.rating.isnot(None)
-        ).all()
-        
-        if ratings:
-            # Calculate new average
-            avg_rating = sum(r[0] for r in ratings) / len(ratings)
-            service.rating = math.ceil(avg_rating * 10) / 10  # Round to 1 decimal place
-            db.add(service)
-    
+    # Update booking rating and the service's running totals
+    ratings.rate_booking(db, booking, rating_input.rating)
     db.commit()
     
+    service = db.query(Service.rating_sum, Service.rating_count).filter(Service.id == booking.service_id).first()
     return {
         "message": "Rating submitted successfully!",
         "booking_id": booking_id,
         "service_id": booking.service_id,
         "new_rating": rating_input.rating,
-        "service_avg_rating": service.rating if service else None
+        "service_avg_rating": round(ratings.average(*service), 1) if service and service.rating_count else None
     }
 
 async def get_current_homeowner(
@@ -1211,13 +1229,7 @@ async def get_current_homeowner(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+    email = decode_token(token).sub
     
     user = db.query(User).filter(User.email == email).first()
     if user is None:
@@ -1269,7 +1281,8 @@ async def refresh_token(
     new_token = create_admin_token(
         email=current_admin.email,
         user_id=current_admin.id,
-        is_super_admin=admin.is_super_admin
+        is_super_admin=admin.is_super_admin,
+        version=current_admin.token_version or 0
     )
     
     return {
@@ -1279,15 +1292,40 @@ async def refresh_token(
 
 @app.get("/auth/validate-admin")
 async def validate_admin_token(
-    current_user: User = Depends(get_current_admin_user)
+    claims: TokenClaims = Depends(require_admin)
 ):
     return {
         "valid": True,
-        "user_id": current_user.id,
-        "email": current_user.email,
-        "is_super_admin": current_user.admin.is_super_admin
+        "user_id": claims.user_id,
+        "email": claims.sub,
+        "is_super_admin": claims.is_super_admin
     }
 
+@app.get("/admin/db/pool")
+async def get_db_pool_status(
+    claims: TokenClaims = Depends(require_admin)
+):
+    """Current connection pool usage, for sizing against max_connections"""
+    return pool_status(engine)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint, enabled by setting METRICS_TOKEN; scrapers send it as a bearer token"""
+    token = os.getenv("METRICS_TOKEN")
+    if not token:
+        # Off unless configured: the metrics name every route, admin ones included
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {token}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(content=metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/recommendations/cache")
+async def get_recommendation_cache_stats(
+    claims: TokenClaims = Depends(require_admin)
+):
+    """Hit rate of this worker's recommendation cache"""
+    return recommendation_cache.stats()
+
 
 import bookings
 
@@ -1327,6 +1365,8 @@ class MessageBase(BaseModel):
     class Config:
         from_attributes = True
 
+message_list = ListSerializer(MessageBase)
+
 class ConversationBase(BaseModel):
     id: UUID4
     user1_id: UUID4
@@ -1617,7 +1657,7 @@ async def get_user_conversations(
                 "unread_count": unread_count
             })
 
-        return result
+        return trusted_response(result)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1628,7 +1668,7 @@ async def get_user_conversations(
 @app.get("/messages/contacts", response_model=List[Contact])
 async def get_contacts(
     current_user: User = Depends(get_current_user_for_messaging),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get all contacts (users with whom the current user has exchanged messages)
@@ -1738,7 +1778,7 @@ async def get_conversation(
             )
 
         # Get all messages between current user and the contact
-        messages = db.query(Message).filter(
+        messages = db.query(Message).options(joinedload(Message.sender)).filter(
             ((Message.sender_id == current_user.id) & (Message.receiver_id == contact_user.id)) |
             ((Message.sender_id == contact_user.id) & (Message.receiver_id == current_user.id))
         ).order_by(Message.timestamp.asc()).all()
@@ -1749,12 +1789,11 @@ async def get_conversation(
             (Message.receiver_id == current_user.id) &
             (Message.read == False)
         ).update({"read": True})
-        db.commit()
 
-        # Format response with sender info and role
+        # Format response with sender info and role, before the commit expires the loaded rows
         response = []
         for message in messages:
-            sender = db.query(User).filter(User.id == message.sender_id).first()
+            sender = message.sender
             if not sender:
                 continue
 
@@ -1767,18 +1806,20 @@ async def get_conversation(
                 sender_role = "admin"
 
             response.append({
-                "id": str(message.id),
-                "sender_id": str(message.sender_id),
-                "receiver_id": str(message.receiver_id),
+                "id": message.id,
+                "sender_id": message.sender_id,
+                "receiver_id": message.receiver_id,
+                "conversation_id": message.conversation_id,
                 "sender_name": sender.full_name,
                 "sender_role": sender_role,
                 "sender_image": getattr(sender, 'profile_image', None),
                 "content": message.content,
-                "timestamp": message.timestamp.isoformat(),
+                "timestamp": message.timestamp,
                 "read": message.read
             })
+        db.commit()
 
-        return response
+        return message_list.response(response)
 
     except HTTPException:
         raise
@@ -1794,7 +1835,7 @@ async def get_conversation(
 @app.post("/messages/send", response_model=MessageBase)
 async def send_message(
     message_data: MessageCreate,
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     try:
@@ -1834,14 +1875,13 @@ async def send_message(
         db.commit()
         db.refresh(new_message)
 
-        sender = db.query(User).filter(User.id == current_user.id).first()
         message_data = {
             "id": str(new_message.id),
             "sender_id": str(new_message.sender_id),
             "receiver_id": str(new_message.receiver_id),
-            "sender_name": sender.full_name,
-            "sender_role": sender.role.lower(),
-            "sender_image": getattr(sender, 'profile_image', None),
+            "sender_name": current_user.full_name,
+            "sender_role": current_user.role.lower(),
+            "sender_image": current_user.profile_image,
             "content": new_message.content,
             "timestamp": new_message.timestamp.isoformat(),
             "read": new_message.read,
@@ -2090,6 +2130,7 @@ async def update_user_profile(
                 db.query(ServiceProvider).filter(ServiceProvider.user_id == current_user.id).update(provider_updates)
         
         db.commit()
+        invalidate_principal(current_user.id)
         
         return {"message": "Profile updated successfully"}
     except Exception as e:
@@ -2108,14 +2149,31 @@ async def change_password(
     db: Session = Depends(get_db)
 ):
     # Verify current password
-    if not current_user.verify_password(request.password):
+    if not await verify_password_async(request.password, current_user.password_hash):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     
     # Update to new password
-    current_user.update_password(request.new_password)
+    current_user.password_hash = await hash_password_async(request.new_password)
+    current_user.updated_at = datetime.utcnow()
+    # Tokens issued before the change stop working; hand back a fresh one
+    revoke_user_tokens(db, current_user.id)
     db.commit()
+    db.refresh(current_user)
+    invalidate_principal(current_user.id)
+    principal = load_principal(db, User.id == current_user.id)
     
-    return {"message": "Password updated successfully"}
+    return {
+        "message": "Password updated successfully",
+        "access_token": create_access_token(
+            data=user_claims(
+                current_user,
+                provider_id=principal.provider_id,
+                homeowner_id=principal.homeowner_id,
+                is_super_admin=principal.is_super_admin
+            )
+        ),
+        "token_type": "bearer"
+    }
 
 # Notification Preferences Endpoints
 @app.get("/users/notification-preferences", response_model=dict)
@@ -2195,41 +2253,22 @@ async def upload_avatar(
     db: Session = Depends(get_db)
 ):
     try:
-        # Validate file type
-        allowed_types = ["image/jpeg", "image/png", "image/gif"]
-        if avatar.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400,
-                detail="Only JPEG, PNG or GIF images are allowed"
-            )
+        # Streamed to disk; type comes from the file's magic bytes, size capped at 2MB
+        stored = await save_upload(
+            avatar,
+            max_bytes=MAX_AVATAR_BYTES,
+            allowed_types={"image/jpeg", "image/png", "image/gif"},
+        )
 
-        # Validate file size (max 2MB)
-        max_size = 2 * 1024 * 1024  # 2MB
-        contents = await avatar.read()
-        if len(contents) > max_size:
-            raise HTTPException(
-                status_code=400,
-                detail="File size exceeds 2MB limit"
-            )
+        schedule_variants(stored)
 
-        # Generate unique filename
-        file_ext = os.path.splitext(avatar.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_ext}"
-        file_path = os.path.join(UPLOAD_DIR, "avatars", unique_filename)
-        
-        # Create avatars directory if it doesn't exist
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            buffer.write(contents)
-        
         # Update user record with new avatar path
-        avatar_url = f"/static/uploads/avatars/{unique_filename}"
+        avatar_url = stored.url
         db.query(User).filter(User.id == current_user.id).update({
             "profile_image": avatar_url
         })
         db.commit()
+        invalidate_principal(current_user.id)
         
         return {
             "message": "Avatar uploaded successfully",
@@ -2266,7 +2305,8 @@ async def get_user_profile(user_id: str, db: Session = Depends(get_db)):
             "id": str(user.id),
             "email": user.email,
             "full_name": user.full_name,
-            "avatar_url": avatar_url
+            "avatar_url": avatar_url,
+            "avatar_variants": variant_urls(user.profile_image)
         }
         
     except Exception as e:
@@ -2280,22 +2320,19 @@ async def delete_avatar(
 ):
     """Remove user's avatar"""
     try:
-        if not current_user.avatar:
+        if not current_user.profile_image:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="No avatar to delete"
             )
-        
-        # Delete file from storage
-        avatar_path = current_user.avatar.replace("/static/uploads/", UPLOAD_DIR)
-        if os.path.exists(avatar_path):
-            os.remove(avatar_path)
-        
-        # Update user record
+
+        # Blobs can be shared by other rows, so the file itself is left to
+        # `python uploads.py` garbage collection once nothing references it
         db.query(User).filter(User.id == current_user.id).update({
-            "avatar": None
+            "profile_image": None
         })
         db.commit()
+        invalidate_principal(current_user.id)
         
         return {"message": "Avatar removed successfully"}
     except HTTPException:
@@ -2311,19 +2348,14 @@ async def delete_avatar(
 # Dashboard Statistics Endpoints
 @app.get("/bookings/stats")
 async def get_booking_stats(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     Get booking statistics for the current homeowner
     """
     try:
-        # Get the homeowner record for the current user
-        homeowner = db.query(HomeOwner).filter(
-            HomeOwner.user_id == current_user.id
-        ).first()
-        
-        if not homeowner:
+        if not current_user.homeowner_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Homeowner record not found"
@@ -2331,12 +2363,12 @@ async def get_booking_stats(
 
         # Count total bookings using homeowner_id
         total_bookings = db.query(Booking).filter(
-            Booking.homeowner_id == homeowner.id
+            Booking.homeowner_id == current_user.homeowner_id
         ).count()
 
         # Count active bookings (pending or confirmed) using homeowner_id
         active_bookings = db.query(Booking).filter(
-            Booking.homeowner_id == homeowner.id,
+            Booking.homeowner_id == current_user.homeowner_id,
             Booking.status.in_([BookingStatus.PENDING.value, BookingStatus.CONFIRMED.value])
         ).count()
 
@@ -2352,19 +2384,14 @@ async def get_booking_stats(
 
 @app.get("/reviews/stats")
 async def get_review_stats(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
     Get review statistics for the current homeowner
     """
     try:
-        # Get the homeowner record for the current user
-        homeowner = db.query(HomeOwner).filter(
-            HomeOwner.user_id == current_user.id
-        ).first()
-        
-        if not homeowner:
+        if not current_user.homeowner_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Homeowner record not found"
@@ -2372,7 +2399,7 @@ async def get_review_stats(
 
         # Count reviews given by this homeowner using homeowner_id
         reviews_given = db.query(Review).filter(
-            Review.homeowner_id == homeowner.id
+            Review.homeowner_id == current_user.homeowner_id
         ).count()
 
         return {
@@ -2388,8 +2415,8 @@ async def get_review_stats(
 
 @app.get("/reviews/provider")
 async def get_provider_reviews(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Get all reviews for services provided by the current service provider
@@ -2402,12 +2429,7 @@ async def get_provider_reviews(
                 detail="Only service providers can access this endpoint"
             )
 
-        # Get the provider record
-        provider = db.query(ServiceProvider).filter(
-            ServiceProvider.user_id == current_user.id
-        ).first()
-        
-        if not provider:
+        if not current_user.provider_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Provider not found"
@@ -2419,7 +2441,7 @@ async def get_provider_reviews(
         ).join(
             Service, Booking.service_id == Service.id
         ).filter(
-            Service.provider_id == provider.id
+            Service.provider_id == current_user.provider_id
         ).order_by(
             Review.created_at.desc()
         ).all()
@@ -2474,7 +2496,7 @@ async def get_provider_reviews(
 
 @app.get("/messages/stats")
 async def get_message_stats(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -2499,7 +2521,7 @@ async def get_message_stats(
 
 @app.get("/messages/stats")
 async def get_message_stats(
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_principal),
     db: Session = Depends(get_db)
 ):
     """
@@ -2526,8 +2548,8 @@ async def get_message_stats(
 
 @app.get("/reviews/provider")
 async def get_provider_reviews(
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_principal)
 ):
     """
     Get all reviews for services provided by the current service provider
@@ -2540,12 +2562,7 @@ async def get_provider_reviews(
                 detail="Only service providers can access this endpoint"
             )
 
-        # Get the provider record
-        provider = db.query(ServiceProvider).filter(
-            ServiceProvider.user_id == current_user.id
-        ).first()
-        
-        if not provider:
+        if not current_user.provider_id:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Provider not found"
@@ -2557,7 +2574,7 @@ async def get_provider_reviews(
         ).join(
             Service, Booking.service_id == Service.id
         ).filter(
-            Service.provider_id == provider.id
+            Service.provider_id == current_user.provider_id
         ).order_by(
             Review.created_at.desc()
         ).all()
@@ -2733,8 +2750,8 @@ async def create_report(
 @app.get("/get/reports")
 async def get_reports(
     status: Optional[str] = None,  # Make status optional
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_admin_user)
+    db: Session = Depends(get_read_db),
+    claims: TokenClaims = Depends(require_admin)
 ):
     try:
         query = db.query(ReportModel)
@@ -2771,14 +2788,8 @@ async def get_reports(
 async def get_report_details(
     report_id: str,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    claims: TokenClaims = Depends(require_admin)
 ):
-    if current_user.role != "admin":
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Only admins can view report details"
-        )
-    
     report = await get_report_or_404(db, report_id)
     return report
 
@@ -2860,6 +2871,7 @@ async def warn_provider(
     }
 
 @app.post("/reports/{report_id}/suspend", response_model=dict)
+@query_budget(12)
 async def suspend_provider(
     report_id: str,
     data: SuspendProvider,
@@ -2890,8 +2902,9 @@ async def suspend_provider(
     provider.status = "suspended"
     provider.suspension_end_date = suspension_end
     
-    upcoming_bookings = db.query(Booking).filter(
-        Booking.service.has(provider_id=report.provider_id),
+    # report.provider_id is the provider's user id, not ServiceProvider.id
+    upcoming_bookings = db.query(Booking).options(joinedload(Booking.service)).filter(
+        Booking.service.has(Service.provider.has(ServiceProvider.user_id == report.provider_id)),
         Booking.status.in_(["pending", "confirmed"])
     ).all()
     
@@ -2905,7 +2918,9 @@ async def suspend_provider(
             message=f"Your booking for '{booking.service.title}' was cancelled due to provider suspension"
         )
     
+    revoke_user_tokens(db, report.provider_id)
     db.commit()
+    invalidate_principal(report.provider_id)
     
     await notify_user(
         user_id=report.provider_id,
@@ -2968,11 +2983,9 @@ async def notify_user(user_id: str, title: str, message: str):
 
 from schemas import EmailCheck, PasswordReset, PasswordResetConfirm
 
-from jose import JWTError, jwt
 from typing_extensions import Annotated
 from pydantic import BaseModel
 from pydantic import UUID4
-import math
 
 # from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 # from pydantic import EmailStr
@@ -0,0 +1,160 @@
+import math
+import threading
+from bisect import bisect_left
+from typing import Dict, Iterable, Optional, Tuple
+
+# Default bucket boundaries in seconds, tuned for request / DB timings
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+class Gauge:
+    def __init__(self, name: str, description: str = ""):
+        self.name = name
+        self.description = description
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0.0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    def __init__(self, name: str, description: str = "", buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = [0] * (len(self.buckets) + 1) + [0.0]
+                self._values[key] = row
+            row[idx] += 1
+            row[-1] += value
+
+    def count(self, **labels) -> int:
+        row = self._values.get(tuple(sorted(labels.items())))
+        return sum(row[:-1]) if row else 0
+
+    def sum(self, **labels) -> float:
+        row = self._values.get(tuple(sorted(labels.items())))
+        return row[-1] if row else 0.0
+
+    def samples(self):
+        """Cumulative bucket samples in Prometheus order"""
+        out = []
+        with self._lock:
+            items = [(key, list(row)) for key, row in self._values.items()]
+        for key, row in items:
+            labels = dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, row):
+                cumulative += bucket_count
+                out.append((f"{self.name}_bucket", {**labels, "le": repr(bound)}, cumulative))
+            cumulative += row[len(self.buckets)]
+            out.append((f"{self.name}_bucket", {**labels, "le": "+Inf"}, cumulative))
+            out.append((f"{self.name}_count", labels, cumulative))
+            out.append((f"{self.name}_sum", labels, row[-1]))
+        return out
+
+
+_registry: Dict[str, object] = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name: str, description: str, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = cls(name, description, **kwargs)
+            _registry[name] = metric
+        return metric
+
+
+def counter(name: str, description: str = "") -> Counter:
+    return _get_or_create(Counter, name, description)
+
+
+def gauge(name: str, description: str = "") -> Gauge:
+    return _get_or_create(Gauge, name, description)
+
+
+def histogram(name: str, description: str = "", buckets: Optional[Iterable[float]] = None) -> Histogram:
+    if buckets is None:
+        return _get_or_create(Histogram, name, description)
+    return _get_or_create(Histogram, name, description, buckets=buckets)
+
+
+def all_metrics():
+    with _registry_lock:
+        return list(_registry.values())
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def render_prometheus() -> str:
+    """Every registered metric in the Prometheus text exposition format (0.0.4)"""
+    types = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}
+    lines = []
+    for metric in sorted(all_metrics(), key=lambda m: m.name):
+        lines.append(f"# HELP {metric.name} {_escape(metric.description)}")
+        lines.append(f"# TYPE {metric.name} {types[type(metric)]}")
+        for name, labels, value in metric.samples():
+            if labels:
+                label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                name = f"{name}{{{label_text}}}"
+            lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,24 @@
+"""add latitude/longitude to service providers
+
+Revision ID: add_geo_columns
+Revises: add_service_search
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_geo_columns'
+down_revision = 'add_service_search'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('serviceproviders', sa.Column('latitude', sa.Float, nullable=True))
+    op.add_column('serviceproviders', sa.Column('longitude', sa.Float, nullable=True))
+    # Existing addresses are geocoded with `python geo.py`
+
+def downgrade():
+    op.drop_column('serviceproviders', 'longitude')
+    op.drop_column('serviceproviders', 'latitude')
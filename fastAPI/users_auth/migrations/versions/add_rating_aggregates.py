@@ -0,0 +1,50 @@
+"""add rating_sum / rating_count to services and serviceproviders
+
+Revision ID: add_rating_aggregates
+Revises: add_service_features
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_rating_aggregates'
+down_revision = 'add_service_features'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    for table in ('services', 'serviceproviders'):
+        op.add_column(table, sa.Column('rating_sum', sa.Integer, nullable=False, server_default='0'))
+        op.add_column(table, sa.Column('rating_count', sa.Integer, nullable=False, server_default='0'))
+
+    # Reviews, plus booking ratings of bookings without a review (see ratings.py)
+    op.execute("""
+        UPDATE services SET rating_sum = t.rating_sum, rating_count = t.rating_count,
+               rating = ROUND(t.rating_sum::float / t.rating_count)
+        FROM (
+            SELECT service_id, SUM(rating) AS rating_sum, COUNT(*) AS rating_count FROM (
+                SELECT service_id, rating FROM reviews
+                UNION ALL
+                SELECT b.service_id, b.rating FROM bookings b
+                WHERE b.rating IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM reviews r WHERE r.booking_id = b.id)
+            ) AS ratings
+            GROUP BY service_id
+        ) AS t
+        WHERE services.id = t.service_id
+    """)
+    op.execute("""
+        UPDATE serviceproviders SET rating_sum = t.rating_sum, rating_count = t.rating_count
+        FROM (
+            SELECT provider_id, SUM(rating_sum) AS rating_sum, SUM(rating_count) AS rating_count
+            FROM services WHERE provider_id IS NOT NULL GROUP BY provider_id
+        ) AS t
+        WHERE serviceproviders.id = t.provider_id
+    """)
+
+def downgrade():
+    for table in ('serviceproviders', 'services'):
+        op.drop_column(table, 'rating_count')
+        op.drop_column(table, 'rating_sum')
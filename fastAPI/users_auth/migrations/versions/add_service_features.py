@@ -0,0 +1,36 @@
+"""add service_features ranking table
+
+Revision ID: add_service_features
+Revises: add_geo_columns
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID
+
+# revision identifiers, used by Alembic.
+revision = 'add_service_features'
+down_revision = 'add_geo_columns'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        'service_features',
+        sa.Column('service_id', UUID(as_uuid=True),
+                  sa.ForeignKey('services.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('bayes_rating', sa.Float, nullable=False),
+        sa.Column('rating_count', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('completion_rate', sa.Float, nullable=False),
+        sa.Column('cancellation_rate', sa.Float, nullable=False),
+        sa.Column('booking_velocity', sa.Float, nullable=False, server_default='0'),
+        sa.Column('response_minutes', sa.Float, nullable=True),
+        sa.Column('updated_at', sa.DateTime, nullable=False),
+    )
+    op.create_index('ix_service_features_updated_at', 'service_features', ['updated_at'])
+    # Filled by `python features.py --full`
+
+def downgrade():
+    op.drop_index('ix_service_features_updated_at', table_name='service_features')
+    op.drop_table('service_features')
@@ -0,0 +1,34 @@
+"""add service full-text and trigram search indexes
+
+Revision ID: add_service_search
+Revises: add_user_token_version
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'add_service_search'
+down_revision = 'add_user_token_version'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        "ALTER TABLE services ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED"
+    )
+    op.execute("CREATE INDEX IF NOT EXISTS ix_services_search_vector ON services USING gin (search_vector)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_services_title_trgm ON services USING gin (title gin_trgm_ops)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_serviceproviders_address_trgm "
+        "ON serviceproviders USING gin (address gin_trgm_ops)"
+    )
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_serviceproviders_address_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_services_title_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_services_search_vector")
+    op.execute("ALTER TABLE services DROP COLUMN IF EXISTS search_vector")
@@ -0,0 +1,21 @@
+"""add user token version
+
+Revision ID: add_user_token_version
+Revises: add_password_reset_tokens
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'add_user_token_version'
+down_revision = 'add_password_reset_tokens'
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.add_column('users', sa.Column('token_version', sa.Integer, nullable=False, server_default='0'))
+
+def downgrade():
+    op.drop_column('users', 'token_version')
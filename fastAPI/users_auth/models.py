@@ -10,8 +10,6 @@ from sqlalchemy.dialects.postgresql import UUID
 from typing import Dict, Any
 from sqlalchemy import JSON
 from sqlalchemy import func
-from sqlalchemy.orm import Session
-from sqlalchemy import event
 
 class UserRole(str, Enum):
     HOMEOWNERS = "homeowners"
@@ -30,9 +28,7 @@ class BookingStatus(str, Enum):
     CANCELLED = "cancelled"
 
 
-from passlib.context import CryptContext
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from passwords import hash_password, verify_password
 
 class ReportStatus(str, Enum):
     OPEN = "open"
@@ -92,6 +88,8 @@ class User(Base):
 
     status = Column(String, default="active")
     suspension_end_date = Column(DateTime(timezone=True))
+    # Bumped to revoke every token issued before (password change, suspension)
+    token_version = Column(Integer, default=0, server_default="0", nullable=False)
     
     reports_submitted = relationship("Report", foreign_keys=[Report.homeowner_id])
     reports_received = relationship("Report", foreign_keys=[Report.provider_id])
@@ -144,11 +142,11 @@ class User(Base):
     
     def verify_password(self, plain_password: str) -> bool:
         """Verify the provided password against the stored hash"""
-        return pwd_context.verify(plain_password, self.password_hash)
+        return verify_password(plain_password, self.password_hash)
     
     def update_password(self, new_password: str) -> None:
         """Update the user's password with a new hash"""
-        self.password_hash = pwd_context.hash(new_password)
+        self.password_hash = hash_password(new_password)
         self.updated_at = datetime.utcnow()
 
 
@@ -173,6 +171,12 @@ class ServiceProvider(Base):
     is_verified = Column(Boolean, default=False)
     verification_date = Column(DateTime)
     verification_by = Column(UUID(as_uuid=True), ForeignKey("users.id"))
+    # Geocoded from address (see geo.py)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    # Totals over all the provider's services, kept in step by ratings.py
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
     
     user = relationship("User", back_populates="serviceproviders", foreign_keys=[user_id])
     verified_by_admin = relationship("User", foreign_keys=[verification_by])
@@ -203,7 +207,9 @@ class Service(Base):
     description = Column(String)
     price = Column(Integer)
     image = Column(String, nullable=True)
-    rating = Column(Integer, default=0)
+    rating = Column(Integer, default=0)  # rounded average, kept in step by ratings.py
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count = Column(Integer, nullable=False, default=0, server_default="0")
     provider_name = Column(String)  
     created_at = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Boolean, default=True)
@@ -340,58 +346,17 @@ class Review(Base):
     
     def __repr__(self):
         return f"<Review {self.rating} stars for Booking {self.booking_id}>"
-    
 
-    @staticmethod
-    def update_service_rating(session, service_id):
-        """Update the average rating and review count for the service"""
-        # Calculate new average rating and count
-        result = session.query(
-            func.avg(Review.rating).label('rating'),
-            func.count(Review.id).label('review_count')
-        ).filter(
-            Review.service_id == service_id
-        ).first()
-        
-        # Update the service
-        service = session.query(Service).get(service_id)
-        if service and result.rating is not None:
-            service.rating = round(float(result.rating), 1)
-            service.review_count = result.review_count
-
-# Set up event listeners
-@event.listens_for(Session, 'after_flush')
-def after_flush(session, context):
-    """After flush handler to update service ratings"""
-    # Get all service_ids that need updating
-    service_ids = set()
-    
-    # Create a set of all service IDs from new, dirty, and deleted reviews
-    for instance in session.new:
-        if isinstance(instance, Review):
-            service_ids.add(instance.service_id)
-    
-    for instance in session.dirty:
-        if isinstance(instance, Review):
-            service_ids.add(instance.service_id)
-    
-    for instance in session.deleted:
-        if isinstance(instance, Review):
-            service_ids.add(instance.service_id)
-    
-    # If we have services to update, register an after_commit handler
-    if service_ids:
-        @event.listens_for(session, 'after_commit', once=True)
-        def after_commit(session):
-            # Create a new session to avoid conflicts with the flushed session
-            new_session = Session(bind=session.bind)
-            try:
-                for service_id in service_ids:
-                    Review.update_service_rating(new_session, service_id)
-                new_session.commit()
-            except Exception as e:
-                new_session.rollback()
-                raise e
-            finally:
-                new_session.close()
-   
\ No newline at end of file
+
+class ServiceFeature(Base):
+    """Ranking features per service, written by features.py (not by request handlers)"""
+    __tablename__ = "service_features"
+
+    service_id = Column(UUID(as_uuid=True), ForeignKey("services.id", ondelete="CASCADE"), primary_key=True)
+    bayes_rating = Column(Float, nullable=False)
+    rating_count = Column(Integer, nullable=False, default=0)
+    completion_rate = Column(Float, nullable=False)
+    cancellation_rate = Column(Float, nullable=False)
+    booking_velocity = Column(Float, nullable=False, default=0.0)  # bookings per day, last 30 days
+    response_minutes = Column(Float, nullable=True)  # median provider reply time
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
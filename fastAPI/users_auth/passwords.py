@@ -0,0 +1,149 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+import metrics
+
+# bcrypt cost factor. Raising it re-hashes users transparently on their next login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# "thread" is enough because the bcrypt backend releases the GIL; "process" isolates
+# the CPU work completely at the price of pickling each call.
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread").lower()
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Hash/verify calls allowed to wait for a worker before new ones are rejected with 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "64"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+QUEUE_DEPTH = metrics.gauge("password_hash_queue_depth", "Hash/verify calls waiting for a worker")
+IN_FLIGHT = metrics.gauge("password_hash_in_flight", "Hash/verify calls running on a worker")
+QUEUE_WAIT = metrics.histogram("password_hash_queue_wait_seconds", "Time spent waiting for a hashing worker")
+DURATION = metrics.histogram("password_hash_duration_seconds", "bcrypt hash/verify duration")
+REJECTED = metrics.counter("password_hash_rejected_total", "Calls rejected because the queue was full")
+REHASHED = metrics.counter("password_rehash_total", "Hashes upgraded to the current cost on login")
+
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE)
+_pending = 0
+_pending_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                if PASSWORD_HASH_EXECUTOR == "process":
+                    _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+                else:
+                    _executor = ThreadPoolExecutor(
+                        max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+                    )
+    return _executor
+
+
+# Worker functions live at module level so the process pool can pickle them
+def _hash(password: str) -> Tuple[str, float]:
+    start = time.perf_counter()
+    return pwd_context.hash(password), time.perf_counter() - start
+
+
+def _verify(password: str, hashed: str) -> Tuple[bool, float]:
+    start = time.perf_counter()
+    return pwd_context.verify(password, hashed), time.perf_counter() - start
+
+
+def _verify_and_update(password: str, hashed: str) -> Tuple[Tuple[bool, Optional[str]], float]:
+    start = time.perf_counter()
+    return pwd_context.verify_and_update(password, hashed), time.perf_counter() - start
+
+
+def _submit(fn, *args):
+    global _pending
+    if not _slots.acquire(blocking=False):
+        REJECTED.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent sign-in requests, please retry shortly",
+            headers={"Retry-After": "1"},
+        )
+    submitted = time.perf_counter()
+    with _pending_lock:
+        _pending += 1
+        _publish_depth()
+
+    def _done(f):
+        global _pending
+        with _pending_lock:
+            _pending -= 1
+            _publish_depth()
+        _slots.release()
+        if not f.cancelled() and f.exception() is None:
+            # Workers can't touch metrics when they run in another process, so queue
+            # wait is total latency minus the bcrypt time reported by the worker.
+            elapsed = f.result()[1]
+            DURATION.observe(elapsed)
+            QUEUE_WAIT.observe(max(time.perf_counter() - submitted - elapsed, 0.0))
+
+    try:
+        future = _get_executor().submit(fn, *args)
+    except Exception:
+        with _pending_lock:
+            _pending -= 1
+            _publish_depth()
+        _slots.release()
+        raise
+    future.add_done_callback(_done)
+    return future
+
+
+def _publish_depth():
+    IN_FLIGHT.set(min(_pending, PASSWORD_HASH_WORKERS))
+    QUEUE_DEPTH.set(max(_pending - PASSWORD_HASH_WORKERS, 0))
+
+
+def hash_password(password: str) -> str:
+    """Hash on the dedicated pool, blocking the calling (worker) thread"""
+    return _submit(_hash, password).result()[0]
+
+
+def verify_password(plain_password, hashed_password) -> bool:
+    return _submit(_verify, plain_password, hashed_password).result()[0]
+
+
+def verify_and_update(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    """Verify and return a replacement hash when the stored cost is outdated"""
+    (ok, new_hash), _ = _submit(_verify_and_update, plain_password, hashed_password).result()
+    if new_hash:
+        REHASHED.inc()
+    return ok, new_hash
+
+
+async def hash_password_async(password: str) -> str:
+    return (await asyncio.wrap_future(_submit(_hash, password)))[0]
+
+
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    return (await asyncio.wrap_future(_submit(_verify, plain_password, hashed_password)))[0]
+
+
+async def verify_and_update_async(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    (ok, new_hash), _ = await asyncio.wrap_future(
+        _submit(_verify_and_update, plain_password, hashed_password)
+    )
+    if new_hash:
+        REHASHED.inc()
+    return ok, new_hash
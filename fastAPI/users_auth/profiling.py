@@ -0,0 +1,252 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import metrics
+
+try:
+    from pyinstrument import Profiler as _Pyinstrument
+except ImportError:  # cProfile only
+    _Pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this, or issuing more statements, get their SQL (and
+# a profile, if sampled) written to PROFILE_DIR
+PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "1.0"))
+PROFILE_SLOW_QUERIES = int(os.getenv("PROFILE_SLOW_QUERIES", "50"))
+# Fraction of requests run under the profiler; profiling slows a request down
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# At most one dump per route in this many seconds, so a slow endpoint can't fill the disk
+PROFILE_DUMP_INTERVAL = float(os.getenv("PROFILE_DUMP_INTERVAL", "60"))
+# Statements kept per request for the dump; counting continues past it
+PROFILE_MAX_STATEMENTS = 500
+
+REQUEST_SECONDS = metrics.histogram("http_request_duration_seconds", "Request latency by route")
+REQUEST_STATEMENTS = metrics.histogram(
+    "http_request_db_statements", "SQL statements issued per request",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+REQUEST_DB_SECONDS = metrics.histogram("http_request_db_seconds", "Time spent in SQL per request")
+RESPONSE_BYTES = metrics.histogram(
+    "http_response_size_bytes", "Response body bytes sent",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+SLOW_REQUESTS = metrics.counter("http_slow_requests_total", "Requests over the slow thresholds")
+
+
+class RequestProfile:
+    """SQL statements and DB time of one request, filled in by the engine events
+
+    Statements are also recorded in the parent, the profile that was current
+    when this one started, so nested captures don't hide them from the request.
+    """
+
+    def __init__(self, parent: Optional["RequestProfile"] = None):
+        self.parent = parent
+        self.statement_count = 0
+        self.db_seconds = 0.0
+        self.statements: List[dict] = []
+
+    def record(self, statement: str, elapsed: float, executemany: bool) -> None:
+        profile = self
+        while profile is not None:
+            profile.statement_count += 1
+            profile.db_seconds += elapsed
+            if len(profile.statements) < PROFILE_MAX_STATEMENTS:
+                # Parameters are left out: they carry emails, password hashes and tokens
+                profile.statements.append({"sql": statement, "ms": round(elapsed * 1000, 3),
+                                           "executemany": executemany})
+            profile = profile.parent
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current.get()
+
+
+@contextmanager
+def capture_queries():
+    """Record the statements run inside the block into a fresh RequestProfile"""
+    profile = RequestProfile(parent=_current.get())
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    starts = conn.info.get("profile_query_start")
+    if profile is None or not starts:
+        return
+    profile.record(statement, time.perf_counter() - starts.pop(), executemany)
+
+
+def route_template(scope: Scope) -> str:
+    """Path template of the matched route, so metrics are not labelled per id"""
+    # Set by the router once the request is matched, before the response starts
+    return getattr(scope.get("route"), "path", "unmatched")
+
+
+class _Sampler:
+    """One profiler at a time per process: cProfile can't nest, and concurrent
+    requests on the event loop would all show up in each other's profiles"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def start(self):
+        if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if _Pyinstrument is not None:
+                profiler = _Pyinstrument(async_mode="enabled")
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+        except Exception as e:  # e.g. another profiler or debugger is attached
+            self._lock.release()
+            logger.warning("Could not start request profiler: %s", e)
+            return None
+        return profiler
+
+    def stop(self, profiler) -> None:
+        try:
+            if _Pyinstrument is not None:
+                profiler.stop()
+            else:
+                profiler.disable()
+        finally:
+            self._lock.release()
+
+
+_sampler = _Sampler()
+_last_dump = {}  # route -> time.monotonic() of its last dump
+_last_dump_lock = threading.Lock()
+
+
+def _should_dump(route: str) -> bool:
+    now = time.monotonic()
+    with _last_dump_lock:
+        if now - _last_dump.get(route, float("-inf")) < PROFILE_DUMP_INTERVAL:
+            return False
+        _last_dump[route] = now
+        return True
+
+
+def dump_slow_request(method: str, route: str, status: int, seconds: float, profile: RequestProfile,
+                      profiler=None) -> str:
+    """Write <stamp>-<route>.sql.json, plus .prof (cProfile) or .html (pyinstrument) if profiled"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", f"{method}{route}").strip("_")
+    base = os.path.join(PROFILE_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{slug}")
+    with open(f"{base}.sql.json", "w") as f:
+        json.dump({
+            "method": method,
+            "route": route,
+            "status": status,
+            "seconds": round(seconds, 4),
+            "statement_count": profile.statement_count,
+            "db_seconds": round(profile.db_seconds, 4),
+            "statements": profile.statements,
+        }, f, indent=2)
+    if profiler is not None:
+        if _Pyinstrument is not None:
+            with open(f"{base}.html", "w") as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.dump_stats(f"{base}.prof")
+    return base
+
+
+class ProfilingMiddleware:
+    """Per-route latency, SQL statement count, DB time and response size
+
+    Requests over PROFILE_SLOW_SECONDS or PROFILE_SLOW_QUERIES have their
+    statement list dumped to PROFILE_DIR, with a profile when the request
+    was one of the PROFILE_SAMPLE_RATE sampled ones. Only the event-loop
+    thread is profiled, so sync endpoints show up as time awaiting the
+    threadpool; their SQL is still captured.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(parent=_current.get())
+        token = _current.set(profile)
+        response = {"status": 500, "bytes": 0}
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        profiler = _sampler.start()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                _sampler.stop(profiler)
+            _current.reset(token)
+            await self._record(scope, response, seconds, profile, profiler)
+
+    async def _record(self, scope: Scope, response: dict, seconds: float, profile: RequestProfile,
+                      profiler) -> None:
+        route = route_template(scope)
+        method = scope["method"]
+        REQUEST_SECONDS.observe(seconds, route=route, method=method, status=str(response["status"]))
+        REQUEST_STATEMENTS.observe(profile.statement_count, route=route, method=method)
+        REQUEST_DB_SECONDS.observe(profile.db_seconds, route=route, method=method)
+        RESPONSE_BYTES.observe(response["bytes"], route=route, method=method)
+
+        if seconds < PROFILE_SLOW_SECONDS and profile.statement_count <= PROFILE_SLOW_QUERIES:
+            return
+        SLOW_REQUESTS.inc(route=route, method=method)
+        if not _should_dump(route):
+            return
+        try:
+            base = await run_in_threadpool(
+                dump_slow_request, method, route, response["status"], seconds, profile, profiler
+            )
+            logger.warning("Slow request %s %s: %.3fs, %d statements, %.3fs in SQL; details in %s.*",
+                           method, route, seconds, profile.statement_count, profile.db_seconds, base)
+        except OSError as e:
+            logger.warning("Could not write profile for %s %s: %s", method, route, e)
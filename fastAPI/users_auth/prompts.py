@@ -0,0 +1,167 @@
+import logging
+import os
+import string
+import textwrap
+from typing import Dict, List, Optional
+
+import metrics
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # not installed, or the BPE file can't be fetched: estimate instead
+    _encoding = None
+
+logger = logging.getLogger(__name__)
+
+# Recent messages sent verbatim; older ones are folded into the rolling summary
+PROMPT_WINDOW_MESSAGES = int(os.getenv("PROMPT_WINDOW_MESSAGES", "8"))
+# Token budget for summary plus window, so prompt size stops growing with the chat
+PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "1200"))
+PROMPT_SUMMARY_TOKENS = int(os.getenv("PROMPT_SUMMARY_TOKENS", "300"))
+# Characters of an evicted message kept in the summary
+SUMMARY_LINE_CHARS = 160
+# Role and separator tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+PROMPT_TOKENS = metrics.histogram("llm_prompt_tokens", "Prompt tokens per LLM call", buckets=_TOKEN_BUCKETS)
+COMPLETION_TOKENS = metrics.histogram("llm_completion_tokens", "Completion tokens per LLM call",
+                                      buckets=_TOKEN_BUCKETS)
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    # About four characters per token for English, and at least one per word
+    return max(len(text) // 4, len(text.split()))
+
+
+def estimate_messages(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+class PromptTemplate:
+    """str.format-style template, parsed once at import; render() only joins strings"""
+
+    def __init__(self, source: str):
+        self.source = textwrap.dedent(source).strip()
+        self._parts = []
+        for literal, field, spec, conversion in string.Formatter().parse(self.source):
+            if spec or conversion:
+                raise ValueError(f"Unsupported format spec in template field {field!r}")
+            self._parts.append((literal, field))
+        self.fields = {field for _, field in self._parts if field is not None}
+        self.static_tokens = estimate_tokens("".join(literal for literal, _ in self._parts))
+
+    def render(self, **values) -> str:
+        out = []
+        for literal, field in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(str(values[field]))
+        return "".join(out)
+
+
+# Static text goes first in every request: identical prefixes are what the
+# OpenAI prompt cache matches on, and they are never rendered twice here.
+EXTRACT_PARAMETERS_SYSTEM = PromptTemplate("""
+    Extract the following parameters from the user's message:
+    - job_type (e.g., plumbing, electrical)
+    - max_budget (numeric value, if mentioned)
+    - location (city or area, if mentioned)
+    - urgency (e.g., 'immediate', 'within_week', if mentioned)
+    If a parameter is not specified, return null for it.
+    Return the result as a JSON object.
+""").render()
+
+EXTRACT_PARAMETERS_BATCH_SYSTEM = PromptTemplate("""
+    The user sends a JSON array of messages. For each message, extract:
+    - job_type (e.g., plumbing, electrical)
+    - max_budget (numeric value, if mentioned)
+    - location (city or area, if mentioned)
+    - urgency (e.g., 'immediate', 'within_week', if mentioned)
+    If a parameter is not specified, return null for it.
+    Return a JSON object {{"results": [...]}} with one object per message, in the same order.
+""").render()
+
+ASSISTANT_SYSTEM = PromptTemplate("""
+    You are a friendly assistant for HomeHelp Connect, a platform connecting homeowners with service providers.
+    Respond naturally to the user's message, providing helpful information or asking clarifying questions.
+""").render()
+
+SUMMARY = PromptTemplate("Summary of the earlier conversation:\n{summary}")
+
+
+def _summary_line(message: Dict[str, str]) -> str:
+    text = " ".join(message["content"].split())
+    if len(text) > SUMMARY_LINE_CHARS:
+        text = text[:SUMMARY_LINE_CHARS - 3].rsplit(" ", 1)[0] + "..."
+    return f"- {message['role']}: {text}"
+
+
+class ConversationMemory:
+    """Sliding window of recent messages plus a rolling summary of older ones
+
+    Messages leaving the window are condensed to one line each, locally, so
+    keeping the prompt bounded costs no extra LLM call. The rendered prefix
+    (system prompt and summary) is cached until the summary changes.
+    """
+
+    def __init__(self, window: int = PROMPT_WINDOW_MESSAGES, budget: int = PROMPT_HISTORY_TOKENS,
+                 summary_budget: int = PROMPT_SUMMARY_TOKENS):
+        self.window = window
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.messages: List[Dict[str, str]] = []
+        self._tokens: List[int] = []
+        self.summary_lines: List[str] = []
+        self.summary_tokens = 0
+        self._prefixes: Dict[str, List[Dict[str, str]]] = {}
+
+    def add(self, role: str, content: str) -> None:
+        self.messages.append({"role": role, "content": content})
+        self._tokens.append(estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS)
+        # Always keep the newest message, however long
+        while len(self.messages) > 1 and (
+            len(self.messages) > self.window or sum(self._tokens) + self.summary_tokens > self.budget
+        ):
+            self._tokens.pop(0)
+            self._fold(self.messages.pop(0))
+
+    def _fold(self, message: Dict[str, str]) -> None:
+        self.summary_lines.append(_summary_line(message))
+        while len(self.summary_lines) > 1 and estimate_tokens("\n".join(self.summary_lines)) > self.summary_budget:
+            self.summary_lines.pop(0)
+        self.summary_tokens = estimate_tokens("\n".join(self.summary_lines)) + MESSAGE_OVERHEAD_TOKENS
+        self._prefixes.clear()
+
+    def prefix(self, system: str) -> List[Dict[str, str]]:
+        cached = self._prefixes.get(system)
+        if cached is None:
+            cached = [{"role": "system", "content": system}]
+            if self.summary_lines:
+                cached.append({"role": "system", "content": SUMMARY.render(summary="\n".join(self.summary_lines))})
+            self._prefixes[system] = cached
+        return cached
+
+    def build(self, system: str) -> List[Dict[str, str]]:
+        """Chat messages for the next call: prefix, then the window (ending with the user's turn)"""
+        return [*self.prefix(system), *self.messages]
+
+
+def log_usage(kind: str, messages: List[Dict[str, str]], response=None, session_id: Optional[str] = None) -> None:
+    """Log and record prompt size; uses the provider's counts when the response has them"""
+    estimated = estimate_messages(messages)
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or estimated
+    completion_tokens = getattr(usage, "completion_tokens", None)
+    PROMPT_TOKENS.observe(prompt_tokens, kind=kind)
+    if completion_tokens is not None:
+        COMPLETION_TOKENS.observe(completion_tokens, kind=kind)
+    logger.info(
+        "llm call kind=%s session=%s messages=%d prompt_tokens=%d estimated=%d completion_tokens=%s",
+        kind, session_id, len(messages), prompt_tokens, estimated, completion_tokens,
+    )
@@ -0,0 +1,135 @@
+import logging
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+import metrics
+from profiling import RequestProfile, capture_queries, current_profile, route_template
+
+logger = logging.getLogger(__name__)
+
+# off: nothing is checked; warn: log and count; strict: raise QueryBudgetExceeded,
+# which TestClient re-raises so the test (and CI) fails
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "warn").lower()
+# The same statement shape more often than this in one request is an N+1,
+# whether or not the route declares a budget
+QUERY_REPEAT_LIMIT = int(os.getenv("QUERY_REPEAT_LIMIT", "5"))
+
+BUDGET_EXCEEDED = metrics.counter("query_budget_exceeded_total", "Requests over their SQL statement budget")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|:\w+|\$\d+|%s|\?")
+# IN lists and VALUES rows of any length collapse to one shape
+_LIST = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Statement shape: literals and bind parameters replaced with ?, whitespace collapsed"""
+    shape = _STRING.sub("?", statement)
+    shape = _PLACEHOLDER.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    shape = _LIST.sub("(?)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+def repeated_shapes(profile: RequestProfile, limit: int) -> List[Tuple[str, int]]:
+    """Fingerprints seen more than limit times, most frequent first"""
+    counts = Counter(fingerprint(s["sql"]) for s in profile.statements)
+    return [(shape, n) for shape, n in counts.most_common() if n > limit]
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    statements: Optional[int] = None
+    repeats: int = QUERY_REPEAT_LIMIT
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(statements: Optional[int] = None, repeats: int = QUERY_REPEAT_LIMIT):
+    """Declare a route's SQL budget; goes below the @app.<method> decorator
+
+        @app.get("/providers")
+        @query_budget(3)
+        async def get_providers(...):
+
+    The endpoint is returned unchanged, so FastAPI sees the same signature.
+    """
+    def decorate(endpoint):
+        endpoint.query_budget = QueryBudget(statements, repeats)
+        return endpoint
+    return decorate
+
+
+def violations(profile: RequestProfile, budget: QueryBudget) -> List[str]:
+    problems = []
+    if budget.statements is not None and profile.statement_count > budget.statements:
+        problems.append(f"{profile.statement_count} statements, budget {budget.statements}")
+    for shape, count in repeated_shapes(profile, budget.repeats):
+        problems.append(f"{count}x (limit {budget.repeats}): {shape}")
+    return problems
+
+
+def report(label: str, profile: RequestProfile, budget: QueryBudget) -> None:
+    """Apply QUERY_BUDGET_MODE to any violations of budget"""
+    if QUERY_BUDGET_MODE == "off":
+        return
+    problems = violations(profile, budget)
+    if not problems:
+        return
+    BUDGET_EXCEEDED.inc(route=label)
+    message = f"Query budget exceeded for {label}:\n  " + "\n  ".join(problems)
+    if QUERY_BUDGET_MODE == "strict":
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+@contextmanager
+def assert_query_budget(statements: Optional[int] = None, repeats: int = QUERY_REPEAT_LIMIT, label: str = "block"):
+    """Fail if the block runs more statements, or repeats a shape more often, than allowed
+
+    Always strict, for use in tests and scripts:
+
+        with assert_query_budget(3):
+            client.get("/providers")
+    """
+    with capture_queries() as profile:
+        yield profile
+    problems = violations(profile, QueryBudget(statements, repeats))
+    if problems:
+        raise QueryBudgetExceeded(f"Query budget exceeded for {label}:\n  " + "\n  ".join(problems))
+
+
+class QueryBudgetMiddleware:
+    """Checks each request against its route's @query_budget after the response
+
+    Uses the statements ProfilingMiddleware collects when it is installed
+    outside this one, and collects its own otherwise.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or QUERY_BUDGET_MODE == "off":
+            await self.app(scope, receive, send)
+            return
+        profile = current_profile()
+        if profile is None:
+            with capture_queries() as profile:
+                await self.app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+        endpoint = getattr(scope.get("route"), "endpoint", None)
+        budget = getattr(endpoint, "query_budget", None) or QueryBudget()
+        report(f"{scope['method']} {route_template(scope)}", profile, budget)
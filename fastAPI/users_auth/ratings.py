@@ -0,0 +1,163 @@
+"""Running rating aggregates on services and providers
+
+A service's ratings are its reviews plus the booking ratings (rate_booking)
+of bookings without a review. Service.rating_sum / rating_count, and the
+same pair on ServiceProvider, are kept in step with single-statement
+increments in the caller's transaction, so a new rating costs two UPDATEs
+however many ratings a service already has. Service.rating is rewritten by
+the same UPDATE as the rounded average for the catalog and search.
+
+`python ratings.py` reports services and providers whose aggregates have
+drifted from the rows they summarise; --fix rewrites them.
+"""
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Float, Integer, case, cast, func, select, update
+from sqlalchemy.orm import Session
+
+from models import Booking, Review, Service, ServiceProvider
+
+logger = logging.getLogger(__name__)
+
+
+def average(rating_sum: int, rating_count: int) -> Optional[float]:
+    return rating_sum / rating_count if rating_count else None
+
+
+def apply_delta(db: Session, service_id, delta_sum: int, delta_count: int) -> None:
+    """Add to the service's and its provider's aggregates without reading them first"""
+    if not delta_sum and not delta_count:
+        return
+    new_sum = Service.rating_sum + delta_sum
+    new_count = Service.rating_count + delta_count
+    db.execute(
+        update(Service).where(Service.id == service_id).values(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating=case((new_count > 0, cast(func.round(cast(new_sum, Float) / new_count), Integer)), else_=0),
+        ).execution_options(synchronize_session=False)
+    )
+    db.execute(
+        update(ServiceProvider).where(
+            ServiceProvider.id == select(Service.provider_id).where(Service.id == service_id).scalar_subquery()
+        ).values(
+            rating_sum=ServiceProvider.rating_sum + delta_sum,
+            rating_count=ServiceProvider.rating_count + delta_count,
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def remove_service(db: Session, service_id) -> None:
+    """Take a service's totals off its provider; call before deleting the service
+
+    The service row should be locked (SELECT ... FOR UPDATE) so no rating
+    lands between this and the delete.
+    """
+    service_totals = select(Service.rating_sum, Service.rating_count).where(Service.id == service_id).subquery()
+    db.execute(
+        update(ServiceProvider).where(
+            ServiceProvider.id == select(Service.provider_id).where(Service.id == service_id).scalar_subquery()
+        ).values(
+            rating_sum=ServiceProvider.rating_sum - select(service_totals.c.rating_sum).scalar_subquery(),
+            rating_count=ServiceProvider.rating_count - select(service_totals.c.rating_count).scalar_subquery(),
+        ).execution_options(synchronize_session=False)
+    )
+
+
+def rate_booking(db: Session, booking: Booking, rating: int) -> None:
+    """Set booking.rating; counted only while the booking has no review"""
+    previous = booking.rating
+    booking.rating = rating
+    if booking.review is not None:
+        return
+    if previous is None:
+        apply_delta(db, booking.service_id, rating, 1)
+    else:
+        apply_delta(db, booking.service_id, rating - previous, 0)
+
+
+def add_review(db: Session, booking: Booking, review: Review) -> None:
+    """Count a new review; it replaces the booking's own rating if it had one"""
+    if booking.rating is None:
+        apply_delta(db, review.service_id, review.rating, 1)
+    else:
+        apply_delta(db, review.service_id, review.rating - booking.rating, 0)
+
+
+def rating_totals(db: Session) -> Dict[object, Tuple[int, int]]:
+    """service id -> (sum, count) recomputed from reviews and unreviewed booking ratings"""
+    totals = defaultdict(lambda: [0, 0])
+    reviews = db.query(Review.service_id, func.sum(Review.rating), func.count(Review.id)).group_by(Review.service_id)
+    unreviewed = db.query(Booking.service_id, func.sum(Booking.rating), func.count(Booking.id)).filter(
+        Booking.rating.isnot(None), ~Booking.review.has()
+    ).group_by(Booking.service_id)
+    for query in (reviews, unreviewed):
+        for service_id, total, count in query:
+            totals[service_id][0] += int(total or 0)
+            totals[service_id][1] += count
+    return {service_id: tuple(pair) for service_id, pair in totals.items()}
+
+
+def reconcile(db: Session, fix: bool = False, sample: int = 20) -> dict:
+    """Compare stored aggregates with a full recount, and rewrite the drifted ones if fix"""
+    totals = rating_totals(db)
+    services: List[dict] = []
+    providers = defaultdict(lambda: [0, 0])
+    for service_id, provider_id, stored_sum, stored_count in db.query(
+        Service.id, Service.provider_id, Service.rating_sum, Service.rating_count
+    ):
+        rating_sum, rating_count = totals.get(service_id, (0, 0))
+        if provider_id is not None:
+            providers[provider_id][0] += rating_sum
+            providers[provider_id][1] += rating_count
+        if (stored_sum, stored_count) != (rating_sum, rating_count):
+            services.append({
+                "id": service_id, "rating_sum": rating_sum, "rating_count": rating_count,
+                "rating": round(rating_sum / rating_count) if rating_count else 0,
+                "stored": [stored_sum, stored_count],
+            })
+    provider_rows = [
+        {"id": provider_id, "rating_sum": providers[provider_id][0], "rating_count": providers[provider_id][1],
+         "stored": [stored_sum, stored_count]}
+        for provider_id, stored_sum, stored_count in db.query(
+            ServiceProvider.id, ServiceProvider.rating_sum, ServiceProvider.rating_count
+        )
+        if (stored_sum, stored_count) != tuple(providers.get(provider_id, (0, 0)))
+    ]
+
+    if fix and (services or provider_rows):
+        for model, rows in ((Service, services), (ServiceProvider, provider_rows)):
+            if rows:
+                db.execute(update(model), [{k: v for k, v in row.items() if k != "stored"} for row in rows])
+        db.commit()
+        logger.info("Rewrote rating aggregates of %d services and %d providers", len(services), len(provider_rows))
+
+    return {
+        "services_drifted": len(services),
+        "providers_drifted": len(provider_rows),
+        "fixed": fix,
+        "sample": [
+            {"kind": kind, "id": str(row["id"]), "stored": row["stored"],
+             "actual": [row["rating_sum"], row["rating_count"]]}
+            for kind, rows in (("service", services), ("provider", provider_rows)) for row in rows
+        ][:sample],
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Check service and provider rating aggregates against a recount")
+    parser.add_argument("--fix", action="store_true", help="rewrite the aggregates that have drifted")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(json.dumps(reconcile(db, args.fix), indent=2))
+    finally:
+        db.close()
@@ -1,17 +1,30 @@
-from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from pydantic import BaseModel, Field, TypeAdapter
+from sqlalchemy.orm import Session, contains_eager
 from sqlalchemy import select
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Tuple
 from uuid import UUID
-# import numpy as np
+import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer # type: ignore
 from sklearn.metrics.pairwise import cosine_similarity # type: ignore
 from fastapi import HTTPException
 from models import Service, ServiceProvider
+from search import search_services
+from geo import EARTH_RADIUS_KM, GEO_RADIUS_KM, find_place, geocode, location_filter
+from features import CANCELLATION, COMPLETION, RATING, RESPONSE, VELOCITY, feature_store
+from embeddings import SYNONYMS, embedding_index
+from prompts import (ASSISTANT_SYSTEM, EXTRACT_PARAMETERS_BATCH_SYSTEM, EXTRACT_PARAMETERS_SYSTEM,
+                     ConversationMemory, log_usage)
+import catalog
+import metrics
 import openai
 from openai import OpenAI
 import os
 import json
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
 from dotenv import load_dotenv
 import uuid
 
@@ -23,6 +36,40 @@ if not os.getenv("OPENAI_API_KEY"):
     raise ValueError("OPENAI_API_KEY environment variable not set")
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# Best full-text matches handed to the similarity ranking
+SEARCH_CANDIDATES = int(os.getenv("RECOMMENDATION_SEARCH_CANDIDATES", "200"))
+# Nearest services in embedding space added to them, so synonyms are found too
+SEMANTIC_CANDIDATES = int(os.getenv("RECOMMENDATION_SEMANTIC_CANDIDATES", "200"))
+# Ranked lists kept per worker, keyed by normalized parameters and the catalog
+# generation, so any service/provider write makes earlier entries unreachable
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "1024"))
+# Also bounds how long feature refreshes and other workers' writes take to show
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", "300"))
+
+# Queries accepted by /api/recommendations/batch in one request
+BATCH_MAX_QUERIES = int(os.getenv("RECOMMENDATION_BATCH_MAX_QUERIES", "500"))
+
+RECOMMENDATION_CACHE = metrics.counter("recommendation_cache_total", "Recommendation lookups by cache outcome")
+
+# Score weights; experience is years/10, rating stars/5, price is relative to the
+# cheapest candidate and distance fades out at GEO_RADIUS_KM. The remaining
+# signals come from features.py: quality is the smoothed rating, cancellation a
+# penalty, velocity saturates at one booking a day and response halves at an
+# hour. Override with e.g. RECOMMENDATION_WEIGHTS='{"rating": 0.1}'
+RANK_WEIGHTS = {
+    "similarity": 0.8,
+    "experience": 0.2,
+    "rating": 0.0,
+    "price": 0.0,
+    "distance": 0.2,
+    "quality": 0.1,
+    "completion": 0.05,
+    "cancellation": 0.05,
+    "velocity": 0.05,
+    "response": 0.05,
+    **json.loads(os.getenv("RECOMMENDATION_WEIGHTS", "{}")),
+}
+
 # Pydantic models
 class ServiceRequest(BaseModel):
     job_type: str
@@ -30,6 +77,10 @@ class ServiceRequest(BaseModel):
     location: str = None
     urgency: str = None
 
+class BatchRecommendationRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_QUERIES)
+    top_k: int = Field(5, ge=1, le=20)
+
 class ChatRequest(BaseModel):
     message: str
     session_id: Optional[str] = None
@@ -58,20 +109,157 @@ class ServiceRecommendation(BaseModel):
     address: str
     score: float
 
+def top_k_indices(scores, k: int):
+    """Indices of the k highest scores, best first, without sorting the whole array"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    # Ties keep candidate order, like the stable sort this replaces
+    candidates.sort()
+    return candidates[np.argsort(-scores[candidates], kind="stable")].tolist()
+
+
+def haversine_km_array(lat0: float, lon0: float, lat, lon):
+    lat0, lon0 = np.radians(lat0), np.radians(lon0)
+    lat, lon = np.radians(lat), np.radians(lon)
+    a = np.sin((lat - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat) * np.sin((lon - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+_recommendations_adapter = TypeAdapter(List[ServiceRecommendation])
+
+
+def budget_bucket(max_budget: Optional[float]) -> Optional[int]:
+    """Round a budget up to two significant digits (523 -> 530, 1499 -> 1500)
+
+    Results are computed for the bucket, a ceiling, and trimmed to each
+    caller's real budget by within_budget, so nothing the caller could
+    afford is left out and nothing over budget is returned.
+    """
+    if not max_budget or max_budget <= 0:
+        return None
+    step = 10 ** max(int(math.floor(math.log10(max_budget))) - 1, 0)
+    return int(math.ceil(max_budget / step) * step)
+
+
+def within_budget(recommendations: List[ServiceRecommendation], max_budget: Optional[float],
+                  top_k: int) -> List[ServiceRecommendation]:
+    """A bucket's ranked list cut down to one caller's budget"""
+    if budget_bucket(max_budget) is not None:
+        recommendations = [r for r in recommendations if r.price <= max_budget]
+    return recommendations[:top_k]
+
+
+def cache_key(job_type: str, max_budget: Optional[float] = None, location: Optional[str] = None,
+              urgency: Optional[str] = None) -> Tuple:
+    """Normalized (job_type, budget bucket, location, urgency)"""
+    def clean(value):
+        return " ".join(str(value).lower().split()) or None if value else None
+
+    return clean(job_type), budget_bucket(max_budget), clean(location), clean(urgency)
+
+
+class RecommendationCache:
+    """Serialized ServiceRecommendation lists with a TTL, LRU-evicted"""
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[List[ServiceRecommendation]]:
+        full_key = (catalog.cache.generation, key)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[full_key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                RECOMMENDATION_CACHE.inc(outcome="miss")
+                return None
+            self._entries.move_to_end(full_key)
+            self.hits += 1
+        RECOMMENDATION_CACHE.inc(outcome="hit")
+        return _recommendations_adapter.validate_json(entry[1])
+
+    def put(self, key: Tuple, generation: int, recommendations: List[ServiceRecommendation]):
+        body = _recommendations_adapter.dump_json(recommendations)
+        with self._lock:
+            self._entries[(generation, key)] = (time.monotonic(), body)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "generation": catalog.cache.generation,
+            }
+
+
+recommendation_cache = RecommendationCache(RECOMMENDATION_CACHE_SIZE, RECOMMENDATION_CACHE_TTL)
+
+
 class RecommendationAgent:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, weights: Optional[Dict[str, float]] = None):
         self.db = db
+        self.weights = {**RANK_WEIGHTS, **(weights or {})}
+
+    def get_semantic_candidates(self, job_type: str, max_budget: float = None, location: str = None):
+        """Nearest services to job_type in embedding space that pass the SQL filters"""
+        hits = embedding_index.search(job_type, k=SEMANTIC_CANDIDATES)
+        if not hits:
+            return []
+        query = self._filtered(max_budget, location).where(Service.id.in_([UUID(i) for i, _ in hits]))
+        by_id = {str(s.id): s for s in self.db.execute(query).scalars().all()}
+        return [by_id[i] for i, _ in hits if i in by_id]
+
+    def _filtered(self, max_budget: float = None, location: str = None):
+        query = (
+            select(Service).join(ServiceProvider)
+            .options(contains_eager(Service.provider))
+            .where(Service.is_active == True)
+        )
+        if max_budget:
+            query = query.where(Service.price <= max_budget)
+        if location:
+            query = query.where(location_filter(location)[0])
+        return query
 
     def get_services(self, job_type: str, max_budget: float = None, location: str = None):
+        return self._candidates(job_type, max_budget, location)[0]
+
+    def _candidates(self, job_type: str, max_budget: float = None, location: str = None) -> Tuple[List[Service], bool]:
+        """get_services, and whether the full-text hits stopped short of SEARCH_CANDIDATES
+
+        When they did, the candidates for any lower budget are exactly these
+        filtered by price, in the same order.
+        """
         try:
-            query = select(Service).join(ServiceProvider).where(Service.is_active == True)
             if job_type:
-                query = query.where(Service.title.ilike(f"%{job_type}%") | Service.description.ilike(f"%{job_type}%"))
-            if max_budget:
-                query = query.where(Service.price <= max_budget)
-            if location:
-                query = query.where(ServiceProvider.address.ilike(f"%{location}%"))
-            return self.db.execute(query).scalars().all()
+                # Full-text hits (index-backed, see search.py) first, then
+                # embedding neighbours they missed ("leaky tap" -> plumbing)
+                services = [
+                    service for service, _ in
+                    search_services(self.db, job_type, location, max_budget, limit=SEARCH_CANDIDATES)
+                ]
+                complete = len(services) < SEARCH_CANDIDATES
+                seen = {s.id for s in services}
+                services.extend(
+                    s for s in self.get_semantic_candidates(job_type, max_budget, location) if s.id not in seen
+                )
+                return services, complete
+            query = self._filtered(max_budget, location)
+            return self.db.execute(query).scalars().all(), True
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database query error: {str(e)}")
 
@@ -80,40 +268,217 @@ class RecommendationAgent:
         vectorizer = TfidfVectorizer()
         tfidf_matrix = vectorizer.fit_transform(texts + [job_type])
         similarities = cosine_similarity(tfidf_matrix[-1:], tfidf_matrix[:-1])[0]
-        return similarities
+        # TF-IDF only sees shared words; the embedding also scores synonyms
+        return np.maximum(similarities, embedding_index.similarities(job_type, services))
 
-    def rank_services(self, services: List[Service], job_type: str, max_budget: float = None):
+    def score_services(self, services: List[Service], similarities, max_budget: float = None, origin=None):
+        """Score every candidate at once; returns a float array aligned with services"""
+        w = self.weights
+        providers = [s.provider for s in services]
+        experience = np.array([p.years_experience or 0 for p in providers], dtype=np.float64)
+        rating = np.array([s.rating or 0 for s in services], dtype=np.float64)
+        price = np.array([s.price or 0 for s in services], dtype=np.float64)
+
+        scores = w["similarity"] * np.asarray(similarities, dtype=np.float64) + w["experience"] * experience / 10.0
+        if w["rating"]:
+            scores += w["rating"] * rating / 5.0
+        if w["price"] and price.max() > price.min():
+            # Cheapest candidate gets the full weight, the most expensive none
+            scores += w["price"] * (price.max() - price) / (price.max() - price.min())
+        if origin and w["distance"]:
+            lat = np.array([p.latitude if p.latitude is not None else np.nan for p in providers], dtype=np.float64)
+            lon = np.array([p.longitude if p.longitude is not None else np.nan for p in providers], dtype=np.float64)
+            distance = haversine_km_array(origin[0], origin[1], lat, lon)
+            # Closer providers get up to the distance weight, fading out at GEO_RADIUS_KM
+            scores += w["distance"] * np.nan_to_num(np.clip(1.0 - distance / GEO_RADIUS_KM, 0.0, 1.0))
+
+        # Precomputed in memory; no queries here
+        features = feature_store.lookup([s.id for s in services]).astype(np.float64)
+        scores += w["quality"] * np.clip((features[:, RATING] - 1.0) / 4.0, 0.0, 1.0)
+        scores += w["completion"] * features[:, COMPLETION]
+        scores -= w["cancellation"] * features[:, CANCELLATION]
+        scores += w["velocity"] * np.minimum(np.log1p(features[:, VELOCITY] * 30) / np.log1p(30), 1.0)
+        scores += w["response"] * np.nan_to_num(1.0 / (1.0 + features[:, RESPONSE] / 60.0))
+        if max_budget:
+            scores = np.where(price > max_budget, scores * 0.5, scores)
+        return scores
+
+    def rank_services(self, services: List[Service], job_type: str, max_budget: float = None,
+                      location: str = None, top_k: int = 5):
         if not services:
             return []
         similarities = self.compute_content_similarity(services, job_type)
-        recommendations = []
-        for idx, service in enumerate(services):
-            score = (
-                0.8 * similarities[idx] +
-                0.2 * (service.provider.years_experience / 10.0 if service.provider.years_experience else 0.0)
-            )
-            if max_budget and service.price > max_budget:
-                score *= 0.5
-            recommendations.append({
-                "service": service,
-                "score": score
-            })
-        recommendations.sort(key=lambda x: x["score"], reverse=True)
+        scores = self.score_services(services, similarities, max_budget, geocode(location))
+        return self._recommendations(services, scores, top_k_indices(scores, top_k))
+
+    def _recommendations(self, services: List[Service], scores, indices) -> List[ServiceRecommendation]:
         return [
             ServiceRecommendation(
-                id=r["service"].id,
-                title=r["service"].title,
-                description=r["service"].description or "",
-                price=float(r["service"].price),
-                provider_name=r["service"].provider_name,
-                rating=float(r["service"].rating),
-                image=r["service"].image or "/placeholder-service.jpg",
-                years_experience=r["service"].provider.years_experience or 0,
-                address=r["service"].provider.address or "",
-                score=r["score"]
-            ) for r in recommendations[:5]
+                id=services[i].id,
+                title=services[i].title,
+                description=services[i].description or "",
+                price=float(services[i].price or 0),
+                provider_name=services[i].provider_name,
+                rating=float(services[i].rating or 0),
+                image=services[i].image or "/placeholder-service.jpg",
+                years_experience=services[i].provider.years_experience or 0,
+                address=services[i].provider.address or "",
+                score=float(scores[i])
+            ) for i in indices
         ]
 
+    def _ranked(self, key: Tuple, top_k: int, services: Optional[List[Service]] = None) -> List[ServiceRecommendation]:
+        """Ranked list cached under key; over-fetched when a budget bucket will be trimmed per caller"""
+        job_type, budget, location, _ = key
+        if services is None:
+            services = self.get_services(job_type, budget, location)
+        return self.rank_services(services, job_type, budget, location, top_k * 2 if budget else top_k)
+
+    def _trimmed(self, key: Tuple, ranked: List[ServiceRecommendation], max_budget: Optional[float], top_k: int,
+                 services: Optional[List[Service]] = None) -> List[ServiceRecommendation]:
+        """within_budget, re-ranking the whole bucket uncached when the cached prefix runs short
+
+        The cached list holds the bucket's best top_k * 2; if too many of
+        them sit between the caller's budget and the bucket, the ones the
+        caller can afford further down are only found in the full ranking.
+        """
+        trimmed = within_budget(ranked, max_budget, top_k)
+        if len(trimmed) < top_k and key[1] is not None and len(ranked) == top_k * 2:
+            job_type, budget, location, _ = key
+            if services is None:
+                services = self.get_services(job_type, budget, location)
+            ranked = self.rank_services(services, job_type, budget, location, len(services))
+            trimmed = within_budget(ranked, max_budget, top_k)
+        return trimmed
+
+    def recommend(self, job_type: str, max_budget: float = None, location: str = None,
+                  urgency: str = None, top_k: int = 5) -> List[ServiceRecommendation]:
+        """get_services + rank_services, answered from recommendation_cache when possible"""
+        key = cache_key(job_type, max_budget, location, urgency)
+        ranked = recommendation_cache.get((*key, top_k))
+        if ranked is None:
+            # Read before querying so a write landing mid-request is not cached as current
+            generation = catalog.cache.generation
+            ranked = self._ranked(key, top_k)
+            recommendation_cache.put((*key, top_k), generation, ranked)
+        return self._trimmed(key, ranked, max_budget, top_k)
+
+    def recommend_batch(self, requests: List[Dict], top_k: int = 5) -> Iterator[Tuple[int, List[ServiceRecommendation]]]:
+        """Yield (position, recommendations) for many extracted parameter sets
+
+        Answers match recommend() exactly. Requests sharing a job type and
+        location share one candidate query at their widest budget bucket;
+        each narrower bucket is ranked over the candidates priced within it,
+        which is what recommend() would have fetched, and cached under the
+        same keys. Cached answers are yielded first, the rest group by group.
+        """
+        groups = defaultdict(list)  # (job_type, location) -> members
+        for position, params in enumerate(requests):
+            max_budget = params.get("max_budget")
+            key = cache_key(params.get("job_type"), max_budget, params.get("location"), params.get("urgency"))
+            if not key[0]:
+                yield position, []
+                continue
+            cached = recommendation_cache.get((*key, top_k))
+            if cached is not None:
+                yield position, self._trimmed(key, cached, max_budget, top_k)
+                continue
+            groups[key[0], key[2]].append((position, key, max_budget))
+
+        for (job_type, location), members in groups.items():
+            generation = catalog.cache.generation
+            buckets = {key[1] for _, key, _ in members}
+            widest = None if None in buckets else max(buckets)
+            services, complete = self._candidates(job_type, widest, location)
+            by_bucket = {}  # bucket -> (candidates, ranked)
+            for position, key, max_budget in members:
+                bucket = key[1]
+                if bucket not in by_bucket:
+                    if bucket == widest:
+                        candidates = services
+                    elif complete:
+                        candidates = [s for s in services if s.price is not None and s.price <= bucket]
+                    else:
+                        # The widest fetch hit SEARCH_CANDIDATES, so cheaper matches may be missing from it
+                        candidates = self.get_services(job_type, bucket, location)
+                    by_bucket[bucket] = candidates, self._ranked(key, top_k, candidates)
+                candidates, ranked = by_bucket[bucket]
+                recommendation_cache.put((*key, top_k), generation, ranked)
+                yield position, self._trimmed(key, ranked, max_budget, top_k, candidates)
+
+
+# A number with the words, currency and unit around it; parse_budget decides
+# whether it is a budget
+_AMOUNT = re.compile(
+    r"(?:\b(?P<word>under|below|less than|max(?:imum)?|up to|at most|within|budget(?: of| is)?)[\s:]+)?"
+    r"(?P<currency>\$|\b(?:etb|birr)\b)?\s*"
+    r"(?P<amount>\d[\d,]*(?:\.\d+)?)"
+    r"(?P<suffix>\s*k\b|\s*(?:etb|birr)\b)?"
+    r"(?P<unit>\s*(?:(?:per|an?|/)\s*)?(?:minutes?|mins?|hours?|hrs?|days?|weeks?|months?|years?)\b)?",
+    re.IGNORECASE,
+)
+_BUDGET_WORDS = ("under", "below", "less than", "budget")
+_URGENCY = (
+    ("immediate", ("asap", "urgent", "urgently", "emergency", "immediately", "right now", "today", "tonight")),
+    ("within_week", ("tomorrow", "this week", "within a week", "next few days", "this weekend")),
+)
+
+
+def parse_budget(message: str) -> Tuple[Optional[float], bool]:
+    """(max_budget, ambiguous) from a message
+
+    A number counts as a budget when it carries a currency ("$500",
+    "500 birr", "2k") or follows under / below / less than / budget. Numbers
+    followed by a time unit ("within 2 days", "up to 3 hours") are not
+    budgets. A rate ("$20 an hour"), a bare number after a weaker word
+    ("max 500", "up to 500") or two different budgets are ambiguous.
+    """
+    budgets = set()
+    ambiguous = False
+    for match in _AMOUNT.finditer(message):
+        word = (match.group("word") or "").lower()
+        suffix = (match.group("suffix") or "").strip().lower()
+        money = bool(match.group("currency") or suffix)
+        if match.group("unit"):
+            ambiguous = ambiguous or money
+            continue
+        if money or word.startswith(_BUDGET_WORDS):
+            budgets.add(float(match.group("amount").replace(",", "")) * (1000 if suffix == "k" else 1))
+        elif word:
+            ambiguous = True
+    if ambiguous or len(budgets) > 1:
+        return None, True
+    return (budgets.pop() if budgets else None), False
+
+
+def extract_parameters_locally(message: str) -> Optional[Dict]:
+    """Rule-based extraction for messages naming exactly one trade
+
+    Uses the synonyms.csv lexicon for the job type and the gazetteer for the
+    location. Returns None when the trade or the budget is missing a clear
+    reading, which is left to the LLM.
+    """
+    words = re.findall(r"[a-z0-9]+", message.lower())
+    votes = Counter()
+    for i, word in enumerate(words):
+        for term in (word, f"{words[i - 1]} {word}" if i else None):
+            votes.update(SYNONYMS.get(term, ()))
+    if len(votes) > 1:
+        votes.pop("handyman", None)  # "fix", "repair" only decide when nothing else matched
+    ranked = votes.most_common(2)
+    if not ranked or (len(ranked) == 2 and ranked[0][1] == ranked[1][1]):
+        return None
+
+    max_budget, ambiguous = parse_budget(message)
+    if ambiguous:
+        return None
+    lowered = " ".join(words)
+    urgency = next((level for level, phrases in _URGENCY if any(
+        re.search(rf"\b{phrase}\b", lowered) for phrase in phrases
+    )), None)
+    return {"job_type": ranked[0][0], "max_budget": max_budget, "location": find_place(message), "urgency": urgency}
+
+
 class ConversationalAgent:
     def __init__(self, db: Session):
         self.db = db
@@ -121,30 +486,62 @@ class ConversationalAgent:
 
     def extract_parameters(self, message: str):
         try:
-            prompt = f"""
-            Extract the following parameters from the user's message:
-            - job_type (e.g., plumbing, electrical)
-            - max_budget (numeric value, if mentioned)
-            - location (city or area, if mentioned)
-            - urgency (e.g., 'immediate', 'within_week', if mentioned)
-            If a parameter is not specified, return null for it.
-            Return the result as a JSON object.
-            User message: "{message}"
-            """
+            messages = [
+                {"role": "system", "content": EXTRACT_PARAMETERS_SYSTEM},
+                {"role": "user", "content": message},
+            ]
             response = client.chat.completions.create(
                 model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
+                messages=messages,
                 response_format={"type": "json_object"}
             )
+            log_usage("extract_parameters", messages, response)
             return json.loads(response.choices[0].message.content)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
 
+    def extract_parameters_batch(self, messages: List[str]) -> List[Tuple[Dict, str]]:
+        """(parameters, "local" | "llm") per message, with at most one LLM call for all of them"""
+        results: List[Optional[Tuple[Dict, str]]] = []
+        leftovers = []
+        for position, message in enumerate(messages):
+            params = extract_parameters_locally(message)
+            results.append((params, "local") if params else None)
+            if params is None:
+                leftovers.append(position)
+        if not leftovers:
+            return results
+
+        try:
+            batch = [
+                {"role": "system", "content": EXTRACT_PARAMETERS_BATCH_SYSTEM},
+                {"role": "user", "content": json.dumps([messages[i] for i in leftovers])},
+            ]
+            response = client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=batch,
+                response_format={"type": "json_object"}
+            )
+            log_usage("extract_parameters_batch", batch, response)
+            extracted = json.loads(response.choices[0].message.content).get("results") or []
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"OpenAI API error: {str(e)}")
+
+        for n, position in enumerate(leftovers):
+            params = extracted[n] if n < len(extracted) and isinstance(extracted[n], dict) else {}
+            try:
+                budget = float(params["max_budget"]) if params.get("max_budget") else None
+            except (TypeError, ValueError):
+                budget = None
+            results[position] = ({**params, "max_budget": budget}, "llm")
+        return results
+
     def generate_response(self, message: str, session_id: Optional[str] = None):
         if not session_id:
             session_id = str(uuid.uuid4())
         if session_id not in session_data:
-            session_data[session_id] = {"history": [], "parameters": {}}
+            session_data[session_id] = {"memory": ConversationMemory(), "parameters": {}}
+        memory = session_data[session_id]["memory"]
         
         params = self.extract_parameters(message)
         job_type = params.get("job_type")
@@ -158,12 +555,11 @@ class ConversationalAgent:
             "location": location,
             "urgency": urgency
         }
-        session_data[session_id]["history"].append({"role": "user", "content": message})
+        memory.add("user", message)
 
         recommendations = []
         if job_type:
-            services = self.recommendation_agent.get_services(job_type, max_budget, location)
-            recommendations = self.recommendation_agent.rank_services(services, job_type, max_budget)
+            recommendations = self.recommendation_agent.recommend(job_type, max_budget, location, urgency)
             
             if recommendations:
                 response_text = f"I found some great {job_type} services for you"
@@ -187,22 +583,19 @@ class ConversationalAgent:
                     response_text += f" within ${max_budget}"
                 response_text += f". Could you clarify or adjust your requirements?"
         else:
-            prompt = f"""
-            You are a friendly assistant for HomeHelp Connect, a platform connecting homeowners with service providers.
-            Respond naturally to the user's message, providing helpful information or asking clarifying questions.
-            Use the conversation history: {json.dumps(session_data[session_id]["history"])}.
-            User message: "{message}"
-            """
+            # Bounded window plus summary instead of the whole history
+            messages = memory.build(ASSISTANT_SYSTEM)
             try:
                 response = client.chat.completions.create(
                     model="gpt-4o-mini",
-                    messages=[{"role": "user", "content": prompt}]
+                    messages=messages
                 )
+                log_usage("assistant", messages, response, session_id)
                 response_text = response.choices[0].message.content
             except Exception as e:
                 response_text = f"Sorry, I encountered an error processing your request: {str(e)}. Please try again."
 
-        session_data[session_id]["history"].append({"role": "assistant", "content": response_text})
+        memory.add("assistant", response_text)
         
         return response_text, recommendations, session_id
 
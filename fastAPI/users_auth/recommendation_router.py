@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from recommendation import ChatRequest, ChatResponse, RecommendationRequest, RecommendationResponse, ConversationalAgent
-from database import get_db
+from recommendation import BatchRecommendationRequest, ChatRequest, ChatResponse, RecommendationRequest, RecommendationResponse, ConversationalAgent
+from database import get_db, get_read_db
+from serializers import FastJSONRoute, dumps
 import os
 
-router = APIRouter()
+router = APIRouter(route_class=FastJSONRoute)
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest, db: Session = Depends(get_db)):
@@ -22,4 +24,27 @@ async def recommendations(request: RecommendationRequest, db: Session = Depends(
     
     agent = ConversationalAgent(db)
     response_text, recommendations, _ = agent.generate_response(request.query)
-    return RecommendationResponse(response=response_text, results=recommendations)
\ No newline at end of file
+    return RecommendationResponse(response=response_text, results=recommendations)
+
+@router.post("/api/recommendations/batch")
+def batch_recommendations(request: BatchRecommendationRequest, db: Session = Depends(get_read_db)):
+    """Recommendations for many job descriptions, streamed as NDJSON in completion order"""
+    if not os.getenv("OPENAI_API_KEY"):
+        raise HTTPException(status_code=500, detail="OPENAI_API_KEY environment variable not set")
+
+    agent = ConversationalAgent(db)
+    # Before streaming starts, so an extraction failure is still a plain 500
+    extracted = agent.extract_parameters_batch(request.queries)
+
+    def lines():
+        params = [p for p, _ in extracted]
+        for position, recommendations in agent.recommendation_agent.recommend_batch(params, request.top_k):
+            yield dumps({
+                "index": position,
+                "query": request.queries[position],
+                "parameters": params[position],
+                "extracted_by": extracted[position][1],
+                "results": [r.model_dump() for r in recommendations],
+            }) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -37,7 +37,9 @@ class ServiceBase(BaseModel):
 class ServiceCreate(ServiceBase):
     provider_id: UUID  # Changed to UUID
 
-from pydantic import ConfigDict
+from pydantic import ConfigDict, computed_field
+from typing import Dict
+from images import variant_urls
 
 class Service(BaseModel):
     id: UUID  # Changed to UUID
@@ -49,6 +51,12 @@ class Service(BaseModel):
     provider_name: str
     created_at: datetime
     provider_id: UUID  # Changed to UUID
+
+    @computed_field
+    @property
+    def image_variants(self) -> Dict[str, str]:
+        # Resized WebP copies (thumb/small/medium/webp), empty until generated
+        return variant_urls(self.image)
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -196,6 +204,7 @@ class UserProfileResponse(BaseModel):
     email: str
     full_name: Optional[str] = None
     avatar_url: Optional[str] = None
+    avatar_variants: Dict[str, str] = {}
 
 class ReviewBase(BaseModel):
     rating: int = Field(..., ge=1, le=5)
@@ -0,0 +1,157 @@
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from sqlalchemy import column, func, literal, literal_column, or_, select, table, text
+from sqlalchemy.orm import Session, contains_eager
+
+from geo import location_filter
+from models import Service, ServiceProvider
+
+logger = logging.getLogger(__name__)
+
+# Postgres: weighted tsvector (title A, description B) plus pg_trgm indexes for
+# typo-tolerant title and address matching. Mirrors the add_service_search
+# migration so databases built with create_all get the same indexes.
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE services ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_services_search_vector ON services USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_services_title_trgm ON services USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_serviceproviders_address_trgm ON serviceproviders USING gin (address gin_trgm_ops)",
+]
+
+# SQLite (local development and tests): FTS5 table kept in sync by triggers
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS services_fts USING fts5("
+    "service_id UNINDEXED, title, description, tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS services_fts_insert AFTER INSERT ON services BEGIN "
+    "INSERT INTO services_fts(service_id, title, description) VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS services_fts_delete AFTER DELETE ON services BEGIN "
+    "DELETE FROM services_fts WHERE service_id = old.id; END",
+    "CREATE TRIGGER IF NOT EXISTS services_fts_update AFTER UPDATE OF title, description ON services BEGIN "
+    "DELETE FROM services_fts WHERE service_id = old.id; "
+    "INSERT INTO services_fts(service_id, title, description) VALUES (new.id, new.title, new.description); END",
+]
+
+# Weight of title trigram similarity next to ts_rank_cd in the Postgres rank
+TRIGRAM_WEIGHT = 0.3
+
+services_fts = table("services_fts", column("service_id"), column("title"), column("description"))
+_fts_engines = {}  # engine url -> FTS5 table present
+
+
+def ensure_search_schema(engine) -> None:
+    """Create the search column, indexes or FTS table if they are missing (idempotent)"""
+    dialect = engine.dialect.name
+    if dialect not in ("postgresql", "sqlite"):
+        return
+    try:
+        with engine.begin() as conn:
+            for statement in POSTGRES_DDL if dialect == "postgresql" else SQLITE_DDL:
+                conn.execute(text(statement))
+            if dialect == "sqlite":
+                conn.execute(text(
+                    "INSERT INTO services_fts(service_id, title, description) "
+                    "SELECT id, title, description FROM services "
+                    "WHERE NOT EXISTS (SELECT 1 FROM services_fts LIMIT 1)"
+                ))
+    except Exception as e:
+        # Missing pg_trgm privileges or an SQLite build without FTS5: search
+        # falls back to ILIKE scans
+        logger.warning("Could not create search indexes: %s", e)
+
+
+def _has_fts(bind) -> bool:
+    key = str(bind.url)
+    if key not in _fts_engines:
+        with bind.connect() as conn:
+            _fts_engines[key] = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = 'services_fts'"
+            )).first() is not None
+    return _fts_engines[key]
+
+
+def _fts5_query(q: str) -> Optional[str]:
+    """Turn free text into an FTS5 query of prefix terms, all required like websearch_to_tsquery"""
+    terms = re.findall(r"\w+", q.lower())
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def _backend(db: Session) -> str:
+    bind = db.get_bind()
+    if bind.dialect.name == "postgresql":
+        return "postgresql"
+    if bind.dialect.name == "sqlite" and _has_fts(bind):
+        return "sqlite"
+    return "ilike"
+
+
+def _fts_hits(fts_query: str):
+    """services_fts matches as a (service_id, rank) CTE; bm25 is lower-is-better"""
+    return (
+        select(
+            services_fts.c.service_id,
+            (-func.bm25(literal_column("services_fts"), 10.0, 3.0)).label("rank"),
+        )
+        .where(text("services_fts MATCH :fts_q").bindparams(fts_q=fts_query))
+        # Materialized so SQLite runs MATCH once instead of flattening it into
+        # the join and re-running it for every service row
+        .cte("fts_hits")
+        .prefix_with("MATERIALIZED")
+    )
+
+
+def text_filter(db: Session, q: str):
+    """Where clause matching services against free text, using the search index when present"""
+    backend = _backend(db)
+    if backend == "postgresql":
+        tsquery = func.websearch_to_tsquery("english", q)
+        return or_(literal_column("services.search_vector").op("@@")(tsquery), Service.title.op("%")(q))
+    if backend == "sqlite":
+        fts_query = _fts5_query(q)
+        if fts_query is None:
+            return literal(True)
+        return Service.id.in_(select(_fts_hits(fts_query).c.service_id))
+    return or_(Service.title.ilike(f"%{q}%"), Service.description.ilike(f"%{q}%"))
+
+
+def search_services(
+    db: Session,
+    q: str,
+    location: Optional[str] = None,
+    max_price: Optional[float] = None,
+    limit: int = 20,
+) -> List[Tuple[Service, float]]:
+    """Active services matching q, best match first, as (service, rank) pairs"""
+    backend = _backend(db)
+    query = db.query(Service)
+    if backend == "postgresql":
+        tsquery = func.websearch_to_tsquery("english", q)
+        rank = func.ts_rank_cd(literal_column("services.search_vector"), tsquery) \
+            + TRIGRAM_WEIGHT * func.similarity(Service.title, q)
+        query = query.filter(text_filter(db, q))
+    elif backend == "sqlite" and _fts5_query(q):
+        hits = _fts_hits(_fts5_query(q))
+        rank = hits.c.rank
+        query = query.join(hits, hits.c.service_id == Service.id)
+    else:
+        rank = literal(0.0)
+        query = query.filter(text_filter(db, q))
+
+    query = (
+        query.add_columns(rank.label("rank"))
+        .join(ServiceProvider, Service.provider_id == ServiceProvider.id)
+        .options(contains_eager(Service.provider))
+        .filter(Service.is_active == True)
+    )
+    if location:
+        query = query.filter(location_filter(location)[0])
+    if max_price:
+        query = query.filter(Service.price <= max_price)
+    rows = query.order_by(literal_column("rank").desc(), Service.id).limit(limit).all()
+    return [(service, float(score or 0.0)) for service, score in rows]
@@ -0,0 +1,110 @@
+import enum
+import json
+from decimal import Decimal
+from typing import Any, Iterable, List, Mapping, Optional, Type
+
+from fastapi.datastructures import DefaultPlaceholder
+from fastapi.responses import JSONResponse, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, TypeAdapter
+
+from schemas import Service as ServiceSchema
+
+try:
+    import orjson
+    # UUID, datetime and dataclasses are native to orjson; these cover the rest
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+except ImportError:  # falls back to the standard library, several times slower
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if orjson is None:
+        # What orjson handles natively
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        if hasattr(value, "hex") and hasattr(value, "version"):  # UUID
+            return str(value)
+        if hasattr(value, "tolist"):  # numpy arrays and scalars
+            return value.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """Compact UTF-8 JSON for plain data: dicts, lists, str, numbers, UUID, datetime"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+    return json.dumps(content, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, without the jsonable_encoder pass
+
+    Content must already be plain data (or pydantic models, dumped on the way).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class FastJSONRoute(APIRoute):
+    """Route class making FastJSONResponse the default for routes without a response_model
+
+    Routes with a response_model keep FastAPI's default class on purpose:
+    only then does FastAPI serialize through pydantic's dump_json, which is
+    faster still. Pass as route_class to APIRouter, or set app.router.route_class.
+    """
+
+    def get_route_handler(self):
+        streaming = getattr(self, "is_json_stream", False) or getattr(self, "is_sse_stream", False)
+        if self.response_field is None and not streaming and isinstance(self.response_class, DefaultPlaceholder):
+            self.response_class = FastJSONResponse
+        return super().get_route_handler()
+
+
+def trusted_response(content: Any, status_code: int = 200,
+                     headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Serialize data this code built itself, skipping response_model validation
+
+    Returning a Response makes FastAPI skip the response_model entirely, so
+    only use it when the dicts already have the schema's shape and types.
+    """
+    return Response(content=dumps(content), status_code=status_code,
+                    media_type="application/json", headers=headers)
+
+
+class ListSerializer:
+    """Precompiled List[model] validator/serializer for list endpoints
+
+    Built once at import, so a request pays for validation and a single Rust
+    dump_json call, instead of FastAPI's per-request field handling.
+    """
+
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        self.adapter = TypeAdapter(List[model])
+
+    def validate(self, items: Iterable, from_attributes: bool = True) -> List[BaseModel]:
+        return self.adapter.validate_python(list(items), from_attributes=from_attributes)
+
+    def dump(self, items: Iterable, validate: bool = True) -> bytes:
+        """JSON array of items; validate=False for trusted dicts already in the schema's shape"""
+        if not validate:
+            return dumps(list(items))
+        return self.adapter.dump_json(self.validate(items))
+
+    def response(self, items: Iterable, validate: bool = True,
+                 headers: Optional[Mapping[str, str]] = None) -> Response:
+        return Response(content=self.dump(items, validate), media_type="application/json", headers=headers)
+
+
+# Shared by every endpoint that returns a list of services
+service_list = ListSerializer(ServiceSchema)
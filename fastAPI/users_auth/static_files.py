@@ -0,0 +1,174 @@
+import hashlib
+import os
+import stat
+import threading
+from collections import OrderedDict
+from mimetypes import guess_type
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+# Content-addressed uploads never change, everything else may be replaced in place
+IMMUTABLE_PREFIX = "uploads/cas/"
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "3600"))
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# "" serves bytes from Python; "x-accel-redirect" (nginx) or "x-sendfile"
+# (Apache/lighttpd) hand the file to the front proxy, which uses sendfile
+STATIC_OFFLOAD = os.getenv("STATIC_OFFLOAD", "").lower()
+# nginx `internal` location that maps to the static directory
+STATIC_ACCEL_PREFIX = os.getenv("STATIC_ACCEL_PREFIX", "/_protected_static/")
+
+# Precompressed siblings in order of preference
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+COMPRESSIBLE_EXTENSIONS = (".svg", ".css", ".js", ".json", ".txt", ".html", ".xml")
+
+_HASH_CACHE_SIZE = 4096
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles with content-hash ETags, long-lived caching and precompressed siblings"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._hashes = OrderedDict()  # (path, mtime_ns, size) -> sha256 hex
+        self._hashes_lock = threading.Lock()
+        self._siblings = OrderedDict()  # (path, mtime_ns, size) -> [(encoding, path, stat)]
+
+    def _hash_key(self, full_path, stat_result):
+        return full_path, stat_result.st_mtime_ns, stat_result.st_size
+
+    def _content_hash(self, full_path, stat_result):
+        """sha256 of the file; CAS files carry it in their name, others are hashed once"""
+        name = os.path.basename(full_path)
+        if self._is_immutable(full_path):
+            return name.split(".", 1)[0]
+        key = self._hash_key(full_path, stat_result)
+        with self._hashes_lock:
+            digest = self._hashes.get(key)
+        if digest is None:
+            digest = hashlib.sha256()
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            digest = digest.hexdigest()
+            with self._hashes_lock:
+                self._hashes[key] = digest
+                if len(self._hashes) > _HASH_CACHE_SIZE:
+                    self._hashes.popitem(last=False)
+        return digest
+
+    def _relative(self, full_path):
+        return os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+
+    def _is_immutable(self, full_path):
+        return self._relative(full_path).startswith(IMMUTABLE_PREFIX)
+
+    def lookup_path(self, path):
+        # Runs in a worker thread, so hashing and sibling stats here keep file_response non-blocking
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            self._content_hash(full_path, stat_result)
+            self._find_siblings(full_path, stat_result)
+        return full_path, stat_result
+
+    def _find_siblings(self, full_path, stat_result):
+        """Precompressed siblings that exist, in ENCODINGS order; remembered per file version"""
+        if not full_path.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        siblings = []
+        for encoding, suffix in ENCODINGS:
+            candidate = full_path + suffix
+            try:
+                siblings.append((encoding, candidate, os.stat(candidate)))
+            except OSError:
+                continue
+        with self._hashes_lock:
+            self._siblings[self._hash_key(full_path, stat_result)] = siblings
+            if len(self._siblings) > _HASH_CACHE_SIZE:
+                self._siblings.popitem(last=False)
+
+    def _precompressed(self, full_path, stat_result, request_headers):
+        """Sibling to serve instead, from what lookup_path found; no filesystem access here"""
+        if "range" in request_headers:
+            return None
+        with self._hashes_lock:
+            siblings = self._siblings.get(self._hash_key(full_path, stat_result), ())
+        accepted = request_headers.get("accept-encoding", "")
+        for encoding, candidate, candidate_stat in siblings:
+            if encoding in accepted:
+                return encoding, candidate, candidate_stat
+        return None
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        request_headers = Headers(scope=scope)
+        full_path = os.fspath(full_path)
+        etag = self._content_hash(full_path, stat_result)
+        headers = {
+            "cache-control": IMMUTABLE_CACHE_CONTROL if self._is_immutable(full_path)
+            else f"public, max-age={STATIC_MAX_AGE}",
+            "vary": "Accept-Encoding",
+        }
+        media_type = guess_type(full_path)[0] or "application/octet-stream"
+
+        serve_path = full_path
+        precompressed = self._precompressed(full_path, stat_result, request_headers)
+        if precompressed is not None:
+            encoding, serve_path, stat_result = precompressed
+            headers["content-encoding"] = encoding
+            etag = f"{etag}-{encoding}"
+        headers["etag"] = f'"{etag}"'
+
+        if STATIC_OFFLOAD in ("x-accel-redirect", "x-sendfile"):
+            response = Response(status_code=status_code, headers=headers, media_type=media_type)
+            if STATIC_OFFLOAD == "x-accel-redirect":
+                response.headers["x-accel-redirect"] = STATIC_ACCEL_PREFIX + self._relative(serve_path)
+            else:
+                response.headers["x-sendfile"] = os.path.abspath(serve_path)
+        else:
+            response = FileResponse(
+                serve_path, status_code=status_code, headers=headers,
+                media_type=media_type, stat_result=stat_result,
+            )
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def precompress(directory: str = "static") -> int:
+    """Write .gz (and .br when brotli is installed) siblings for compressible files"""
+    import gzip
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    written = 0
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            outputs = [(".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                outputs.append((".br", lambda d: brotli.compress(d, quality=11)))
+            for suffix, compress in outputs:
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                compressed = compress(data)
+                if len(compressed) < len(data):
+                    with open(target, "wb") as f:
+                        f.write(compressed)
+                    written += 1
+    return written
+
+
+if __name__ == "__main__":
+    print(f"Wrote {precompress()} precompressed files")
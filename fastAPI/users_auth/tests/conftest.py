@@ -0,0 +1,36 @@
+"""Tests run against a throwaway SQLite database
+
+The environment is set before any app module is imported, since database.py,
+recommendation.py and query_budget.py read it at import time.
+
+    cd fastAPI/users_auth && python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(prefix="homehelp-tests-"), "test.db")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_PATH}"
+os.environ["QUERY_BUDGET_MODE"] = "strict"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from database import Base, SessionLocal, engine  # noqa: E402
+from search import ensure_search_schema  # noqa: E402
+
+
+@pytest.fixture()
+def db():
+    """A session on freshly created tables"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS services_fts")
+    ensure_search_schema(engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
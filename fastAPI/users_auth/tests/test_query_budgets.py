@@ -0,0 +1,116 @@
+"""SQL statement budgets of the admin endpoints, checked in QUERY_BUDGET_MODE=strict
+
+Seeds more rows than any budget allows, so a per-row lazy load in these
+endpoints fails the test instead of passing on a near-empty table.
+"""
+import asyncio
+import uuid
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+from auth import get_current_super_admin, require_admin
+from database import SessionLocal
+from models import Admin, Booking, HomeOwner, Report, Service, ServiceProvider, User, UserRole
+from query_budget import QUERY_BUDGET_MODE, QueryBudgetExceeded, assert_query_budget, fingerprint
+from schemas import SuspendProvider
+
+import main
+
+ROWS = 8  # above QUERY_REPEAT_LIMIT, so an N+1 over them is caught
+
+
+def add_user(db, role, name):
+    user = User(id=uuid.uuid4(), email=f"{name}-{uuid.uuid4().hex[:8]}@example.com", password_hash="x",
+                full_name=name, role=role)
+    db.add(user)
+    return user
+
+
+@pytest.fixture()
+def seeded(db):
+    for i in range(ROWS):
+        db.add(Admin(id=uuid.uuid4(), user_id=add_user(db, UserRole.ADMIN.value, f"admin{i}").id,
+                     is_super_admin=i == 0))
+    homeowner_user = add_user(db, UserRole.HOMEOWNERS.value, "homeowner")
+    homeowner = HomeOwner(id=uuid.uuid4(), user_id=homeowner_user.id)
+    providers = []
+    for i in range(ROWS):
+        user = add_user(db, UserRole.SERVICEPROVIDERS.value, f"provider{i}")
+        provider = ServiceProvider(id=uuid.uuid4(), user_id=user.id, business_name=f"Provider {i}",
+                                   service_name="plumbing", is_verified=True, years_experience=i)
+        providers.append((user, provider))
+    db.add(homeowner)
+    db.add_all(provider for _, provider in providers)
+
+    user, provider = providers[0]
+    services = [
+        Service(id=uuid.uuid4(), provider_id=provider.id, title=f"Plumbing job {i}", price=300,
+                provider_name=provider.business_name, is_active=True)
+        for i in range(ROWS)
+    ]
+    db.add_all(services)
+    db.add_all(
+        Booking(id=uuid.uuid4(), service_id=service.id, homeowner_id=homeowner.id, provider_id=provider.id,
+                scheduled_date=date(2026, 11, 1), scheduled_time="09:00", status="pending", price=300)
+        for service in services
+    )
+    report = Report(id=uuid.uuid4(), homeowner_id=homeowner_user.id, provider_id=user.id, title="No show",
+                    description="Did not come", service_title=services[0].title,
+                    provider_name=provider.business_name, homeowner_name=homeowner_user.full_name)
+    db.add(report)
+    db.commit()
+    return {"report_id": report.id}
+
+
+@pytest.fixture()
+def client():
+    main.app.dependency_overrides[get_current_super_admin] = lambda: None
+    main.app.dependency_overrides[require_admin] = lambda: None
+    try:
+        yield TestClient(main.app)
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+def test_strict_mode():
+    # Otherwise the middleware only logs and the endpoint tests below prove nothing
+    assert QUERY_BUDGET_MODE == "strict"
+
+
+def test_admins_within_budget(seeded, client):
+    response = client.get("/admins")
+    assert response.status_code == 200
+    assert len(response.json()) == ROWS
+
+
+def test_providers_within_budget(seeded, client):
+    response = client.get("/providers", params={"limit": ROWS})
+    assert response.status_code == 200
+    assert len(response.json()) == ROWS
+
+
+def test_suspend_within_budget(seeded):
+    # Called directly: on SQLite the route's string report_id does not bind to the UUID column.
+    # A fresh session, so nothing the seeding loaded is answered from its identity map
+    db = SessionLocal()
+    try:
+        admin = db.query(User).filter(User.role == UserRole.ADMIN.value).first()
+        admin.role = "admin"
+        with assert_query_budget(main.suspend_provider.query_budget.statements, label="suspend_provider"):
+            result = asyncio.run(main.suspend_provider(seeded["report_id"], SuspendProvider(), db, admin))
+    finally:
+        db.close()
+    assert result["cancelled_bookings"] == ROWS
+
+
+def test_n_plus_one_names_the_statement(seeded, db):
+    with pytest.raises(QueryBudgetExceeded) as excinfo:
+        with assert_query_budget(label="lazy providers") as profile:
+            for provider in db.query(ServiceProvider).all():
+                provider.user.email
+    shape = fingerprint(profile.statements[-1]["sql"])
+    assert "FROM users" in shape
+    assert f"{ROWS}x" in str(excinfo.value)
+    assert shape in str(excinfo.value)
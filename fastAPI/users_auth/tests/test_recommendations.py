@@ -0,0 +1,84 @@
+import uuid
+
+import pytest
+
+from geo import provider_locations
+from models import Service, ServiceProvider, User, UserRole
+from recommendation import RecommendationAgent, budget_bucket, parse_budget, recommendation_cache
+
+
+def add_provider(db, years_experience, prices, title="Plumbing repair"):
+    user = User(id=uuid.uuid4(), email=f"{uuid.uuid4().hex}@example.com", password_hash="x",
+                full_name="Test Provider", role=UserRole.SERVICEPROVIDERS.value)
+    provider = ServiceProvider(id=uuid.uuid4(), user_id=user.id, business_name="Pipes",
+                               service_name="plumbing", address="Bole", years_experience=years_experience)
+    db.add_all([user, provider])
+    db.add_all([
+        Service(id=uuid.uuid4(), provider_id=provider.id, title=title, description="Leaks, taps and pipes",
+                price=price, provider_name="Pipes", is_active=True)
+        for price in prices
+    ])
+    db.commit()
+    provider_locations.refresh(db)  # not the background reload, which may still hold the last test's grid
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    recommendation_cache._entries.clear()
+    yield
+    recommendation_cache._entries.clear()
+
+
+def test_budget_bucket_rounds_up():
+    assert budget_bucket(501) == 510
+    assert budget_bucket(1499) == 1500
+    assert budget_bucket(None) is None
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("need a plumber within 2 days", (None, False)),
+    ("electrician up to 3 hours of work", (None, False)),
+    ("plumber under $500", (500.0, False)),
+    ("plumber budget is 1,500 birr", (1500.0, False)),
+    ("plumber for 2k in Bole", (2000.0, False)),
+    ("fix my 2 taps, under 300 birr", (300.0, False)),
+    ("plumber max 500", (None, True)),
+    ("plumber at $20 an hour", (None, True)),
+    ("plumber under 500 or 600 birr", (None, True)),
+])
+def test_parse_budget(message, expected):
+    assert parse_budget(message) == expected
+
+
+def test_top_of_bucket_above_budget_still_fills_top_k(db):
+    # Budget 501 ranks bucket 510, whose best four are all priced 502-510
+    add_provider(db, 30, [502, 505, 508, 510])
+    add_provider(db, 1, [300, 400, 450])
+    agent = RecommendationAgent(db)
+
+    for _ in range(2):  # computed, then from the cache
+        results = agent.recommend("plumbing", max_budget=501, top_k=2)
+        assert len(results) == 2
+        assert all(r.price <= 501 for r in results)
+
+
+
+@pytest.mark.parametrize("search_candidates", [200, 3])
+def test_batch_matches_single(db, monkeypatch, search_candidates):
+    monkeypatch.setattr("recommendation.SEARCH_CANDIDATES", search_candidates)
+    add_provider(db, 30, [502, 505, 508, 510])
+    add_provider(db, 12, [120, 480, 950])
+    add_provider(db, 1, [300, 400, 450, 1200])
+    add_provider(db, 8, [250, 700], title="Electrical wiring")
+    requests = [
+        {"job_type": "plumbing", "max_budget": budget, "location": location, "urgency": None}
+        for budget in (None, 300, 450, 501, 510, 1000) for location in (None, "Bole")
+    ] + [{"job_type": "electrical", "max_budget": 600}, {"job_type": None}]
+    agent = RecommendationAgent(db)
+
+    batch = dict(agent.recommend_batch(requests, top_k=3))
+    recommendation_cache._entries.clear()
+    for position, params in enumerate(requests):
+        single = agent.recommend(params["job_type"], params.get("max_budget"), params.get("location"),
+                                 top_k=3) if params["job_type"] else []
+        assert batch[position] == single, params
@@ -0,0 +1,276 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Dict
+from uuid import UUID
+
+from fastapi import HTTPException, status
+from jose import JWTError, jwt
+from sqlalchemy import or_
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "mysecret")
+ALGORITHM = "HS256"
+
+# Decoded tokens kept in memory, keyed by sha256 of the raw token
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# How often each worker reloads revoked token versions from the database
+REVOCATION_REFRESH_SECONDS = float(os.getenv("REVOCATION_REFRESH_SECONDS", "30"))
+# After a failed reload, wait this long before the next attempt
+REVOCATION_RETRY_SECONDS = float(os.getenv("REVOCATION_RETRY_SECONDS", "5"))
+# How long a request waits for the worker's first load before checking without it
+REVOCATION_READY_TIMEOUT = float(os.getenv("REVOCATION_READY_TIMEOUT", "5"))
+# This worker's own revocations are re-applied over reloads for this long, so a
+# reload whose query ran before the revoking transaction committed can't undo them
+REVOCATION_GRACE_SECONDS = float(os.getenv("REVOCATION_GRACE_SECONDS", "120"))
+
+TOKEN_CACHE = metrics.counter("token_cache_total", "Token verifications by cache outcome")
+TOKEN_REVOKED = metrics.counter("token_revoked_total", "Requests rejected by the revocation list")
+
+
+@dataclass(frozen=True)
+class TokenClaims:
+    sub: str
+    exp: float
+    role: Optional[str] = None
+    user_id: Optional[str] = None
+    provider_id: Optional[str] = None
+    homeowner_id: Optional[str] = None
+    is_super_admin: bool = False
+    is_pending: bool = False
+    version: int = 0
+
+
+def create_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    to_encode = data.copy()
+
+    # Convert UUIDs to strings
+    for key, value in to_encode.items():
+        if isinstance(value, UUID):
+            to_encode[key] = str(value)
+
+    # Set expiration time
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(minutes=15)
+
+    to_encode.update({"exp": expire})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def user_claims(user, provider_id=None, homeowner_id=None, is_super_admin: bool = False) -> dict:
+    """Claims that let handlers authorize a user without touching the database"""
+    claims = {
+        "sub": user.email,
+        "user_id": str(user.id),
+        "role": user.role.value if hasattr(user.role, "value") else user.role,
+        "ver": user.token_version or 0,
+    }
+    if provider_id:
+        claims["provider_id"] = str(provider_id)
+    if homeowner_id:
+        claims["homeowner_id"] = str(homeowner_id)
+    if is_super_admin:
+        claims["is_super_admin"] = True
+    return claims
+
+
+class BloomFilter:
+    def __init__(self, size_bits: int = 1 << 16, hashes: int = 4):
+        self.size = size_bits
+        self.hashes = hashes
+        self.bits = bytearray(size_bits // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class RevocationList:
+    """Users whose older tokens are no longer valid
+
+    The bloom filter answers "definitely not revoked" for almost every request
+    without a lock or a dict lookup; only users in the filter get the exact
+    token version / inactive check. Reloads run on a background thread so
+    request handling never waits on the query; `ready` is set after the
+    first one.
+    """
+
+    def __init__(self):
+        self.bloom = BloomFilter()
+        self.versions: Dict[str, int] = {}
+        self.inactive = set()
+        self.loaded_at = 0.0
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._local: Dict[str, tuple] = {}  # user id -> (version, inactive, time.monotonic())
+        self._local_lock = threading.Lock()
+
+    def refresh(self, db) -> None:
+        from models import User
+
+        rows = db.query(User.id, User.token_version, User.is_active).filter(
+            or_(User.token_version > 0, User.is_active == False)
+        ).all()
+        bloom, versions, inactive = BloomFilter(), {}, set()
+        for user_id, version, is_active in rows:
+            key = str(user_id)
+            bloom.add(key)
+            versions[key] = version or 0
+            if not is_active:
+                inactive.add(key)
+        with self._local_lock:
+            cutoff = time.monotonic() - REVOCATION_GRACE_SECONDS
+            self._local = {key: entry for key, entry in self._local.items() if entry[2] >= cutoff}
+            for key, (version, is_inactive, _) in self._local.items():
+                bloom.add(key)
+                versions[key] = max(versions.get(key, 0), version)
+                if is_inactive:
+                    inactive.add(key)
+            self.bloom, self.versions, self.inactive = bloom, versions, inactive
+        self.loaded_at = time.monotonic()
+        self.ready.set()
+
+    def _reload(self) -> None:
+        try:
+            from database import SessionLocal
+
+            db = SessionLocal()
+            try:
+                self.refresh(db)
+            finally:
+                db.close()
+        except Exception as e:
+            logger.warning("Could not load revoked tokens: %s", e)
+            # Back off instead of retrying on every request
+            self.loaded_at = time.monotonic() - REVOCATION_REFRESH_SECONDS + REVOCATION_RETRY_SECONDS
+        finally:
+            self._lock.release()
+
+    def refresh_if_stale(self) -> None:
+        if time.monotonic() - self.loaded_at < REVOCATION_REFRESH_SECONDS:
+            return
+        if not self._lock.acquire(blocking=False):
+            return  # another thread is already refreshing
+        threading.Thread(target=self._reload, name="token-revocations", daemon=True).start()
+
+    def revoke(self, user_id, version: int, inactive: bool = False) -> None:
+        key = str(user_id)
+        with self._local_lock:
+            self._local[key] = (version, inactive, time.monotonic())
+            self.bloom.add(key)
+            self.versions[key] = max(self.versions.get(key, 0), version)
+            if inactive:
+                self.inactive.add(key)
+
+    def is_revoked(self, claims: TokenClaims) -> bool:
+        key = claims.user_id
+        if not key or key not in self.bloom:
+            return False
+        if key in self.inactive:
+            return True
+        return claims.version < self.versions.get(key, 0)
+
+
+revocations = RevocationList()
+_token_cache: "OrderedDict[str, TokenClaims]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
+def _claims_from_payload(payload: dict) -> TokenClaims:
+    return TokenClaims(
+        sub=payload.get("sub"),
+        exp=float(payload.get("exp") or 0),
+        role=payload.get("role"),
+        user_id=payload.get("user_id"),
+        provider_id=payload.get("provider_id"),
+        homeowner_id=payload.get("homeowner_id"),
+        is_super_admin=bool(payload.get("is_super_admin", False)),
+        is_pending=bool(payload.get("is_pending", False)),
+        version=int(payload.get("ver") or 0),
+    )
+
+
+def decode_token(token: str) -> TokenClaims:
+    """Verify a bearer token once and serve repeats from the token cache"""
+    if token.startswith('Bearer '):
+        token = token[7:]
+
+    key = hashlib.sha256(token.encode()).hexdigest()
+    claims = _token_cache.get(key)
+    if claims is not None:
+        TOKEN_CACHE.inc(outcome="hit")
+    else:
+        TOKEN_CACHE.inc(outcome="miss")
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError as e:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=f"Invalid token: {str(e)}",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        claims = _claims_from_payload(payload)
+        if not claims.sub:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        with _token_cache_lock:
+            _token_cache[key] = claims
+            if len(_token_cache) > TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+
+    if claims.exp <= time.time():
+        with _token_cache_lock:
+            _token_cache.pop(key, None)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token expired",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    revocations.refresh_if_stale()
+    if revocations.is_revoked(claims):
+        TOKEN_REVOKED.inc()
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return claims
+
+
+def revoke_user_tokens(db, user_id, deactivate: bool = False) -> int:
+    """Invalidate every token issued to a user so far (password change, suspension)
+
+    Bumps users.token_version; other workers pick it up on their next refresh.
+    The caller commits.
+    """
+    from models import User
+
+    db.query(User).filter(User.id == user_id).update(
+        {User.token_version: User.token_version + 1}, synchronize_session=False
+    )
+    version = db.query(User.token_version).filter(User.id == user_id).scalar() or 0
+    revocations.revoke(user_id, version, inactive=deactivate)
+    return version
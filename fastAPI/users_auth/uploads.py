@@ -0,0 +1,234 @@
+import hashlib
+import os
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+from fastapi import HTTPException, UploadFile, status
+
+UPLOAD_DIR = "static/uploads"
+# Content-addressed blobs, named by the SHA-256 of their contents
+CAS_DIR = os.path.join(UPLOAD_DIR, "cas")
+CAS_URL_FRAGMENT = "static/uploads/cas/"
+TMP_DIR = os.path.join(UPLOAD_DIR, "tmp")
+# Unreferenced blobs younger than this survive garbage collection
+GC_GRACE_SECONDS = float(os.getenv("UPLOAD_GC_GRACE_SECONDS", str(24 * 3600)))
+
+# Bytes read from the request per iteration; memory per upload stays at one chunk
+CHUNK_SIZE = 64 * 1024
+
+MAX_DOCUMENT_BYTES = int(os.getenv("MAX_DOCUMENT_BYTES", str(10 * 1024 * 1024)))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
+MAX_AVATAR_BYTES = 2 * 1024 * 1024
+
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp"}
+DOCUMENT_TYPES = IMAGE_TYPES | {"application/pdf"}
+
+_utime = aiofiles.os.wrap(os.utime)
+
+_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "application/pdf": ".pdf",
+}
+
+
+@dataclass
+class StoredUpload:
+    path: str  # filesystem path, e.g. static/uploads/cas/ab/cd/<sha256>.png
+    url: str  # public URL, e.g. /static/uploads/cas/ab/cd/<sha256>.png
+    content_type: str
+    size: int
+    sha256: str
+    deduplicated: bool = False
+
+
+def sniff_content_type(head: bytes) -> Optional[str]:
+    """Detect the file type from its magic bytes rather than trusting the client"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    return None
+
+
+def blob_path(digest: str, ext: str = "") -> str:
+    """Sharded location of a blob: cas/ab/cd/abcd...<ext>
+
+    Two levels of 256 directories keep each directory small even with
+    millions of files.
+    """
+    return os.path.join(CAS_DIR, digest[:2], digest[2:4], f"{digest}{ext}")
+
+
+def path_to_url(path: str) -> str:
+    return "/" + path.replace(os.sep, "/").lstrip("/")
+
+
+async def _stream_to_temp(
+    upload: UploadFile, temp_path: str, max_bytes: int
+) -> Tuple[bytes, int, str]:
+    """Copy the upload to temp_path chunk by chunk; returns (first bytes, size, sha256)"""
+    size = 0
+    head = b""
+    digest = hashlib.sha256()
+    async with aiofiles.open(temp_path, "wb") as out:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"File exceeds the {max_bytes // (1024 * 1024)}MB limit"
+                )
+            if len(head) < 16:
+                head += chunk[:16 - len(head)]
+            digest.update(chunk)
+            await out.write(chunk)
+    return head, size, digest.hexdigest()
+
+
+async def save_upload(
+    upload: UploadFile,
+    max_bytes: int = MAX_DOCUMENT_BYTES,
+    allowed_types: Optional[Iterable[str]] = DOCUMENT_TYPES,
+) -> StoredUpload:
+    """Stream an upload into the content-addressed store
+
+    The SHA-256 is computed while the file is written to a temporary name, so
+    identical uploads end up at the same path and a duplicate only costs the
+    temporary file. Readers never see partial files because blobs are renamed
+    into place once the size and type checks passed.
+    """
+    await aiofiles.os.makedirs(TMP_DIR, exist_ok=True)
+    temp_path = os.path.join(TMP_DIR, f"{uuid.uuid4()}.part")
+
+    try:
+        head, size, digest = await _stream_to_temp(upload, temp_path, max_bytes)
+        content_type = sniff_content_type(head)
+        if allowed_types is not None and content_type not in set(allowed_types):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Unsupported file type"
+            )
+
+        if content_type:
+            file_ext = _EXTENSIONS[content_type]
+        else:
+            file_ext = os.path.splitext(upload.filename or "")[1].lower()
+        final_path = blob_path(digest, file_ext)
+        deduplicated = await aiofiles.os.path.exists(final_path)
+        if deduplicated:
+            await aiofiles.os.remove(temp_path)
+            # Fresh mtime keeps the blob out of a concurrent GC's grace window
+            await _utime(final_path)
+        else:
+            await aiofiles.os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            await aiofiles.os.replace(temp_path, final_path)
+    except BaseException:
+        if await aiofiles.os.path.exists(temp_path):
+            await aiofiles.os.remove(temp_path)
+        raise
+
+    return StoredUpload(
+        path=final_path,
+        url=path_to_url(final_path),
+        content_type=content_type or upload.content_type or "application/octet-stream",
+        size=size,
+        sha256=digest,
+        deduplicated=deduplicated,
+    )
+
+
+def blob_refcounts(db) -> Counter:
+    """Number of rows referencing each blob, keyed by filesystem path
+
+    Image columns store URLs (/static/uploads/...) while document columns
+    store paths (static/uploads/...); both normalise to the same key.
+    """
+    from models import Booking, ProviderRegistrationRequest, Service, ServiceProvider, User
+
+    columns = [
+        User.profile_image,
+        Service.image,
+        ServiceProvider.id_verification,
+        ServiceProvider.certification,
+        ProviderRegistrationRequest.id_verification,
+        ProviderRegistrationRequest.certification,
+        Booking.service_image,
+    ]
+    counts = Counter()
+    for column in columns:
+        for (value,) in db.query(column).filter(column.like(f"%{CAS_URL_FRAGMENT}%")):
+            counts[os.path.normpath(value.lstrip("/"))] += 1
+    return counts
+
+
+def collect_garbage(db, grace_seconds: float = GC_GRACE_SECONDS, dry_run: bool = False) -> dict:
+    """Delete blobs nothing references any more
+
+    Blobs younger than grace_seconds are kept so that a file uploaded by a
+    request that has not committed yet is not collected under it.
+    """
+    referenced = blob_refcounts(db)
+    # Derived files (image variants) are named <sha256>_<variant>.webp and live
+    # as long as their original
+    digests = {os.path.basename(path)[:64] for path in referenced}
+    cutoff = time.time() - grace_seconds
+    stats = {"scanned": 0, "referenced": 0, "removed": 0, "freed_bytes": 0, "kept_recent": 0}
+
+    for root, _dirs, files in os.walk(CAS_DIR):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            stats["scanned"] += 1
+            if referenced.get(path) or name[:64] in digests:
+                stats["referenced"] += 1
+                continue
+            st = os.stat(path)
+            if st.st_mtime > cutoff:
+                stats["kept_recent"] += 1
+                continue
+            stats["removed"] += 1
+            stats["freed_bytes"] += st.st_size
+            if not dry_run:
+                os.remove(path)
+
+    # Temporary files left behind by crashed workers
+    if os.path.isdir(TMP_DIR):
+        for name in os.listdir(TMP_DIR):
+            path = os.path.join(TMP_DIR, name)
+            if os.stat(path).st_mtime < cutoff and not dry_run:
+                os.remove(path)
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Remove unreferenced blobs from the upload store")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--grace-hours", type=float, default=GC_GRACE_SECONDS / 3600)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print(json.dumps(collect_garbage(db, args.grace_hours * 3600, args.dry_run), indent=2))
+    finally:
+        db.close()